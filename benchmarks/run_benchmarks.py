@@ -0,0 +1,200 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import tracemalloc
+import numpy as np
+
+from benchmarks.synthetic_dataset import generate_dataset
+from data_management.data_loader import DataLoader
+from data_management.trial_loader import TrialDataLoader, TrialLabelsLoader
+from data_management.categorical import gait_event_vocabulary
+from normalize_dataset.normalize_dataset import NormalizeDataset
+from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+from normalize_dataset.online_segmenter import OnlineSegmenter
+from clean_dataset.data_cleaner import DataCleaner
+
+
+def reset_peak_rss():
+    """
+    Reset the peak resident set size of the process (Linux only)
+    :return: True if the peak can be measured with peak_rss
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmHWM'):
+                return int(line.split()[1]) * 1024
+
+
+def measure(results, stage, func, items=None, unit='items'):
+    """
+    Run a stage, recording its wall time, its peak memory and its throughput. The peak memory is the peak resident set
+    size of the stage where it can be reset (Linux), otherwise the peak of the memory traced by tracemalloc, which
+    slows down stages with many small allocations.
+    :param items: Number of items processed by the stage, or a function of the output of the stage returning it
+    :return: Output of the stage
+    """
+    rss = reset_peak_rss()
+    if not rss:
+        tracemalloc.start()
+    start = time.perf_counter()
+    output = func()
+    seconds = time.perf_counter() - start
+    if rss:
+        peak = peak_rss()
+    else:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    items = items(output) if callable(items) else items
+    results.append({'stage': stage, 'seconds': seconds, 'items': items, 'unit': unit,
+                    'throughput': items / seconds if items is not None and seconds > 0 else None,
+                    'peak_memory_bytes': peak})
+    print(f"{stage}: {seconds:.3f} s, {items} {unit}", file=sys.stderr)
+
+    return output
+
+
+def run_benchmarks(dataset_path, output_path, subjects, samples=100, gc_key='hs', outlier_method='iForest'):
+    """
+    Time every stage of the pipeline on a dataset in the UH dataset layout
+    :return: List with the measures of every stage
+    """
+    results = list()
+    data_loader = DataLoader(base_path=dataset_path, data_folder='kin_data', labels_folder='labels',
+                             subjects=subjects)
+    files = [(os.path.join(data_loader.data_path, trial), os.path.join(data_loader.labels_path, label))
+             for idx in range(len(subjects)) for trial, label in data_loader.subject_files(idx)]
+    joint_labels = list(data_loader.joints.values())
+
+    # Raw data
+    trials = measure(results, 'mat_decode', lambda: [TrialDataLoader(data_path, modalities={'joint_angle': joint_labels})
+                                                     for data_path, _ in files], items=len(files), unit='trials')
+    lengths = [len(trial.joint_angle('jRightKnee')) for trial in trials]
+    del trials
+    measure(results, 'get_labels', lambda: [TrialLabelsLoader(label_path, length_data=length).get_label_codes()
+                                            for (_, label_path), length in zip(files, lengths)],
+            items=sum(lengths), unit='samples')
+
+    # Normalization
+    normalize_dataset = NormalizeDataset(data_loader=data_loader, gc_key=gc_key, samples=samples,
+                                         path=os.path.join(output_path, 'normalized_dataset'))
+    subjects_data = [normalize_dataset.remove_nones(data_loader.get_subject(idx, encoded=True))
+                     for idx in range(len(subjects))]
+
+    def segment():
+        strides = list()
+        for subject_data in subjects_data:
+            for joint in data_loader.joints.keys():
+                gc_key_code = gait_event_vocabulary.code(f"{joint[0].lower()}{gc_key}")
+                stride_idx = normalize_dataset.get_stride_idx(gc_event_label=subject_data['Labels'][:, 1],
+                                                              gc_key=gc_key_code)
+                strides.append((normalize_dataset.normalize_per_gc(stride_idx, subject_data[joint][:, 2]),
+                                normalize_dataset.stride_labels(stride_idx, subject_data['Labels'][:, 0])))
+        return strides
+    strides = measure(results, 'stride_segmentation', segment,
+                      items=lambda output: sum(len(joint_labels) for _, joint_labels in output), unit='strides')
+
+    interpolated = measure(results, 'interpolation',
+                           lambda: [normalize_dataset.interpolate_data(joint_strides) for joint_strides, _ in strides],
+                           items=sum(len(joint_labels) for _, joint_labels in strides), unit='strides')
+
+    # Live segmentation, one sample at a time. The latency of a stride is the time from pushing its closing heel strike
+    # to getting it back normalized.
+    def segment_online():
+        latencies = list()
+        for subject_data in subjects_data:
+            for joint in data_loader.joints.keys():
+                segmenter = OnlineSegmenter(side=joint.split('_')[0], gc_key=gc_key, samples=samples)
+                values, labels = subject_data[joint][:, 2], subject_data['Labels']
+                for i in range(len(labels)):
+                    start = time.perf_counter()
+                    strides = segmenter.push(values[i], labels[i])
+                    if len(strides) > 0:
+                        latencies.append(time.perf_counter() - start)
+        return latencies
+    latencies = measure(results, 'online_segmentation', segment_online, items=len, unit='strides')
+    results[-1].update({f"latency_p{percentile}": float(np.percentile(latencies, percentile))
+                        if len(latencies) > 0 else None for percentile in [50, 90, 99]})
+
+    def save():
+        i = 0
+        for subject_idx in range(len(subjects)):
+            for joint in data_loader.joints.keys():
+                labelled = normalize_dataset.label_strides_data(stride_data=interpolated[i],
+                                                                stride_labels=strides[i][1])
+                normalize_dataset.save_files(data=labelled, subject=normalize_dataset.subject_name(subject_idx),
+                                             joint=joint)
+                i += 1
+    measure(results, 'save', save, items=sum(len(joint_strides) for joint_strides in interpolated), unit='strides')
+
+    # Cleaning
+    normalized_data_loader = NormalizedDataLoader(dataset_path=normalize_dataset.path)
+    data_cleaner = DataCleaner(base_path=normalize_dataset.path, data_loader=normalized_data_loader,
+                               outlier_method=outlier_method)
+    data, labels = data_cleaner.get_all_data(subjects=normalized_data_loader.subjects())
+    outliers_idx = measure(results, 'outlier_detection', lambda: data_cleaner.detect_outliers(data=data, labels=labels),
+                           items=len(data), unit='strides')
+    measure(results, 'structure_data',
+            lambda: data_cleaner.structure_data(data=np.delete(data, outliers_idx, axis=0),
+                                                labels=np.delete(labels, outliers_idx, axis=0),
+                                                vocabularies=normalized_data_loader.vocabularies()),
+            items=len(data) - len(outliers_idx), unit='strides')
+
+    return results
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline on a synthetic or existing UH dataset")
+    parser.add_argument('--dataset', default=None, help="Existing dataset, a synthetic one is generated if not given")
+    parser.add_argument('--subjects', type=int, default=3)
+    parser.add_argument('--trials', type=int, default=3)
+    parser.add_argument('--trial-time', type=float, default=60)
+    parser.add_argument('--sample-rate', type=int, default=60)
+    parser.add_argument('--stride-time', type=float, default=1.1)
+    parser.add_argument('--samples', type=int, default=100)
+    parser.add_argument('--outlier-method', default='iForest')
+    parser.add_argument('--output', default=None, help="JSON file for the results, printed to stdout if not given")
+    args = parser.parse_args(arguments)
+
+    work_path = tempfile.mkdtemp(prefix='houston_benchmark_')
+    try:
+        config = vars(args).copy()
+        if args.dataset is None:
+            dataset_path = os.path.join(work_path, 'dataset')
+            subjects = generate_dataset(base_path=dataset_path, subjects=args.subjects, trials=args.trials,
+                                        trial_time=args.trial_time, sample_rate=args.sample_rate,
+                                        stride_time=args.stride_time)
+        else:
+            dataset_path = args.dataset
+            subjects = sorted({file.split('T')[0] for file in os.listdir(os.path.join(dataset_path, 'kin_data'))})
+
+        stages = run_benchmarks(dataset_path=dataset_path, output_path=work_path, subjects=subjects,
+                                samples=args.samples, outlier_method=args.outlier_method)
+    finally:
+        shutil.rmtree(work_path, ignore_errors=True)
+
+    report = json.dumps({'config': config, 'stages': stages}, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(report)
+
+    return stages
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+import os
+import argparse
+import numpy as np
+
+from scipy.io import savemat
+
+from data_management.trial_loader import event_labels
+
+segment_labels = ['Pelvis', 'L5', 'L3', 'T12', 'T8', 'Neck', 'Head', 'RightShoulder', 'RightUpperArm', 'RightForeArm',
+                  'RightHand', 'LeftShoulder', 'LeftUpperArm', 'LeftForeArm', 'LeftHand', 'RightUpperLeg',
+                  'RightLowerLeg', 'RightFoot', 'RightToe', 'LeftUpperLeg', 'LeftLowerLeg', 'LeftFoot', 'LeftToe']
+sensor_labels = ['Pelvis', 'T8', 'Head', 'RightShoulder', 'RightUpperArm', 'RightForeArm', 'RightHand', 'LeftShoulder',
+                 'LeftUpperArm', 'LeftForeArm', 'LeftHand', 'RightUpperLeg', 'RightLowerLeg', 'RightFoot',
+                 'LeftUpperLeg', 'LeftLowerLeg', 'LeftFoot']
+joint_labels = ['jL5S1', 'jL4L3', 'jL1T12', 'jT9T8', 'jT1C7', 'jC1Head', 'jRightT4Shoulder', 'jRightShoulder',
+                'jRightElbow', 'jRightWrist', 'jLeftT4Shoulder', 'jLeftShoulder', 'jLeftElbow', 'jLeftWrist',
+                'jRightHip', 'jRightKnee', 'jRightAnkle', 'jRightBallFoot', 'jLeftHip', 'jLeftKnee', 'jLeftAnkle',
+                'jLeftBallFoot']
+terrain_events = [event for event in event_labels.keys() if event != 'None']
+
+
+def label_cell(labels):
+    """
+    :return: N×1 MATLAB cell array of strings
+    """
+    cell = np.empty((len(labels), 1), dtype=object)
+    for i, label in enumerate(labels):
+        cell[i, 0] = np.array([label])
+
+    return cell
+
+
+def data_cell(arrays):
+    """
+    :return: 1×1 MATLAB cell array holding the labels×N×M matrix of a modality
+    """
+    cell = np.empty((1, 1), dtype=object)
+    cell[0, 0] = np.stack(arrays)
+
+    return cell
+
+
+def gait_cycles(length, sample_rate, rng, stride_time=1.1, gap_probability=0.1):
+    """
+    Gait cycle events of a trial: every row is [rhs, lto, lhs, rto, rhs] and consecutive cycles share the closing
+    heel strike, except after a gap of unlabeled samples
+    :param stride_time: Mean duration of a stride (s), the inverse of the event density
+    :param gap_probability: Probability of a gap of unlabeled samples after each cycle
+    """
+    index, labels = list(), list()
+    position = int(rng.integers(1, max(2, sample_rate)))
+    event = rng.choice(terrain_events)
+    while True:
+        stride = max(8, int(rng.normal(stride_time, 0.1 * stride_time) * sample_rate))
+        if position + stride >= length:
+            break
+        phases = np.round(np.array([0, 0.1, 0.5, 0.6, 1]) * stride).astype(int) + position
+        index.append(phases)
+        # Terrains change every few strides
+        if rng.random() < 0.2:
+            event = rng.choice(terrain_events)
+        labels.append(event)
+
+        position += stride
+        if rng.random() < gap_probability:
+            position += int(rng.integers(2, max(3, sample_rate)))
+
+    return np.array(index, dtype=np.int32).reshape(-1, 5), labels
+
+
+def write_trial(kin_path, gc_path, length, sample_rate, rng, stride_time=1.1, gap_probability=0.1):
+    """
+    Write the kin and gc .mat files of a trial with the structure read by TrialDataLoader and TrialLabelsLoader
+    """
+    t = np.arange(length) / sample_rate
+
+    def modality(labels, columns=3):
+        return data_cell([30 * np.sin(2 * np.pi * t / stride_time + rng.uniform(0, 2 * np.pi))[:, None] +
+                          rng.normal(scale=2, size=(length, columns)) for _ in labels])
+
+    setup = {'segmentLabel': label_cell(segment_labels),
+             'sensorLabel': label_cell(sensor_labels),
+             'jointLabel': label_cell(joint_labels),
+             'numTrials': np.array([[1]])}
+    data = {'jointAngle': modality(joint_labels),
+            'acceleration': modality(segment_labels),
+            'velocity': modality(segment_labels),
+            'position': modality(segment_labels),
+            'orientationQuaternion': modality(segment_labels, columns=4),
+            'orientationEuler': modality(segment_labels),
+            'angularAcceleration': modality(segment_labels),
+            'angularVelocity': modality(segment_labels),
+            'sensorAcceleration': modality(sensor_labels),
+            'sensorOrientation': modality(sensor_labels, columns=4),
+            'sensorAngularVelocity': modality(sensor_labels)}
+    savemat(kin_path, {'kin': {'setup': setup, 'data': data, 'sampleRate': np.array([[sample_rate]])}})
+
+    index, labels = gait_cycles(length=length, sample_rate=sample_rate, rng=rng, stride_time=stride_time,
+                                gap_probability=gap_probability)
+    savemat(gc_path, {'gc': {'label': label_cell(labels), 'index': index, 'time': index / sample_rate}})
+
+
+def generate_dataset(base_path, subjects=3, trials=3, trial_time=60, sample_rate=60, stride_time=1.1,
+                     gap_probability=0.1, seed=0):
+    """
+    Write a synthetic dataset in the layout of the UH dataset: <base_path>/kin_data/AB##T##.mat and
+    <base_path>/labels/AB##-T##-gc.mat
+    :param trial_time: Duration of every trial (s)
+    :return: List with the subject names
+    """
+    rng = np.random.default_rng(seed)
+    for folder in ['kin_data', 'labels']:
+        os.makedirs(os.path.join(base_path, folder), exist_ok=True)
+
+    subject_names = [f"AB{str(subject + 1).zfill(2)}" for subject in range(subjects)]
+    for subject in subject_names:
+        for trial in range(1, trials + 1):
+            write_trial(kin_path=os.path.join(base_path, 'kin_data', f"{subject}T{str(trial).zfill(2)}.mat"),
+                        gc_path=os.path.join(base_path, 'labels', f"{subject}-T{str(trial).zfill(2)}-gc.mat"),
+                        length=int(trial_time * sample_rate), sample_rate=sample_rate, rng=rng,
+                        stride_time=stride_time, gap_probability=gap_probability)
+
+    return subject_names
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic dataset in the UH dataset format")
+    parser.add_argument('base_path')
+    parser.add_argument('--subjects', type=int, default=3)
+    parser.add_argument('--trials', type=int, default=3)
+    parser.add_argument('--trial-time', type=float, default=60, help="Duration of every trial (s)")
+    parser.add_argument('--sample-rate', type=int, default=60)
+    parser.add_argument('--stride-time', type=float, default=1.1, help="Mean duration of a stride (s)")
+    parser.add_argument('--gap-probability', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate_dataset(base_path=args.base_path, subjects=args.subjects, trials=args.trials, trial_time=args.trial_time,
+                     sample_rate=args.sample_rate, stride_time=args.stride_time,
+                     gap_probability=args.gap_probability, seed=args.seed)
@@ -1,69 +1,170 @@
 import os
 import numpy as np
 
+from concurrent.futures import ProcessPoolExecutor
 from clean_dataset.outlier_detector import OutlierDetector
+from clean_dataset.outlier_models import OutlierModels
+from data_management.instrumentation import Instrumentation
+from data_management.manifest import Manifest
+from normalize_dataset.catalog import Catalog
+from normalize_dataset.dataset_store import DatasetStore, DatasetStoreWriter
+from normalize_dataset.precision import check_precision, encode
 
 
 class DataCleaner:
-    def __init__(self, base_path, data_loader, outlier_method='MCD'):
+    def __init__(self, base_path, data_loader, outlier_method='MCD', workers=1, instrumentation=None,
+                 models_path=None, refit_models=False, drift_threshold=0.1, max_fit_strides=None, reduction=None,
+                 components=20, precision=None, compression=None):
+        """
+        :param workers: Number of processes fitting the outlier models of the (joint, activity) groups in parallel
+        :param instrumentation: Optional Instrumentation recording a span per stage of the run and per (joint, activity)
+         group, with the strides and outliers of each
+        :param models_path: Optional folder where the outlier model of every group is saved after fitting it once, the
+         next runs score the strides with the saved models instead of refitting them (see OutlierModels)
+        :param refit_models: Refit and save the models of all the groups cleaned
+        :param drift_threshold: Refit the model of a group when the outlier rate of its strides exceeds the training
+         rate of the model by more than this
+        :param max_fit_strides: Approximate the outliers of groups with more strides than this, fitting the model on a
+         subsample stratified by subject (see OutlierDetector)
+        :param reduction: None, 'pca' or 'downsample' representation of the strides in the approximate detection
+        :param components: Number of components, or samples per stride, of the reduction
+        :param precision: None to save the clean strides as they are read, or 'float32', 'float16' or 'int16' (store
+         only), see encode
+        :param compression: None or 'zlib' compression of the store entries
+        """
         self.base_path = base_path
         self.data_loader = data_loader
-        self.outlier_detector = OutlierDetector(method=outlier_method)
+        self.outlier_method = outlier_method
+        self.instrumentation = Instrumentation(enabled=False) if instrumentation is None else instrumentation
+        self.outlier_detector = OutlierDetector(method=outlier_method, instrumentation=self.instrumentation,
+                                                max_fit_strides=max_fit_strides, reduction=reduction,
+                                                components=components)
+        self.workers = workers
+        self.outlier_models = None
+        if models_path is not None:
+            self.outlier_models = OutlierModels(path=models_path, method=outlier_method,
+                                                drift_threshold=drift_threshold, instrumentation=self.instrumentation)
+        self.refit_models = refit_models
+        self.precision = precision
+        self.compression = compression
+        self.max_error = 0.
 
     def get_all_data(self, subjects):
         print("Collecting all data...")
         all_data, all_labels = list(), list()
 
         for subject in subjects:
-            joints = os.listdir(os.path.join(self.base_path, subject))
-            for joint in joints:
-                activities = os.listdir(os.path.join(self.base_path, subject, joint))
-                for activity in activities:
-                    data, labels = self.data_loader.get_data(subject=subject, joint=joint,
-                                                             activity=str(activity).split('.')[0])
-                    all_data.append(data)
-                    all_labels.append(labels)
+            with self.instrumentation.span('collect', subject=subject) as span:
+                joints = self.data_loader.joints(subject)
+                for joint in joints:
+                    activities = self.data_loader.activities(subject, joint)
+                    for activity in activities:
+                        data, labels = self.data_loader.get_data(subject=subject, joint=joint, activity=activity,
+                                                                 encoded=True)
+                        all_data.append(data)
+                        all_labels.append(labels)
+                        span.add(strides=len(data))
 
         all_data, all_labels = np.vstack(all_data), np.vstack(all_labels)
 
         return all_data, all_labels
 
+    @staticmethod
+    def group_index(labels):
+        """
+        Group the rows by (joint, activity) with a single stable sort of the group codes
+        :return: List of (joint, activity) groups, ordered by joint and activity, and the sorted row indices of each one
+        """
+        joints, joint_codes = np.unique(labels[:, 1], return_inverse=True)
+        activities, activity_codes = np.unique(labels[:, 2], return_inverse=True)
+        codes = joint_codes.reshape(-1) * len(activities) + activity_codes.reshape(-1)
+
+        order = np.argsort(codes, kind='stable')
+        group_codes, starts = np.unique(codes[order], return_index=True)
+        stops = np.append(starts[1:], len(order))
+        groups = [(joints[code // len(activities)], activities[code % len(activities)]) for code in group_codes]
+
+        return groups, [order[start:stop] for start, stop in zip(starts, stops)]
+
     def detect_outliers(self, data, labels):
         print("Detecting outliers...")
-        unique_joints = np.unique(labels[:, 1])
-        unique_activities = np.unique(labels[:, 2])
+        with self.instrumentation.span('detect_outliers') as span:
+            groups, groups_idx = self.group_index(labels)
+            if np.issubdtype(labels.dtype, np.integer):
+                _, joint_vocabulary, activity_vocabulary = self.data_loader.vocabularies()
+                groups = [(joint_vocabulary.labels[joint], activity_vocabulary.labels[activity])
+                          for joint, activity in groups]
+            groups = [group for group, data_idx in zip(groups, groups_idx) if len(data_idx) > 5]
+            groups_idx = [data_idx for data_idx in groups_idx if len(data_idx) > 5]
+
+            if self.workers > 1:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    outliers_detected = list()
+                    for outlier_detected, spans in executor.map(self.detect_group_outliers_entry, groups,
+                                                                [data[data_idx] for data_idx in groups_idx],
+                                                                [labels[data_idx, 0] for data_idx in groups_idx]):
+                        self.instrumentation.merge(spans)
+                        outliers_detected.append(outlier_detected)
+            else:
+                outliers_detected = [self.detect_group_outliers(group=group, x=data[data_idx],
+                                                                strata=labels[data_idx, 0])
+                                     for group, data_idx in zip(groups, groups_idx)]
 
-        outliers_idx = list()
-        for joint in unique_joints:
-            for activity in unique_activities:
-                data_ts = [data for i, data in enumerate(data) if joint == labels[i, 1] and
-                           activity == labels[i, 2]]
-                data_idx = [i for i, _ in enumerate(data) if
-                            joint == labels[i, 1] and activity == labels[i, 2]]
+            outliers_idx = [data_idx[np.asarray(outlier_detected, dtype=int)] for data_idx, outlier_detected in
+                            zip(groups_idx, outliers_detected)]
+            outliers_idx = np.concatenate(outliers_idx) if len(outliers_idx) > 0 else np.array(list(), dtype=int)
+            span.add(strides=len(data), groups=len(groups), outliers=len(outliers_idx))
 
-                if len(data_ts) > 5:
-                    outlier_detected = self.outlier_detector.detect_outliers(x=np.array(data_ts))
-                    outliers_idx.append([data_idx[i] for i in outlier_detected])
+        return outliers_idx
 
-        outliers_idx = np.concatenate(outliers_idx)
+    def detect_group_outliers(self, group, x, strata=None):
+        """
+        :param group: (joint, activity) of the strides
+        :param x: Strides of the group, flattened to a vector each when they are channels×samples matrices
+        :param strata: Subject of every stride
+        :return: Indices of the outliers in x
+        """
+        x = x.reshape(x.shape[0], -1)
+        with self.instrumentation.span('outlier_group', joint=str(group[0]), activity=str(group[1])) as span:
+            if self.outlier_models is not None:
+                outliers_idx = self.outlier_models.detect_outliers(joint=str(group[0]), activity=str(group[1]), x=x,
+                                                                   refit=self.refit_models)
+            else:
+                outliers_idx = self.outlier_detector.detect_outliers(x=x, strata=strata)
+            span.add(strides=x.shape[0], outliers=len(outliers_idx))
 
         return outliers_idx
 
+    def detect_group_outliers_entry(self, group, x, strata=None):
+        """
+        Detect the outliers of a group in a worker process
+        :return: Indices of the outliers in x and the spans recorded in the worker
+        """
+        outliers_idx = self.detect_group_outliers(group=group, x=x, strata=strata)
+        return outliers_idx, self.instrumentation.pop_spans()
+
     @staticmethod
-    def structure_data(data, labels):
+    def structure_data(data, labels, vocabularies=None):
+        """
+        :param labels: N×3 array with the [subject, joint, activity] of every row
+        :param vocabularies: (subject, joint, activity) vocabularies to decode the labels when they are codes
+        :return: Dictionary {subject: {joint: {activity: strides}}}
+        """
         print("Structuring data...")
-        subjects, joints, activities = np.unique(labels[:, 0]), np.unique(labels[:, 1]), np.unique(labels[:, 2])
-
-        structured_data = {subject: {joint: {activity: list() for activity in activities} for joint in joints}
-                           for subject in subjects}
+        groups, inverse = np.unique(labels, axis=0, return_inverse=True)
+        order = np.argsort(inverse.reshape(-1), kind='stable')
+        bounds = np.searchsorted(inverse.reshape(-1)[order], np.arange(len(groups) + 1))
+        if vocabularies is not None:
+            groups = [[vocabulary.labels[code] for vocabulary, code in zip(vocabularies, group)] for group in groups]
+        groups = [tuple(str(label) for label in group) for group in groups]
 
-        for data_, label in zip(data, labels):
-            structured_data[label[0]][label[1]][label[2]].append(data_.reshape(1, -1))
+        subjects, joints = sorted({group[0] for group in groups}), sorted({group[1] for group in groups})
+        structured_data = {subject: {joint: dict() for joint in joints} for subject in subjects}
 
-        structured_data = {subject: {joint: {activity: np.concatenate(structured_data[subject][joint][activity])
-                                             for activity in activities
-                                             if len(structured_data[subject][joint][activity]) > 0} for joint in joints}
-                           for subject in subjects}
+        for i in sorted(range(len(groups)), key=lambda group_idx: groups[group_idx]):
+            subject, joint, activity = groups[i]
+            rows = order[bounds[i]:bounds[i + 1]]
+            structured_data[subject][joint][activity] = data[rows]
 
         return structured_data
 
@@ -72,15 +173,35 @@ class DataCleaner:
         outliers_idx = self.detect_outliers(data=all_data, labels=all_labels)
         new_data = np.delete(all_data, outliers_idx, axis=0)
         new_labels = np.delete(all_labels, outliers_idx, axis=0)
-        structured_data = self.structure_data(data=new_data, labels=new_labels)
+        with self.instrumentation.span('structure_data') as span:
+            structured_data = self.structure_data(data=new_data, labels=new_labels,
+                                                  vocabularies=self.data_loader.vocabularies())
+            span.add(strides=len(new_data))
 
         return structured_data
 
     @staticmethod
-    def save(data, base_folder):
+    def save(data, base_folder, storage='directory', precision=None, compression=None):
+        """
+        :param storage: 'directory' to save a <subject>/<joint>/<activity>.npy tree in base_folder, 'store' to save a
+         single store file in base_folder
+        :param precision: Precision of the saved strides, and compression of the store entries (see DataCleaner)
+        :return: Max reconstruction error of the strides saved with a reduced precision
+        """
         print("Saving data...")
+        check_precision(precision=precision, compression=compression, storage=storage)
+        if storage == 'store':
+            with DatasetStoreWriter(base_folder, precision=precision, compression=compression) as writer:
+                for subject, joint_dict in data.items():
+                    for joint, activity_dict in joint_dict.items():
+                        for activity, activity_data in activity_dict.items():
+                            writer.write(subject, joint, activity, activity_data)
+            return writer.max_error()
+
         if not os.path.exists(base_folder):
             os.mkdir(base_folder)
+        catalog = Catalog.read(base_folder)
+        max_error = 0.
 
         for subject, joint_dict in data.items():
             path_lvl_1 = os.path.join(base_folder, subject)
@@ -95,12 +216,276 @@ class DataCleaner:
                 for activity, activity_data in activity_dict.items():
                     path_lvl_3 = os.path.join(path_lvl_2, f"{activity}.npy")
                     print(activity_data.shape)
+                    activity_data, encoding = encode(activity_data, precision)
                     np.save(path_lvl_3, arr=activity_data)
+                    catalog.add(subject, joint, activity, shape=activity_data.shape, dtype=activity_data.dtype)
+                    if encoding is not None:
+                        max_error = max(max_error, encoding['error'])
+        catalog.save(base_folder)
 
-        return True
+        return max_error
+
+    def run_and_save(self, subjects, base_folder="clean_dataset", storage='directory', incremental=False, shard=None):
+        """
+        :param incremental: Only clean the (joint, activity) groups whose inputs or outlier method changed since the
+         last run (see run_streaming)
+        :param shard: Optional Shard of a run split across nodes (see run_streaming)
+        """
+        if incremental or shard is not None:
+            return self.run_streaming(subjects=subjects, base_folder=base_folder, storage=storage,
+                                      incremental=incremental, shard=shard)
 
-    def run_and_save(self, subjects, base_folder="clean_dataset"):
         structured_data = self.run(subjects=subjects)
-        self.save(data=structured_data, base_folder=base_folder)
+        with self.instrumentation.span('save', path=base_folder):
+            self.max_error = self.save(data=structured_data, base_folder=base_folder, storage=storage,
+                                       precision=self.precision, compression=self.compression)
+        self.report_error()
+
+        return True
+
+    def report_error(self):
+        if self.precision is not None:
+            print(f"Max reconstruction error ({self.precision}): {self.max_error:.3g}")
+
+    def group_entries(self, subjects):
+        """
+        List where every (joint, activity) group is stored without loading any data
+        :return: Dictionary {(joint, activity): list of subjects}, ordered by joint and activity
+        """
+        groups = dict()
+        for subject in subjects:
+            for joint in self.data_loader.joints(subject):
+                for activity in self.data_loader.activities(subject, joint):
+                    groups.setdefault((joint, activity), list()).append(subject)
+
+        return {group: groups[group] for group in sorted(groups.keys())}
+
+    def clean_group(self, joint, activity, subjects):
+        """
+        Remove the outliers of a single (joint, activity) group across the given subjects
+        :return: Dictionary {subject: clean strides} of the group
+        """
+        with self.instrumentation.span('clean_group', joint=joint, activity=activity) as span:
+            data = [self.data_loader.get_array(subject=subject, joint=joint, activity=activity) for subject in subjects]
+            bounds = np.cumsum([0] + [subject_data.shape[0] for subject_data in data])
+            group_data = np.concatenate(data)
+
+            keep = np.ones(group_data.shape[0], dtype=bool)
+            if group_data.shape[0] > 5 and self.outlier_models is not None:
+                outliers_idx = self.outlier_models.detect_outliers(
+                    joint=joint, activity=activity, x=group_data.reshape(group_data.shape[0], -1), subjects=subjects,
+                    refit=self.refit_models)
+                keep[outliers_idx] = False
+            elif group_data.shape[0] > 5:
+                outliers_idx = self.outlier_detector.detect_outliers(x=group_data.reshape(group_data.shape[0], -1),
+                                                                     strata=np.repeat(np.arange(len(data)),
+                                                                                      np.diff(bounds)))
+                keep[np.asarray(outliers_idx, dtype=int)] = False
+            span.add(subjects=len(subjects), strides=len(keep), outliers=len(keep) - np.count_nonzero(keep))
+
+        return {subject: group_data[bounds[i]:bounds[i + 1]][keep[bounds[i]:bounds[i + 1]]]
+                for i, subject in enumerate(subjects)}
+
+    def clean_group_entry(self, group_entry):
+        """
+        Clean a group in a worker process
+        :return: Clean strides of the group (see clean_group) and the spans recorded in the worker
+        """
+        (joint, activity), subjects = group_entry
+        clean_data = self.clean_group(joint=joint, activity=activity, subjects=subjects)
+        return clean_data, self.instrumentation.pop_spans()
+
+    def merge_spans(self, entries):
+        """
+        Merge the spans of the results of clean_group_entry as they are consumed
+        """
+        for clean_data, spans in entries:
+            self.instrumentation.merge(spans)
+            yield clean_data
+
+    def save_group(self, joint, activity, clean_data, base_folder, writer=None, catalog=None):
+        """
+        :param catalog: Catalog of the directory tree, updated with the saved entries
+        """
+        for subject, activity_data in clean_data.items():
+            if activity_data.shape[0] == 0:
+                continue
+            if writer is not None:
+                writer.write(subject, joint, activity, activity_data)
+            else:
+                os.makedirs(os.path.join(base_folder, subject, joint), exist_ok=True)
+                activity_data, encoding = encode(activity_data, self.precision)
+                np.save(os.path.join(base_folder, subject, joint, f"{activity}.npy"), arr=activity_data)
+                if encoding is not None:
+                    self.max_error = max(self.max_error, encoding['error'])
+                if catalog is not None:
+                    catalog.add(subject, joint, activity, shape=activity_data.shape, dtype=activity_data.dtype)
+
+    def outlier_agreement(self, subjects, min_strides=None):
+        """
+        Compare the approximate outlier detection with the exact one on every (joint, activity) group, to choose from
+        which group size to approximate
+        :param min_strides: Only compare the groups with more strides than this, max_fit_strides if not given
+        :return: List with the joint, activity and agreement (see OutlierDetector.agreement) of every group
+        """
+        if self.outlier_detector.max_fit_strides is None:
+            raise ValueError("Approximation: 'max_fit_strides' is not set.")
+        min_strides = self.outlier_detector.max_fit_strides if min_strides is None else min_strides
+        report = list()
+        for (joint, activity), group_subjects in self.group_entries(subjects=subjects).items():
+            data = [self.data_loader.get_array(subject=subject, joint=joint, activity=activity)
+                    for subject in group_subjects]
+            group_data = np.concatenate(data)
+            if group_data.shape[0] <= max(5, min_strides):
+                continue
+            strata = np.repeat(np.arange(len(data)), [subject_data.shape[0] for subject_data in data])
+            agreement = self.outlier_detector.agreement(x=group_data.reshape(group_data.shape[0], -1), strata=strata)
+            report.append(dict({'joint': joint, 'activity': activity}, **agreement))
+
+        return report
+
+    def score_subjects(self, subjects):
+        """
+        Score the strides of new subjects against the saved outlier models, without fitting or cleaning anything
+        :return: Dictionary {(subject, joint, activity): boolean array, True for the outlier strides}. Groups without a
+         saved model are not scored.
+        """
+        if self.outlier_models is None:
+            raise ValueError("Scoring: 'models_path' is not set.")
+        print("Scoring strides...")
+        scores = dict()
+        for (joint, activity), group_subjects in self.group_entries(subjects=subjects).items():
+            if self.outlier_models.get(joint, activity) is None:
+                continue
+            data = [self.data_loader.get_array(subject=subject, joint=joint, activity=activity)
+                    for subject in group_subjects]
+            bounds = np.cumsum([0] + [subject_data.shape[0] for subject_data in data])
+            group_data = np.concatenate(data)
+            outliers = np.zeros(group_data.shape[0], dtype=bool)
+            outliers[self.outlier_models.predict(joint, activity, x=group_data.reshape(group_data.shape[0], -1))] = True
+            for i, subject in enumerate(group_subjects):
+                scores[(subject, joint, activity)] = outliers[bounds[i]:bounds[i + 1]]
+
+        return scores
+
+    def group_inputs(self, joint, activity, subjects, manifest):
+        """
+        :return: Dictionary {subject/joint/activity: content hash} with the inputs of a group
+        """
+        inputs = dict()
+        for subject in subjects:
+            if self.data_loader.store is None:
+                inputs[f"{subject}/{joint}/{activity}"] = manifest.file_hash(
+                    os.path.join(self.data_loader.dataset_path, subject, joint, f"{activity}.npy"))
+            else:
+                inputs[f"{subject}/{joint}/{activity}"] = manifest.data_hash(
+                    self.data_loader.get_array(subject=subject, joint=joint, activity=activity))
+
+        return inputs
+
+    @staticmethod
+    def remove_group(joint, activity, base_folder):
+        for subject in os.listdir(base_folder):
+            file_name = os.path.join(base_folder, subject, joint, f"{activity}.npy")
+            if os.path.exists(file_name):
+                os.remove(file_name)
+
+    def run_streaming(self, subjects, base_folder="clean_dataset", storage='directory', incremental=False,
+                      shard=None):
+        """
+        Clean and save one (joint, activity) group at a time, straight from the data loader to base_folder. The peak
+        memory is bounded by the largest group (times the number of workers) instead of the whole dataset.
+        :param storage: 'directory' or 'store', as in save
+        :param incremental: Only clean the groups whose inputs or outlier method changed since the last run, as
+         recorded in the manifest of base_folder (see Manifest)
+        :param shard: Optional Shard of a run split across nodes. Only the groups of the shard are cleaned, with all
+         their subjects, into the partial output of the shard (see Shard.path), to be combined by merge_shards.
+        """
+        print("Cleaning data by group...")
+        check_precision(precision=self.precision, compression=self.compression, storage=storage)
+        group_entries = list(self.group_entries(subjects=subjects).items())
+        params = {'outlier_method': self.outlier_method}
+        if self.outlier_models is not None:
+            params['models_path'] = os.path.abspath(self.outlier_models.path)
+        if self.precision is not None or self.compression is not None:
+            params.update(precision=self.precision, compression=self.compression)
+        if shard is not None:
+            shard_groups = shard.select([f"{joint}/{activity}" for (joint, activity), _ in group_entries])
+            total_groups, final_folder = len(group_entries), base_folder
+            group_entries = [group_entries[position] for position, _ in shard_groups]
+            base_folder = shard.path(base_folder)
+            print(f"Shard {shard.index} of {shard.count}: {len(group_entries)} groups...")
+
+        manifest, previous_store, removed = None, None, list()
+        if incremental:
+            manifest = Manifest(Manifest.output_path(base_folder, storage=storage))
+            inputs = {group: self.group_inputs(*group, subjects=group_subjects, manifest=manifest)
+                      for group, group_subjects in group_entries}
+            changed_entries = [(group, group_subjects) for group, group_subjects in group_entries if
+                               not manifest.is_up_to_date(f"{group[0]}/{group[1]}", inputs=inputs[group],
+                                                          params=params)]
+            # Groups of the previous run that no longer have strides (or are not in the shard)
+            removed = [tuple(output.split('/')) for output in manifest.outputs()
+                       if tuple(output.split('/')) not in inputs]
+            print(f"{len(changed_entries)} of {len(group_entries)} groups changed, {len(removed)} removed...")
+            for joint, activity in removed:
+                manifest.remove(f"{joint}/{activity}")
+            if storage == 'store' and os.path.exists(base_folder):
+                previous_store = DatasetStore(base_folder)
+            elif storage == 'directory' and os.path.exists(base_folder):
+                for joint, activity in [group for group, _ in changed_entries] + removed:
+                    self.remove_group(joint=joint, activity=activity, base_folder=base_folder)
+            group_entries = changed_entries
+
+        self.max_error = 0.
+        writer = DatasetStoreWriter(base_folder, precision=self.precision,
+                                    compression=self.compression) if storage == 'store' else None
+        catalog = None
+        if storage == 'directory':
+            catalog = Catalog.read(base_folder) if os.path.exists(base_folder) else Catalog()
+        if catalog is not None and incremental:
+            for joint, activity in [group for group, _ in group_entries] + removed:
+                catalog.remove(joint=joint, activity=activity)
+        if previous_store is not None:
+            changed_groups = {group for group, _ in group_entries} | set(removed)
+            for subject, joint, activity in previous_store.keys():
+                if (joint, activity) not in changed_groups:
+                    writer.copy(previous_store, subject, joint, activity)
+            previous_store.close()
+
+        executor = ProcessPoolExecutor(max_workers=self.workers) if self.workers > 1 else None
+        try:
+            if executor is not None:
+                clean_groups = self.merge_spans(executor.map(self.clean_group_entry, group_entries))
+            else:
+                clean_groups = (self.clean_group(joint=joint, activity=activity, subjects=group_subjects)
+                                for (joint, activity), group_subjects in group_entries)
+
+            for ((joint, activity), _), clean_data in zip(group_entries, clean_groups):
+                with self.instrumentation.span('save_group', joint=joint, activity=activity):
+                    self.save_group(joint=joint, activity=activity, clean_data=clean_data, base_folder=base_folder,
+                                    writer=writer, catalog=catalog)
+                if manifest is not None:
+                    manifest.record(f"{joint}/{activity}", inputs=inputs[(joint, activity)], params=params)
+        except BaseException:
+            # The previous store is kept, along with its manifest
+            if writer is not None:
+                writer.abort()
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown()
+
+        if writer is not None:
+            writer.close()
+            self.max_error = writer.max_error()
+        self.report_error()
+        if catalog is not None:
+            catalog.save(base_folder)
+        if manifest is not None:
+            manifest.save()
+        if shard is not None:
+            shard.save_manifest(final_folder, unit='group', items=shard_groups, total=total_groups, storage=storage,
+                                params=params)
 
         return True
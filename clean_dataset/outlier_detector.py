@@ -1,24 +1,170 @@
-from sklearn.ensemble import IsolationForest
-from sklearn.covariance import EllipticEnvelope
-from sklearn.neighbors import LocalOutlierFactor
+import time
+import numpy as np
+
+from data_management.instrumentation import Instrumentation
 
 
 class OutlierDetector:
-    def __init__(self, method='isolation_forest'):
+    def __init__(self, method='isolation_forest', instrumentation=None, novelty=False, max_fit_strides=None,
+                 reduction=None, components=20, chunk_size=4096, seed=0):
+        """
+        :param instrumentation: Optional Instrumentation recording a 'fit_predict' span per call of detect_outliers
+        :param novelty: Fit LOF in novelty mode, so new strides can be scored with predict after fit
+        :param max_fit_strides: Approximate the detection of groups with more strides than this: the model is fitted on
+         a random (or stratified) subsample of max_fit_strides strides and scores all the strides in chunks. Smaller
+         groups are detected exactly.
+        :param reduction: None, 'pca' or 'downsample', representation of the strides fitted and scored in the
+         approximate detection: their first principal components, or every n-th sample of each stride
+        :param components: Number of principal components, or of samples kept per stride, of the reduction
+        :param chunk_size: Number of strides scored at once in the approximate detection
+        :param seed: Seed of the subsample
+        """
+        self.instrumentation = Instrumentation(enabled=False) if instrumentation is None else instrumentation
+        self.method_name = method
+        self.method = self.estimator(method=method, novelty=novelty)
+        if reduction not in [None, 'pca', 'downsample']:
+            raise ValueError(f"Reduction: '{reduction}' is not supported.")
+        self.max_fit_strides = max_fit_strides
+        self.reduction = reduction
+        self.components = components
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.reduction_model = None
+
+    @staticmethod
+    def estimator(method, novelty=False):
+        # The backends are imported when used, scikit-learn is slow to import
         if method == 'iForest':
-            self.method = IsolationForest()
+            from sklearn.ensemble import IsolationForest
+            return IsolationForest()
         elif method == 'MCD':
-            self.method = EllipticEnvelope()
+            from sklearn.covariance import EllipticEnvelope
+            return EllipticEnvelope()
         elif method == 'LOF':
-            self.method = LocalOutlierFactor()
+            from sklearn.neighbors import LocalOutlierFactor
+            return LocalOutlierFactor(novelty=novelty)
         else:
             raise ValueError(f"Method: '{method}' is not supported.")
 
-    def detect_outliers(self, x):
-        if x.shape[0] > 0:
-            y_hat = self.method.fit_predict(X=x)
-            outliers_idx = [i for i, y in enumerate(y_hat) if y == -1]
-        else:
-            outliers_idx = list()
+    def detect_outliers(self, x, strata=None):
+        """
+        :param strata: Optional stratum (e.g. subject) of every stride, the subsample of the approximate detection
+         keeps the proportion of each stratum
+        :return: Indices of the outliers in x
+        """
+        if self.max_fit_strides is not None and x.shape[0] > self.max_fit_strides:
+            return self.detect_outliers_approximate(x=x, strata=strata)
+
+        with self.instrumentation.span('fit_predict', method=type(self.method).__name__) as span:
+            if x.shape[0] > 0:
+                y_hat = self.method.fit_predict(X=x)
+                outliers_idx = np.flatnonzero(y_hat == -1)
+            else:
+                outliers_idx = np.array(list(), dtype=int)
+            span.add(strides=x.shape[0], outliers=len(outliers_idx))
+
+        return outliers_idx
+
+    def subsample(self, n, strata=None):
+        """
+        :return: Sorted indices of a random subsample of max_fit_strides of n strides. With strata, every stratum keeps
+         its proportion of the strides (and at least one).
+        """
+        rng = np.random.default_rng(self.seed)
+        if strata is None:
+            return np.sort(rng.choice(n, size=min(n, self.max_fit_strides), replace=False))
+
+        subsample_idx = list()
+        for stratum in np.unique(strata):
+            stratum_idx = np.flatnonzero(strata == stratum)
+            size = min(len(stratum_idx), max(1, int(round(self.max_fit_strides * len(stratum_idx) / n))))
+            subsample_idx.append(rng.choice(stratum_idx, size=size, replace=False))
+
+        return np.sort(np.concatenate(subsample_idx))
+
+    def reduce(self, x, fit=False):
+        """
+        :param fit: Fit the principal components to x
+        :return: Reduced representation of the strides (see reduction)
+        """
+        if self.reduction == 'pca':
+            if fit:
+                from sklearn.decomposition import PCA
+                self.reduction_model = PCA(n_components=min(self.components, *x.shape), random_state=self.seed).fit(x)
+            return self.reduction_model.transform(x)
+        elif self.reduction == 'downsample':
+            return x[:, ::max(1, -(-x.shape[1] // self.components))]
+
+        return x
+
+    def detect_outliers_approximate(self, x, strata=None):
+        """
+        Fit the model on a subsample of the strides and score every stride in chunks
+        :return: Indices of the outliers in x
+        """
+        with self.instrumentation.span('fit_predict_approximate', method=type(self.method).__name__) as span:
+            subsample_idx = self.subsample(n=x.shape[0], strata=strata)
+            estimator = self.estimator(method=self.method_name, novelty=True)
+            estimator.fit(X=self.reduce(x[subsample_idx], fit=True))
+
+            y_hat = np.empty(x.shape[0], dtype=int)
+            for start in range(0, x.shape[0], self.chunk_size):
+                chunk = slice(start, start + self.chunk_size)
+                y_hat[chunk] = estimator.predict(X=self.reduce(x[chunk]))
+            if self.method_name == 'LOF':
+                # The strides of the subsample keep the factors of the fit, as in fit_predict
+                y_hat[subsample_idx] = np.where(estimator.negative_outlier_factor_ < estimator.offset_, -1, 1)
+            outliers_idx = np.flatnonzero(y_hat == -1)
+            span.add(strides=x.shape[0], fit_strides=len(subsample_idx), outliers=len(outliers_idx))
+
+        return outliers_idx
+
+    def agreement(self, x, strata=None):
+        """
+        Compare the approximate detection of a group with the exact one
+        :return: Dictionary with the strides and outliers of each detection, the fraction of strides both label the
+         same, the precision and recall of the approximate outliers and the time of each detection
+        """
+        start = time.perf_counter()
+        exact = np.zeros(x.shape[0], dtype=bool)
+        exact[self.estimator(method=self.method_name).fit_predict(X=x) == -1] = True
+        exact_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        approximate = np.zeros(x.shape[0], dtype=bool)
+        approximate[self.detect_outliers_approximate(x=x, strata=strata)] = True
+        approximate_time = time.perf_counter() - start
+
+        both, exact_outliers, approximate_outliers = [int(np.count_nonzero(outliers)) for outliers in
+                                                      [exact & approximate, exact, approximate]]
+        return {'strides': x.shape[0], 'exact_outliers': exact_outliers, 'approximate_outliers': approximate_outliers,
+                'agreement': float(np.mean(exact == approximate)),
+                'precision': both / approximate_outliers if approximate_outliers > 0 else None,
+                'recall': both / exact_outliers if exact_outliers > 0 else None,
+                'exact_seconds': exact_time, 'approximate_seconds': approximate_time}
+
+    def fit(self, x):
+        """
+        Fit the model to score new strides with predict
+        :return: Indices of the outliers in x, the same as detect_outliers
+        """
+        with self.instrumentation.span('fit', method=type(self.method).__name__) as span:
+            self.method.fit(X=x)
+            if self.method_name == 'LOF':
+                # LOF does not score its own training strides with predict, their factors are kept by fit
+                outliers_idx = list(np.flatnonzero(self.method.negative_outlier_factor_ < self.method.offset_))
+            else:
+                outliers_idx = list(np.flatnonzero(self.method.predict(X=x) == -1))
+            span.add(strides=x.shape[0], outliers=len(outliers_idx))
+
+        return outliers_idx
+
+    def predict(self, x):
+        """
+        :return: Indices of the outliers in x according to the fitted model
+        """
+        with self.instrumentation.span('predict', method=type(self.method).__name__) as span:
+            outliers_idx = list(np.flatnonzero(self.method.predict(X=x) == -1)) if x.shape[0] > 0 else list()
+            span.add(strides=x.shape[0], outliers=len(outliers_idx))
 
         return outliers_idx
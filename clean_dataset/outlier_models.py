@@ -0,0 +1,114 @@
+import os
+import pickle
+import numpy as np
+
+from clean_dataset.outlier_detector import OutlierDetector
+from data_management.manifest import Manifest
+
+
+class OutlierModels:
+    """
+    Outlier models of the (joint, activity) groups, fitted once and saved to disk so new strides are scored against
+    them instead of refitting on the whole group. Every group is a pickle file in path with the fitted model, its
+    parameters and the outliers of its training strides. A model is refitted when its parameters change, when
+    explicitly requested, or when the outlier rate of the strides it scores exceeds its training rate by more than
+    drift_threshold.
+    """
+    def __init__(self, path, method='iForest', drift_threshold=0.1, instrumentation=None):
+        self.path = path
+        self.method = method
+        self.drift_threshold = drift_threshold
+        self.instrumentation = instrumentation
+        self.models = dict()
+
+    def params(self):
+        return {'method': self.method}
+
+    def model_path(self, joint, activity):
+        return os.path.join(self.path, f"{joint}__{activity}.pkl")
+
+    def groups(self):
+        """
+        :return: List with the (joint, activity) of every saved model
+        """
+        if not os.path.exists(self.path):
+            return list()
+        return sorted(tuple(file[:-len('.pkl')].split('__')) for file in os.listdir(self.path)
+                      if file.endswith('.pkl'))
+
+    def get(self, joint, activity):
+        """
+        :return: Saved model of a group, None if there is none or it was fitted with other parameters
+        """
+        if (joint, activity) not in self.models:
+            model_path = self.model_path(joint, activity)
+            if not os.path.exists(model_path):
+                return None
+            with open(model_path, 'rb') as f:
+                model = pickle.load(f)
+            if model['params'] != self.params():
+                return None
+            self.models[(joint, activity)] = model
+
+        return self.models[(joint, activity)]
+
+    def detector(self, model):
+        outlier_detector = OutlierDetector(method=self.method, instrumentation=self.instrumentation, novelty=True)
+        outlier_detector.method = model['estimator']
+
+        return outlier_detector
+
+    def fit(self, joint, activity, x, subjects=()):
+        """
+        Fit and save the model of a group
+        :param subjects: Subjects of the training strides, saved with the model for reference
+        :return: Indices of the outliers in x
+        """
+        outlier_detector = OutlierDetector(method=self.method, instrumentation=self.instrumentation, novelty=True)
+        outliers_idx = outlier_detector.fit(x=x)
+        model = {'params': self.params(), 'estimator': outlier_detector.method, 'strides': x.shape[0],
+                 'outlier_rate': len(outliers_idx) / x.shape[0], 'outliers_idx': list(outliers_idx),
+                 'data_hash': Manifest.data_hash(np.ascontiguousarray(x)), 'subjects': list(subjects)}
+
+        # Groups may be fitted concurrently, every group writes its own file
+        os.makedirs(self.path, exist_ok=True)
+        tmp_path = f"{self.model_path(joint, activity)}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(model, f)
+        os.replace(tmp_path, self.model_path(joint, activity))
+        self.models[(joint, activity)] = model
+
+        return outliers_idx
+
+    def predict(self, joint, activity, x):
+        """
+        :return: Indices of the outliers in x according to the saved model of the group, None if there is no model
+        """
+        model = self.get(joint, activity)
+        if model is None:
+            return None
+        # The training strides keep the outliers found when fitting, e.g. LOF scores them differently in novelty mode
+        if x.shape[0] == model['strides'] and Manifest.data_hash(np.ascontiguousarray(x)) == model['data_hash']:
+            return model['outliers_idx']
+        return self.detector(model).predict(x=x)
+
+    def drift(self, joint, activity, outliers_idx, strides):
+        """
+        :return: Outlier rate of scored strides above the training outlier rate of the model
+        """
+        return len(outliers_idx) / max(strides, 1) - self.get(joint, activity)['outlier_rate']
+
+    def detect_outliers(self, joint, activity, x, subjects=(), refit=False):
+        """
+        Score the strides of a group with its saved model, fitting it first if there is none or refit is True, and
+        refitting it on x when the strides drifted
+        :return: Indices of the outliers in x
+        """
+        outliers_idx = None if refit else self.predict(joint=joint, activity=activity, x=x)
+        if outliers_idx is not None and self.drift(joint, activity, outliers_idx, x.shape[0]) > self.drift_threshold:
+            print(f"Refitting {joint}/{activity}, the outlier rate drifted...")
+            outliers_idx = None
+        if outliers_idx is None:
+            outliers_idx = self.fit(joint=joint, activity=activity, x=x, subjects=subjects)
+
+        return np.asarray(outliers_idx, dtype=int)
@@ -0,0 +1,211 @@
+import os
+import sys
+import json
+import argparse
+
+# Only the standard library is imported at module level so --help and inspect start fast, every command imports the
+# modules it needs
+
+
+def instrumentation_of(args):
+    if args.trace is None and args.report is None:
+        return None
+    from data_management.instrumentation import Instrumentation
+    return Instrumentation()
+
+
+def export_instrumentation(instrumentation, args):
+    if instrumentation is None:
+        return
+    if args.trace is not None:
+        instrumentation.to_chrome_trace(args.trace)
+    if args.report is not None:
+        instrumentation.to_json(args.report)
+
+
+def shard_of(args):
+    if args.shards is None:
+        return None
+    from normalize_dataset.sharding import Shard
+    return Shard(index=args.shard, count=args.shards)
+
+
+def raw_subjects(base_path, data_folder):
+    return sorted({str(trial).split('T')[0] for trial in os.listdir(os.path.join(base_path, data_folder))})
+
+
+def normalize(args):
+    from data_management.data_loader import DataLoader
+    from normalize_dataset.normalize_dataset import NormalizeDataset
+
+    instrumentation = instrumentation_of(args)
+    cache = None
+    if args.cache is not None:
+        from data_management.trial_cache import TrialCache
+        cache = TrialCache(cache_path=args.cache)
+    subjects = args.subjects if args.subjects else raw_subjects(args.base_path, args.data_folder)
+    data_loader = DataLoader(base_path=args.base_path, data_folder=args.data_folder, labels_folder=args.labels_folder,
+                             subjects=subjects, cache=cache, workers=args.loader_workers,
+                             instrumentation=instrumentation)
+    normalize_dataset = NormalizeDataset(data_loader=data_loader, gc_key=args.gc_key, samples=args.samples,
+                                         path=args.output, workers=args.workers, interpolation=args.interpolation,
+                                         all_channels=args.all_channels, storage=args.storage,
+                                         incremental=args.incremental, instrumentation=instrumentation,
+                                         shard=shard_of(args), precision=args.precision,
+                                         compression=args.compression)
+    normalize_dataset.run()
+    export_instrumentation(instrumentation, args)
+
+
+def clean(args):
+    from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+    from clean_dataset.data_cleaner import DataCleaner
+
+    instrumentation = instrumentation_of(args)
+    data_loader = NormalizedDataLoader(dataset_path=args.input)
+    subjects = args.subjects if args.subjects else data_loader.subjects()
+    data_cleaner = DataCleaner(base_path=args.input, data_loader=data_loader, outlier_method=args.method,
+                               workers=args.workers, instrumentation=instrumentation, models_path=args.models,
+                               refit_models=args.refit_models, drift_threshold=args.drift_threshold,
+                               max_fit_strides=args.max_fit_strides, reduction=args.reduction,
+                               components=args.components, precision=args.precision,
+                               compression=args.compression)
+    if args.streaming:
+        data_cleaner.run_streaming(subjects=subjects, base_folder=args.output, storage=args.storage,
+                                   incremental=args.incremental, shard=shard_of(args))
+    else:
+        data_cleaner.run_and_save(subjects=subjects, base_folder=args.output, storage=args.storage,
+                                  incremental=args.incremental, shard=shard_of(args))
+    export_instrumentation(instrumentation, args)
+
+
+def inspect(args):
+    """
+    Print the entries of a normalized dataset (directory tree or store), or the trials of every subject of a raw
+    dataset when path holds the data folder
+    """
+    if os.path.isdir(os.path.join(args.path, args.data_folder)):
+        subjects = raw_subjects(args.path, args.data_folder)
+        trials = {subject: sorted(trial for trial in os.listdir(os.path.join(args.path, args.data_folder))
+                                  if str(trial).split('T')[0] == subject) for subject in subjects}
+        if args.json:
+            print(json.dumps(trials, indent=2))
+        else:
+            for subject, subject_trials in trials.items():
+                print(f"{subject}: {len(subject_trials)} trials")
+        return
+
+    from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+    data_loader = NormalizedDataLoader(dataset_path=args.path)
+    entries = [dict(subject=subject, joint=joint, activity=activity,
+                    **data_loader.catalog.entry(subject, joint, activity))
+               for subject, joint, activity in data_loader.select()]
+
+    if args.json:
+        print(json.dumps(entries, indent=2))
+    else:
+        for entry in entries:
+            print(f"{entry['subject']}/{entry['joint']}/{entry['activity']}: {entry['strides']} strides of "
+                  f"{tuple(entry['shape'])} {entry['dtype']}")
+        print(f"{len(entries)} entries, {sum(entry['strides'] for entry in entries)} strides")
+        if data_loader.store is not None:
+            print(f"Max reconstruction error: {data_loader.store.max_error():.3g}")
+
+
+def merge(args):
+    from normalize_dataset.sharding import merge_shards
+    merge_shards(path=args.output, shards=args.shards)
+
+
+def bench(arguments):
+    from benchmarks.run_benchmarks import main as run_benchmarks
+    run_benchmarks(arguments)
+
+
+def add_precision_arguments(parser):
+    parser.add_argument('--precision', default=None, choices=['float32', 'float16', 'int16'],
+                        help="Precision of the saved strides, float64 if not given (int16 needs --storage store)")
+    parser.add_argument('--compression', default=None, choices=['zlib'], help="Compression of the store entries")
+
+
+def add_shard_arguments(parser):
+    parser.add_argument('--shards', type=int, default=None, help="Number of shards (nodes) of the run, see merge")
+    parser.add_argument('--shard', type=int, default=0, help="Shard processed by this node, from 0 to shards - 1")
+
+
+def add_instrumentation_arguments(parser):
+    parser.add_argument('--trace', default=None, help="Chrome trace file with the timing of every stage")
+    parser.add_argument('--report', default=None, help="JSON file with the timing and memory of every stage")
+
+
+def parser_of():
+    parser = argparse.ArgumentParser(description="Normalize and clean the UH (Houston) gait dataset")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    normalize_parser = commands.add_parser('normalize', help="Segment and normalize the strides of a raw dataset")
+    normalize_parser.add_argument('base_path', help="Folder of the raw dataset")
+    normalize_parser.add_argument('--data-folder', default='kin_data')
+    normalize_parser.add_argument('--labels-folder', default='labels')
+    normalize_parser.add_argument('--subjects', nargs='*', default=None, help="All the subjects if not given")
+    normalize_parser.add_argument('--output', default='normalized_dataset')
+    normalize_parser.add_argument('--gc-key', default='hs')
+    normalize_parser.add_argument('--samples', type=int, default=100)
+    normalize_parser.add_argument('--interpolation', default='cubic', choices=['cubic', 'linear'])
+    normalize_parser.add_argument('--all-channels', action='store_true')
+    normalize_parser.add_argument('--storage', default='directory', choices=['directory', 'store'])
+    normalize_parser.add_argument('--workers', type=int, default=1, help="Processes normalizing subjects")
+    normalize_parser.add_argument('--loader-workers', type=int, default=1, help="Processes decoding trials")
+    normalize_parser.add_argument('--cache', default=None, help="Folder of the decoded trial cache")
+    normalize_parser.add_argument('--incremental', action='store_true')
+    add_precision_arguments(normalize_parser)
+    add_shard_arguments(normalize_parser)
+    add_instrumentation_arguments(normalize_parser)
+    normalize_parser.set_defaults(func=normalize)
+
+    clean_parser = commands.add_parser('clean', help="Remove the outlier strides of a normalized dataset")
+    clean_parser.add_argument('input', help="Normalized dataset, folder or store file")
+    clean_parser.add_argument('--output', default='normalize_dataset_clean')
+    clean_parser.add_argument('--subjects', nargs='*', default=None, help="All the subjects if not given")
+    clean_parser.add_argument('--method', default='iForest', choices=['iForest', 'MCD', 'LOF'])
+    clean_parser.add_argument('--storage', default='directory', choices=['directory', 'store'])
+    clean_parser.add_argument('--workers', type=int, default=1)
+    clean_parser.add_argument('--streaming', action='store_true', help="Clean one (joint, activity) group at a time")
+    clean_parser.add_argument('--incremental', action='store_true')
+    clean_parser.add_argument('--models', default=None, help="Folder of the saved outlier models")
+    clean_parser.add_argument('--refit-models', action='store_true')
+    clean_parser.add_argument('--drift-threshold', type=float, default=0.1)
+    clean_parser.add_argument('--max-fit-strides', type=int, default=None)
+    clean_parser.add_argument('--reduction', default=None, choices=['pca', 'downsample'])
+    clean_parser.add_argument('--components', type=int, default=20)
+    add_precision_arguments(clean_parser)
+    add_shard_arguments(clean_parser)
+    add_instrumentation_arguments(clean_parser)
+    clean_parser.set_defaults(func=clean)
+
+    merge_parser = commands.add_parser('merge', help="Combine the outputs of the shards of a normalize or clean run")
+    merge_parser.add_argument('output', help="Output of the run, as given to normalize or clean")
+    merge_parser.add_argument('--shards', type=int, required=True)
+    merge_parser.set_defaults(func=merge)
+
+    inspect_parser = commands.add_parser('inspect', help="List the entries of a normalized or raw dataset")
+    inspect_parser.add_argument('path')
+    inspect_parser.add_argument('--data-folder', default='kin_data')
+    inspect_parser.add_argument('--json', action='store_true')
+    inspect_parser.set_defaults(func=inspect)
+
+    # The arguments of bench are parsed by benchmarks.run_benchmarks, see main
+    commands.add_parser('bench', help="Benchmark the pipeline, see bench --help")
+
+    return parser
+
+
+def main(arguments=None):
+    arguments = sys.argv[1:] if arguments is None else arguments
+    if arguments[:1] == ['bench']:
+        return bench(arguments[1:])
+    args = parser_of().parse_args(arguments)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -2,15 +2,23 @@ import os
 import numpy as np
 
 from data_management.data_loader import DataLoader
+from data_management.trial_cache import TrialCache
 from normalize_dataset.normalize_dataset import NormalizeDataset
 
 base_path = "C:/Users/Camilo Guillen/Documents/Universidad de los Andes/Tesis/Datasets/houston/UH Dataset/"
 data_folder = 'kin_data'
 labels_folder = 'labels'
-subjects = list(np.unique([sub.split('T')[0] for sub in os.listdir(os.path.join(base_path, data_folder))]))
 key = 'hs'
 samples = 100
+cache_path = "trial_cache"
+workers = os.cpu_count()
 
-data_loader = DataLoader(base_path=base_path, data_folder=data_folder, labels_folder=labels_folder, subjects=subjects)
-normalize_dataset_obj = NormalizeDataset(data_loader=data_loader, gc_key=key, samples=samples)
-normalize_dataset_obj.run()
+if __name__ == '__main__':
+    # The guard is required by the process pool on Windows, where workers re-import this script (and would list the
+    # data folder again)
+    subjects = list(np.unique([sub.split('T')[0] for sub in os.listdir(os.path.join(base_path, data_folder))]))
+    data_loader = DataLoader(base_path=base_path, data_folder=data_folder, labels_folder=labels_folder,
+                             subjects=subjects, cache=TrialCache(cache_path=cache_path))
+    normalize_dataset_obj = NormalizeDataset(data_loader=data_loader, gc_key=key, samples=samples, workers=workers,
+                                             incremental=True)
+    normalize_dataset_obj.run()
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+class Vocabulary:
+    """
+    Map labels (activities, gait events, joints, subjects) to small integer codes and back. Codes are given in order of
+    insertion and arrays of codes use the smallest integer type that fits the vocabulary.
+    """
+    def __init__(self, labels=(), grow=False):
+        """
+        :param labels: Initial labels of the vocabulary
+        :param grow: Add unknown labels when encoding instead of raising a KeyError
+        """
+        self.labels = list()
+        self.codes = dict()
+        self.grow = grow
+        for label in labels:
+            self.add(label)
+
+    def __len__(self):
+        return len(self.labels)
+
+    def __contains__(self, label):
+        return label in self.codes
+
+    @property
+    def dtype(self):
+        for dtype in [np.int8, np.int16, np.int32]:
+            if len(self.labels) <= np.iinfo(dtype).max + 1:
+                return np.dtype(dtype)
+        return np.dtype(np.int64)
+
+    def add(self, label):
+        label = str(label)
+        if label not in self.codes:
+            self.codes[label] = len(self.labels)
+            self.labels.append(label)
+
+        return self.codes[label]
+
+    def code(self, label):
+        """
+        :return: Code of a single label
+        """
+        if self.grow:
+            return self.add(label)
+        return self.codes[str(label)]
+
+    def encode(self, labels):
+        """
+        :return: Array of codes with the shape of labels. Only the unique labels are looked up.
+        """
+        labels = np.asarray(labels)
+        unique_labels, inverse = np.unique(labels, return_inverse=True)
+        unique_codes = np.array([self.code(label) for label in unique_labels], dtype=np.int64)
+
+        return unique_codes[inverse].reshape(labels.shape).astype(self.dtype)
+
+    def decode(self, codes):
+        """
+        :return: Unicode array of labels with the shape of codes, as wide as the longest label used
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        if codes.size == 0:
+            return np.array(list(), dtype=str).reshape(codes.shape)
+
+        return np.array(self.labels, dtype=object)[codes].astype(str)
+
+
+# Terrain of every activity label, an activity 'x2y' goes from terrain x to terrain y
+terrains = ['w', 'rd', 'ra', 'sd', 'sa']
+
+activity_vocabulary = Vocabulary(['none'] + [f"{start}2{end}" for start in terrains for end in terrains])
+gait_event_vocabulary = Vocabulary(['none', 'rhs', 'lto', 'lhs', 'rto'])
+
+# Code of the transition label of a stride given the codes of its first and last activity labels, e.g. w2w -> ra2ra
+# gives w2ra. Transitions involving 'none' are 'none'.
+activity_transitions = np.zeros((len(activity_vocabulary), len(activity_vocabulary)), dtype=activity_vocabulary.dtype)
+for start_label in activity_vocabulary.labels[1:]:
+    for end_label in activity_vocabulary.labels[1:]:
+        activity_transitions[activity_vocabulary.code(start_label), activity_vocabulary.code(end_label)] = \
+            activity_vocabulary.code(f"{start_label.split('2')[0]}2{end_label.split('2')[0]}")
@@ -1,48 +1,206 @@
 import os
+import re
 import numpy as np
 
-from data_management.trial_loader import TrialDataLoader, TrialLabelsLoader
-from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor
+
+from data_management.instrumentation import Instrumentation
+from data_management.trial_loader import TrialDataLoader, TrialLabelsLoader, decode_labels
+
+# Subject and trial number of the data (e.g. AB01T01.mat) and label (e.g. AB01-T01-gc.mat) file names
+trial_file_pattern = re.compile(r'^(?P<subject>[^T\-]+)-?T(?P<trial>\d+)')
 
 
 class DataLoader:
-    def __init__(self, base_path, data_folder, labels_folder, subjects):
+    # Joints of the normalized dataset and their label in the Xsens export
+    joints = {'Right_Knee': 'jRightKnee',
+              'Left_Knee': 'jLeftKnee',
+              'Right_Ankle': 'jRightAnkle',
+              'Left_Ankle': 'jLeftAnkle',
+              'Right_Hip': 'jRightHip',
+              'Left_Hip': 'jLeftHip'}
+
+    def __init__(self, base_path, data_folder, labels_folder, subjects, cache=None, workers=1, extra_channels=None,
+                 instrumentation=None):
+        """
+        :param instrumentation: Optional Instrumentation recording a 'load_subject' span per subject and a 'load_trial'
+         span per trial
+        :param cache: Optional TrialCache with the decoded trials of previous runs
+        :param workers: Number of processes decoding and labeling the trials of a subject in parallel
+        :param extra_channels: Optional dictionary {name: (modality, label)} with other TrialDataLoader modalities to
+         load along with the joint angles, e.g. {'Right_Shank': ('angular_velocity', 'RightLowerLeg')}. Names start with
+         the side of the body.
+        """
         self.data_path = os.path.join(base_path, data_folder)
         self.labels_path = os.path.join(base_path, labels_folder)
         self.subjects = subjects
+        self.cache = cache
+        self.workers = workers
+        self.extra_channels = dict() if extra_channels is None else extra_channels
+        self.instrumentation = Instrumentation(enabled=False) if instrumentation is None else instrumentation
+        self.files_index = None
 
     def __len__(self):
         return len(self.subjects)
 
     def __getitem__(self, idx):
-        subject = self.subjects[idx]
-        files = [(trial, label) for trial, label in zip(os.listdir(self.data_path), os.listdir(self.labels_path))
-                 if (str(trial).split('T')[0] and str(label).split('-')[0]) == subject]
-
-        right_ankle_data, right_hip_data, right_knee_data = list(), list(), list()
-        left_ankle_data, left_hip_data, left_knee_data = list(), list(), list()
-        labels = list()
-
-        for trial, label in tqdm(files):
-            trial_data_loader = TrialDataLoader(data_path=os.path.join(self.data_path, trial))
-            right_knee_data.append(trial_data_loader.joint_angle('jRightKnee'))
-            left_knee_data.append(trial_data_loader.joint_angle('jLeftKnee'))
-            right_ankle_data.append(trial_data_loader.joint_angle('jRightAnkle'))
-            left_ankle_data.append(trial_data_loader.joint_angle('jLeftAnkle'))
-            right_hip_data.append(trial_data_loader.joint_angle('jRightHip'))
-            left_hip_data.append(trial_data_loader.joint_angle('jLeftHip'))
-
-            trial_label_loader = TrialLabelsLoader(label_path=os.path.join(self.labels_path, label),
-                                                   length_data=len(trial_data_loader.joint_angle('jRightKnee')))
-            labels.append(trial_label_loader.get_labels())
-
-        data = dict()
-        data['Right_Knee'] = np.vstack(right_knee_data)
-        data['Left_Knee'] = np.vstack(left_knee_data)
-        data['Right_Ankle'] = np.vstack(right_ankle_data)
-        data['Left_Ankle'] = np.vstack(left_ankle_data)
-        data['Right_Hip'] = np.vstack(right_hip_data)
-        data['Left_Hip'] = np.vstack(left_hip_data)
-        data['Labels'] = np.vstack(labels)
+        return self.get_subject(idx=idx)
+
+    def get_subject(self, idx, encoded=False):
+        """
+        :param encoded: Return the labels as the [activity, gait event] codes of activity_vocabulary and
+         gait_event_vocabulary instead of strings
+        :return: Dictionary with the N×3 joint angles of every joint (and extra channel) and the N×2 'Labels', 'none' for
+         the samples outside the gait cycles (see TrialLabelsLoader.get_labels)
+        """
+        from tqdm import tqdm
+        files = self.subject_files(idx=idx)
+        if len(files) == 0:
+            raise ValueError(f"Subject: '{self.subjects[idx]}' has no trials.")
+
+        with self.instrumentation.span('load_subject', subject=self.subjects[idx]) as span:
+            if self.workers > 1:
+                with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                    # map keeps the order of the files, so the result is the same as the serial path
+                    trials_data = list(tqdm(executor.map(self.load_trial_entry, *zip(*files)), total=len(files)))
+                for _, spans in trials_data:
+                    self.instrumentation.merge(spans)
+                trials_data = [trial_data for trial_data, _ in trials_data]
+            else:
+                trials_data = [self.load_trial(trial=trial, label=label) for trial, label in tqdm(files)]
+
+            data = self.assemble(trials_data)
+            if not encoded:
+                data['Labels'] = decode_labels(data['Labels'])
+            span.add(trials=len(files), samples=len(data['Labels']))
 
         return data
+
+    def assemble(self, trials_data):
+        """
+        Copy the trials of a subject into arrays sized once for all of them
+        :param trials_data: List with the data of every trial (see load_trial)
+        :return: Dictionary with the N×3 joint angles of every joint (and extra channel) and the N×2 'Labels' codes
+        """
+        lengths = [len(trial_data['labels']) for trial_data in trials_data]
+        starts = np.concatenate([[0], np.cumsum(lengths)])
+        joint_names = list(self.joints.keys())
+
+        # Joints first, so the angles of every joint are a contiguous N×3 block
+        first_trial = trials_data[0]
+        joint_angles = np.empty((len(joint_names), starts[-1]) + first_trial['joint_angle'].shape[2:],
+                                dtype=np.result_type(*{trial_data['joint_angle'].dtype for trial_data in trials_data}))
+        labels = np.empty((starts[-1],) + first_trial['labels'].shape[1:], dtype=first_trial['labels'].dtype)
+        extra = {channel: np.empty((starts[-1],) + channel_data.shape[1:], dtype=channel_data.dtype)
+                 for channel, channel_data in first_trial['extra'].items()}
+        for start, end, trial_data in zip(starts[:-1], starts[1:], trials_data):
+            joint_angles[:, start:end] = trial_data['joint_angle']
+            labels[start:end] = trial_data['labels']
+            for channel, channel_data in trial_data['extra'].items():
+                extra[channel][start:end] = channel_data
+
+        data = {joint: joint_angles[i] for i, joint in enumerate(joint_names)}
+        data.update(extra)
+        data['Labels'] = labels
+
+        return data
+
+    @staticmethod
+    def trial_key(file):
+        """
+        :return: (subject, trial number) of a data or label file name, None if it does not name a trial
+        """
+        match = trial_file_pattern.match(str(file))
+        return None if match is None else (match.group('subject'), int(match.group('trial')))
+
+    def index_files(self):
+        """
+        Pair the data and label files of every trial by their subject and trial number, listing the folders only once
+        :return: Dictionary {subject: list of (trial, label) file names in the order of the trials}
+        """
+        if self.files_index is None:
+            labels = {self.trial_key(label): label for label in os.listdir(self.labels_path)}
+            files_index = dict()
+            for trial in os.listdir(self.data_path):
+                key = self.trial_key(trial)
+                if key is None:
+                    continue
+                if key not in labels:
+                    print(f"Trial {trial} has no labels, skipping...")
+                    continue
+                files_index.setdefault(key[0], list()).append((key[1], trial, labels[key]))
+            self.files_index = {subject: [(trial, label) for _, trial, label in sorted(trials)]
+                                for subject, trials in files_index.items()}
+
+        return self.files_index
+
+    def subject_files(self, idx):
+        """
+        :return: List of (trial, label) file names of a subject
+        """
+        return self.index_files().get(self.subjects[idx], list())
+
+    def subject_paths(self, idx):
+        """
+        :return: List with the paths of every data and label file of a subject
+        """
+        return [path for trial, label in self.subject_files(idx=idx) for path in
+                [os.path.join(self.data_path, trial), os.path.join(self.labels_path, label)]]
+
+    def load_trial(self, trial, label):
+        """
+        Decode the joint angles and labels of a trial, or read them from the cache when they did not change
+        :return: Dictionary with the J×N×3 'joint_angle' array (joints in the order of self.joints), the N×2 'labels'
+         array of codes, the 'sample_rate' of the trial and the 'extra' dictionary {name: N×M matrix} of the extra channels
+        """
+        data_path = os.path.join(self.data_path, trial)
+        label_path = os.path.join(self.labels_path, label)
+        joint_labels = list(self.joints.values())
+        # The extra channels are part of the cache key, so entries with different channels never mix
+        cache_key = joint_labels + [f"{name}:{modality}:{label}" for name, (modality, label) in
+                                    self.extra_channels.items()]
+
+        with self.instrumentation.span('load_trial', subject=trial.split('T')[0], trial=trial) as span:
+            span.add(trials=1)
+            if self.cache is not None:
+                trial_data = self.cache.get(data_path=data_path, label_path=label_path, joints=cache_key)
+                if trial_data is not None:
+                    span.add(cache_hits=1, samples=len(trial_data['labels']))
+                    return trial_data
+
+            trial_data = self.decode_trial(data_path=data_path, label_path=label_path, joint_labels=joint_labels)
+            span.add(samples=len(trial_data['labels']))
+
+            if self.cache is not None:
+                self.cache.put(data_path=data_path, label_path=label_path, joints=cache_key, **trial_data)
+
+        return trial_data
+
+    def load_trial_entry(self, trial, label):
+        """
+        Load a trial in a worker process
+        :return: Trial data (see load_trial) and the spans recorded in the worker
+        """
+        trial_data = self.load_trial(trial=trial, label=label)
+        return trial_data, self.instrumentation.pop_spans()
+
+    def decode_trial(self, data_path, label_path, joint_labels):
+        """
+        :return: Trial data (see load_trial) decoded from the .mat files
+        """
+        # Only the joint angles used by the dataset (and the extra channels) are decoded from the Xsens export
+        modalities = {'joint_angle': list(joint_labels)}
+        for modality, label_ in self.extra_channels.values():
+            modalities.setdefault(modality, list())
+            if label_ not in modalities[modality]:
+                modalities[modality].append(label_)
+        trial_data_loader = TrialDataLoader(data_path=data_path, modalities=modalities)
+        joint_angle = np.stack([trial_data_loader.joint_angle(joint_label) for joint_label in joint_labels])
+        trial_label_loader = TrialLabelsLoader(label_path=label_path, length_data=joint_angle.shape[1])
+        trial_data = {'joint_angle': joint_angle,
+                      'labels': trial_label_loader.get_label_codes(),
+                      'sample_rate': trial_data_loader.get_sample_rate(),
+                      'extra': {name: trial_data_loader.get_modality(modality)[label_] for name, (modality, label_) in
+                                self.extra_channels.items()}}
+
+        return trial_data
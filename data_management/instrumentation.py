@@ -0,0 +1,208 @@
+import os
+import json
+import time
+import threading
+
+from contextlib import contextmanager
+
+
+def read_io():
+    """
+    :return: (bytes read, bytes written) by the process so far, including reads served from the page cache, or
+     (None, None) where /proc/self/io is not available
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(': ') for line in f.read().splitlines())
+        return int(counters['rchar']), int(counters['wchar'])
+    except (OSError, KeyError, ValueError):
+        return None, None
+
+
+def read_peak_rss(reset=False):
+    """
+    :param reset: Reset the peak resident set size after reading it (Linux only), so the next read is the peak since now
+    :return: Peak resident set size of the process (bytes), None if it cannot be measured
+    """
+    try:
+        with open('/proc/self/status') as f:
+            peak = next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmHWM'))
+    except (OSError, StopIteration):
+        try:
+            import resource
+        except ImportError:
+            return None
+        # ru_maxrss cannot be reset and is in kilobytes on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    if reset:
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+
+    return peak
+
+
+class Span:
+    """
+    Measures of a stage of a run: wall and CPU time, bytes read and written and peak RSS of the process while the stage
+    runs, item counts (trials, strides, outliers...) and attributes identifying it (subject, joint...)
+    """
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self.counts = dict()
+        self.pid, self.tid = os.getpid(), threading.get_ident()
+        self.start = time.time()
+        self.wall_time, self.cpu_time = None, None
+        self.bytes_read, self.bytes_written = None, None
+        self.peak_rss = None
+
+    def add(self, **counts):
+        """
+        Add to the item counts of the span, e.g. span.add(strides=len(strides))
+        """
+        for key, value in counts.items():
+            self.counts[key] = self.counts.get(key, 0) + int(value)
+
+    def to_dict(self):
+        return {'name': self.name, 'attributes': self.attributes, 'counts': self.counts, 'pid': self.pid,
+                'tid': self.tid, 'start': self.start, 'wall_time': self.wall_time, 'cpu_time': self.cpu_time,
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written, 'peak_rss_bytes': self.peak_rss}
+
+
+class Instrumentation:
+    """
+    Record spans of the stages of a run and pass every finished span to the hooks. Spans nest: the peak RSS of a span
+    includes the peaks of the spans it contains. Spans recorded in worker processes are returned to the main process
+    with pop_spans and merge.
+    """
+    def __init__(self, hooks=None, enabled=True):
+        """
+        :param hooks: Functions called with every finished Span, e.g. to log it
+        :param enabled: Record nothing when False, so components can always open spans
+        """
+        self.hooks = list() if hooks is None else list(hooks)
+        self.enabled = enabled
+        self.spans = list()
+        self.open_spans = list()
+
+    def __getstate__(self):
+        # Hooks may not be picklable, workers record spans without them and the main process calls the hooks on merge
+        state = self.__dict__.copy()
+        state.update(hooks=list(), spans=list(), open_spans=list())
+        return state
+
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+
+    def update_peaks(self):
+        # The peak RSS is reset at every span boundary, so each open span keeps the maximum of the peaks in between
+        peak = read_peak_rss(reset=True)
+        if peak is not None:
+            for span in self.open_spans:
+                span.peak_rss = peak if span.peak_rss is None else max(span.peak_rss, peak)
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """
+        Context manager measuring the code it wraps, e.g.
+            with instrumentation.span('normalize_subject', subject='AB01') as span:
+                span.add(strides=len(strides))
+        """
+        span = Span(name, attributes)
+        if not self.enabled:
+            yield span
+            return
+
+        self.update_peaks()
+        self.open_spans.append(span)
+        bytes_read, bytes_written = read_io()
+        cpu_start, wall_start = time.process_time(), time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.wall_time = time.perf_counter() - wall_start
+            span.cpu_time = time.process_time() - cpu_start
+            if bytes_read is not None:
+                bytes_read_end, bytes_written_end = read_io()
+                span.bytes_read, span.bytes_written = bytes_read_end - bytes_read, bytes_written_end - bytes_written
+            self.update_peaks()
+            self.open_spans.remove(span)
+            self.spans.append(span)
+            for hook in self.hooks:
+                hook(span)
+
+    def pop_spans(self):
+        """
+        :return: Finished spans, which are removed from the instrumentation (e.g. to send them from a worker process)
+        """
+        spans, self.spans = self.spans, list()
+        return spans
+
+    def merge(self, spans):
+        """
+        Add the spans recorded by another instrumentation, e.g. in a worker process
+        """
+        for span in spans:
+            self.spans.append(span)
+            for hook in self.hooks:
+                hook(span)
+
+    def summary(self):
+        """
+        :return: Dictionary {span name: totals of its spans}
+        """
+        summary = dict()
+        for span in self.spans:
+            totals = summary.setdefault(span.name, {'spans': 0, 'wall_time': 0., 'cpu_time': 0., 'bytes_read': 0,
+                                                    'bytes_written': 0, 'peak_rss_bytes': None, 'counts': dict()})
+            totals['spans'] += 1
+            totals['wall_time'] += span.wall_time
+            totals['cpu_time'] += span.cpu_time
+            totals['bytes_read'] += span.bytes_read or 0
+            totals['bytes_written'] += span.bytes_written or 0
+            if span.peak_rss is not None:
+                totals['peak_rss_bytes'] = max(totals['peak_rss_bytes'] or 0, span.peak_rss)
+            for key, value in span.counts.items():
+                totals['counts'][key] = totals['counts'].get(key, 0) + value
+
+        return summary
+
+    def to_json(self, path=None):
+        """
+        :param path: File to write, the JSON string is returned if not given
+        """
+        report = json.dumps({'spans': [span.to_dict() for span in self.spans], 'summary': self.summary()}, indent=2)
+        if path is None:
+            return report
+        with open(path, 'w') as f:
+            f.write(report)
+
+    def to_chrome_trace(self, path=None):
+        """
+        Export the spans in the Chrome trace event format, to open in chrome://tracing or Perfetto
+        :param path: File to write, the JSON string is returned if not given
+        """
+        events = list()
+        for span in sorted(self.spans, key=lambda span_: span_.start):
+            args = dict(span.attributes, **span.counts)
+            args.update(cpu_time=span.cpu_time, bytes_read=span.bytes_read, bytes_written=span.bytes_written,
+                        peak_rss_bytes=span.peak_rss)
+            events.append({'name': span.name, 'ph': 'X', 'ts': span.start * 1e6, 'dur': span.wall_time * 1e6,
+                           'pid': span.pid, 'tid': span.tid, 'args': args})
+        trace = json.dumps({'traceEvents': events, 'displayTimeUnit': 'ms'})
+        if path is None:
+            return trace
+        with open(path, 'w') as f:
+            f.write(trace)
+
+
+def print_span(span):
+    """
+    Hook printing a line per finished span
+    """
+    attributes = ', '.join(f"{key}={value}" for key, value in list(span.attributes.items()) + list(span.counts.items()))
+    print(f"{span.name}({attributes}): {span.wall_time:.3f} s wall, {span.cpu_time:.3f} s CPU")
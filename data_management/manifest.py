@@ -0,0 +1,84 @@
+import os
+import json
+import hashlib
+
+
+class Manifest:
+    """
+    Record, for every output of a run, the content hashes of its inputs and the parameters it was built with, so the
+    next run only recomputes the outputs whose inputs or parameters changed. The manifest is a JSON file. The hash of
+    a file is cached with its size and modification time, so unchanged files are not read again.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.manifest = {'outputs': dict(), 'hashes': dict()}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.manifest = json.load(f)
+
+    @staticmethod
+    def output_path(path, storage='directory'):
+        """
+        :return: Path of the manifest of a dataset saved as a directory tree or as a store file
+        """
+        if storage == 'store':
+            return f"{path}.manifest.json"
+        return os.path.join(path, 'manifest.json')
+
+    def file_hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        cached = self.manifest['hashes'].get(path)
+        if cached is not None and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+            return cached[2]
+
+        content_hash = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                content_hash.update(block)
+        self.manifest['hashes'][path] = [stat.st_size, stat.st_mtime_ns, content_hash.hexdigest()]
+
+        return content_hash.hexdigest()
+
+    @staticmethod
+    def data_hash(data):
+        """
+        :return: Content hash of an array, for inputs that are not files (e.g. the entries of a store)
+        """
+        content_hash = hashlib.sha1(f"{data.dtype.str}{data.shape}".encode())
+        content_hash.update(memoryview(data).cast('B') if data.flags.c_contiguous else data.tobytes())
+        return content_hash.hexdigest()
+
+    def signature(self, inputs, params):
+        """
+        :param inputs: List of input files, or dictionary {input name: content hash}
+        :param params: JSON serializable parameters of the output
+        """
+        if not isinstance(inputs, dict):
+            inputs = {os.path.abspath(path): self.file_hash(path) for path in inputs}
+
+        return {'inputs': dict(sorted(inputs.items())), 'params': json.loads(json.dumps(params))}
+
+    def is_up_to_date(self, output, inputs, params):
+        return self.manifest['outputs'].get(output) == self.signature(inputs=inputs, params=params)
+
+    def record(self, output, inputs, params):
+        self.manifest['outputs'][output] = self.signature(inputs=inputs, params=params)
+
+    def outputs(self):
+        """
+        :return: Names of the outputs recorded
+        """
+        return list(self.manifest['outputs'].keys())
+
+    def remove(self, output):
+        self.manifest['outputs'].pop(output, None)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,136 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+# Bumped whenever the content of the entries changes, so entries of older versions are never read
+CACHE_VERSION = 2
+
+
+class TrialCache:
+    """
+    On-disk cache of decoded trials. Every entry is a folder with:
+    - joint_angle.npy: J×N×3 array with the joint angles of the trial, in the order of the requested joints
+    - labels.npy: N×2 array with the per-sample label codes computed by TrialLabelsLoader
+    - extra_<i>.npy: N×M array of the i-th extra channel of the trial
+    - meta.json: source files, joints, extra channels and sample rate of the trial
+    The arrays are plain .npy files, so they are memory-mapped on read instead of parsed. Entries are keyed by the path,
+    size and modification time of the source files, and the least recently used ones are evicted when the cache grows
+    over max_size bytes.
+    """
+    def __init__(self, cache_path, max_size=10 * 1024 ** 3):
+        self.cache_path = cache_path
+        self.max_size = max_size
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_path)
+
+    @staticmethod
+    def file_signature(path):
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+    def key(self, data_path, label_path, joints):
+        signature = [self.file_signature(data_path), self.file_signature(label_path), list(joints), CACHE_VERSION]
+        return hashlib.sha1(json.dumps(signature).encode()).hexdigest()
+
+    def entries(self):
+        return [entry for entry in os.listdir(self.cache_path) if not entry.startswith('.')]
+
+    def get(self, data_path, label_path, joints):
+        """
+        :return: Dictionary with the memory-mapped 'joint_angle' and 'labels' arrays and the 'sample_rate' of the trial,
+         None if the trial is not cached or its source files changed
+        """
+        entry_path = os.path.join(self.cache_path, self.key(data_path, label_path, joints))
+        if not os.path.exists(os.path.join(entry_path, 'meta.json')):
+            return None
+
+        with open(os.path.join(entry_path, 'meta.json')) as f:
+            meta = json.load(f)
+        # Mark the entry as recently used for the eviction policy
+        os.utime(entry_path)
+
+        return {'joint_angle': np.load(os.path.join(entry_path, 'joint_angle.npy'), mmap_mode='r'),
+                'labels': np.load(os.path.join(entry_path, 'labels.npy'), mmap_mode='r'),
+                'sample_rate': meta['sample_rate'],
+                'extra': {name: np.load(os.path.join(entry_path, f"extra_{i}.npy"), mmap_mode='r')
+                          for i, name in enumerate(meta.get('extra', list()))}}
+
+    def put(self, data_path, label_path, joints, joint_angle, labels, sample_rate, extra=None):
+        """
+        Store a decoded trial, replacing the stale entries of the same source files
+        :param joint_angle: J×N×3 array with the joint angles in the order of joints
+        :param labels: N×2 array with the label codes of the trial
+        :param sample_rate: Sample rate of the trial
+        :param extra: Optional dictionary {name: N×M matrix} with other channels of the trial
+        """
+        extra = dict() if extra is None else extra
+        self.invalidate(data_path=data_path, label_path=label_path, joints=joints)
+
+        key = self.key(data_path, label_path, joints)
+        tmp_path = os.path.join(self.cache_path, f".{key}.{os.getpid()}")
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.mkdir(tmp_path)
+
+        np.save(os.path.join(tmp_path, 'joint_angle.npy'), np.asarray(joint_angle))
+        np.save(os.path.join(tmp_path, 'labels.npy'), np.asarray(labels))
+        for i, channel_data in enumerate(extra.values()):
+            np.save(os.path.join(tmp_path, f"extra_{i}.npy"), np.asarray(channel_data))
+        size = sum(os.path.getsize(os.path.join(tmp_path, file)) for file in os.listdir(tmp_path))
+        meta = {'sources': [os.path.abspath(data_path), os.path.abspath(label_path)],
+                'joints': list(joints),
+                'extra': list(extra.keys()),
+                'sample_rate': np.asarray(sample_rate).item(),
+                'size': size}
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+        try:
+            os.rename(tmp_path, os.path.join(self.cache_path, key))
+        except OSError:
+            # Another process cached the same trial first
+            shutil.rmtree(tmp_path)
+
+        self.evict()
+
+    def read_meta(self, entry):
+        try:
+            with open(os.path.join(self.cache_path, entry, 'meta.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def invalidate(self, data_path=None, label_path=None, joints=None):
+        """
+        Remove the entries built from the given source files (and joints, if given), or every entry when no file is
+        given
+        """
+        sources = {os.path.abspath(path) for path in (data_path, label_path) if path is not None}
+        for entry in self.entries():
+            meta = self.read_meta(entry)
+            if meta is not None and joints is not None and meta['joints'] != list(joints):
+                continue
+            if len(sources) == 0 or meta is None or len(sources.intersection(meta['sources'])) > 0:
+                shutil.rmtree(os.path.join(self.cache_path, entry), ignore_errors=True)
+
+    def size(self):
+        return sum(meta['size'] for meta in map(self.read_meta, self.entries()) if meta is not None)
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_size bytes
+        """
+        entries = list()
+        for entry in self.entries():
+            meta = self.read_meta(entry)
+            if meta is not None:
+                entries.append((os.path.getmtime(os.path.join(self.cache_path, entry)), meta['size'], entry))
+
+        total_size = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries):
+            if total_size <= self.max_size:
+                break
+            shutil.rmtree(os.path.join(self.cache_path, entry), ignore_errors=True)
+            total_size -= size
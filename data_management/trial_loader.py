@@ -1,14 +1,35 @@
 import numpy as np
 
-from scipy.io import loadmat
+from data_management.categorical import activity_vocabulary, gait_event_vocabulary
+
+
+# Position of every modality inside the kinematic data struct and the setup labels that name its entries
+kin_modalities = {'joint_angle': (0, 'joint_label'),
+                  'acceleration': (1, 'segment_label'),
+                  'velocity': (2, 'segment_label'),
+                  'position': (3, 'segment_label'),
+                  'orientation_quaternion': (4, 'segment_label'),
+                  'orientation_euler': (5, 'segment_label'),
+                  'angular_acceleration': (6, 'segment_label'),
+                  'angular_velocity': (7, 'segment_label'),
+                  'sensor_acceleration': (8, 'sensor_label'),
+                  'sensor_orientation': (9, 'sensor_label'),
+                  'sensor_angular_velocity': (10, 'sensor_label')}
 
 
 class TrialDataLoader:
     """
     Make structure for kinetic information
     """
-    def __init__(self, data_path):
-        data = loadmat(data_path)
+    def __init__(self, data_path, lazy=False, modalities=None):
+        """
+        :param data_path: Path of the kin .mat file
+        :param lazy: Decode each modality only the first time it is accessed
+        :param modalities: Dictionary {modality: list of labels} with the only data a run needs, e.g.
+         {'joint_angle': ['jRightKnee', 'jLeftKnee']}. They are decoded right away and the raw struct is released.
+        """
+        from scipy.io import loadmat
+        data = loadmat(data_path, variable_names=['kin'])
         self.kin = data['kin']
         # Setup Information
         kin_setup_info = self.kin[0][0][0][0][0]
@@ -17,33 +38,48 @@ class TrialDataLoader:
                           'joint_label': [i[0][0] for i in kin_setup_info[2]],
                           'num_trials': kin_setup_info[3][0][0]}
         # Kinematic Data
-        kin_data_info = self.kin[0][0][1][0][0]
-        self.kin_data = {'joint_angle': {self.kin_setup['joint_label'][i]: kin_data_info[0][0][0][i] for i in
-                                         range(len(self.kin_setup['joint_label']))},
-                         'acceleration': {self.kin_setup['segment_label'][i]: kin_data_info[1][0][0][i] for i in
-                                          range(len(self.kin_setup['segment_label']))},
-                         'velocity': {self.kin_setup['segment_label'][i]: kin_data_info[2][0][0][i] for i in
-                                      range(len(self.kin_setup['segment_label']))},
-                         'position': {self.kin_setup['segment_label'][i]: kin_data_info[3][0][0][i] for i in
-                                      range(len(self.kin_setup['segment_label']))},
-                         'orientation_quaternion': {self.kin_setup['segment_label'][i]: kin_data_info[4][0][0][i] for i
-                                                    in range(len(self.kin_setup['segment_label']))},
-                         'orientation_euler': {self.kin_setup['segment_label'][i]: kin_data_info[5][0][0][i] for i in
-                                               range(len(self.kin_setup['segment_label']))},
-                         'angular_acceleration': {self.kin_setup['segment_label'][i]: kin_data_info[6][0][0][i] for i in
-                                                  range(len(self.kin_setup['segment_label']))},
-                         'angular_velocity': {self.kin_setup['segment_label'][i]: kin_data_info[7][0][0][i] for i in
-                                              range(len(self.kin_setup['segment_label']))},
-                         'sensor_acceleration': {self.kin_setup['sensor_label'][i]: kin_data_info[8][0][0][i] for i in
-                                                 range(len(self.kin_setup['sensor_label']))},
-                         'sensor_orientation': {self.kin_setup['sensor_label'][i]: kin_data_info[9][0][0][i] for i in
-                                                range(len(self.kin_setup['sensor_label']))},
-                         'sensor_angular_velocity': {self.kin_setup['sensor_label'][i]: kin_data_info[10][0][0][i] for i
-                                                     in range(len(self.kin_setup['sensor_label']))}
-                         }
+        self.kin_data = dict()
+        if modalities is not None:
+            for modality, labels in modalities.items():
+                self.kin_data[modality] = {label: np.array(value) for label, value in
+                                           self.decode_modality(modality, labels=labels).items()}
+        elif not lazy:
+            for modality in kin_modalities.keys():
+                self.kin_data[modality] = self.decode_modality(modality)
         # Sample Rate
         self.sample_rate = self.kin[0][0][2][0][0]
 
+        if modalities is not None:
+            self.kin = None
+
+    def decode_modality(self, modality, labels=None):
+        """
+        Build the dictionary {label: N×M matrix} of a modality from the raw struct
+        :param modality: Name of the modality, one of the keys of kin_modalities
+        :param labels: Labels to decode, all of them when None
+        """
+        if modality not in kin_modalities:
+            raise ValueError(f"Modality: '{modality}' is not supported.")
+        if self.kin is None:
+            raise KeyError(f"Modality: '{modality}' was not selected when loading the trial.")
+
+        position, label_key = kin_modalities[modality]
+        modality_info = self.kin[0][0][1][0][0][position][0][0]
+        all_labels = self.kin_setup[label_key]
+        if labels is None:
+            labels = all_labels
+
+        return {label: modality_info[all_labels.index(label)] for label in labels}
+
+    def get_modality(self, modality):
+        """
+        :return: Dictionary {label: N×M matrix} of the modality, decoded on first access
+        """
+        if modality not in self.kin_data:
+            self.kin_data[modality] = self.decode_modality(modality)
+
+        return self.kin_data[modality]
+
     def segment_label(self):
         """
         :return: 23×1 array containing the names of the body segments
@@ -74,14 +110,14 @@ class TrialDataLoader:
         Get the string of the sensor label
         :return: N×3 matrix containing sensor acceleration vector (x,y,z) at each time point N (units: m/s2)
         """
-        return self.kin_data['sensor_acceleration'][sensor_label]
+        return self.get_modality('sensor_acceleration')[sensor_label]
 
     def sensor_angular_velocity(self, sensor_label):
         """
         Get the string of the sensor label
         :return: N×3 matrix containing sensor angular velocity vector (x,y,z) at each time point N (units: rad/s2)
         """
-        return self.kin_data['sensor_angular_velocity'][sensor_label]
+        return self.get_modality('sensor_angular_velocity')[sensor_label]
 
     def sensor_orientation(self, sensor_label):
         """
@@ -89,21 +125,21 @@ class TrialDataLoader:
         :return: N×3 matrix containing sensor orientation vector (x,y,z) at each time point N in the global frame
          (units: m)
         """
-        return self.kin_data['sensor_orientation'][sensor_label]
+        return self.get_modality('sensor_orientation')[sensor_label]
 
     def orientation_quaternion(self, segment_label):
         """
         Get the string of the segment label
         :return: N×4 matrix containing segment orientation quaternion (q0, q1, q2, q3) at each time point N
         """
-        return self.kin_data['orientation_quaternion'][segment_label]
+        return self.get_modality('orientation_quaternion')[segment_label]
 
     def orientation_euler(self, segment_label):
         """
         Get the string of the segment label
         :return: N×3 matrix containing segment orientation (x,y,z) at each time point N (units: m)
         """
-        return self.kin_data['orientation_euler'][segment_label]
+        return self.get_modality('orientation_euler')[segment_label]
 
     def position(self, segment_label):
         """
@@ -111,7 +147,7 @@ class TrialDataLoader:
         :return: N×3 matrix containing the position vector (x, y, z) of the origin of the segment in the global frame
          at each time point N (units: m)
         """
-        return self.kin_data['position'][segment_label]
+        return self.get_modality('position')[segment_label]
 
     def velocity(self, segment_label):
         """
@@ -119,7 +155,7 @@ class TrialDataLoader:
         :return: N×3 matrix containing the velocity vector (x, y, z) of the origin of the segment in the global frame at
          each time point N (units: m/s)
         """
-        return self.kin_data['velocity'][segment_label]
+        return self.get_modality('velocity')[segment_label]
 
     def acceleration(self, segment_label):
         """
@@ -127,7 +163,7 @@ class TrialDataLoader:
         :return: N×3 matrix containing the acceleration vector (x, y, z) of the origin of the segment in the global
          frame at each time point N (units: m/s2)
         """
-        return self.kin_data['acceleration'][segment_label]
+        return self.get_modality('acceleration')[segment_label]
 
     def angular_velocity(self, segment_label):
         """
@@ -135,7 +171,7 @@ class TrialDataLoader:
         :return: N×3 matrix containing the angular velocity vector (x, y, z) of the segment in the global frame in
         (units: rad/s)
         """
-        return self.kin_data['angular_velocity'][segment_label]
+        return self.get_modality('angular_velocity')[segment_label]
 
     def angular_acceleration(self, segment_label):
         """
@@ -143,7 +179,7 @@ class TrialDataLoader:
         :return: N×3 matrix containing the angular acceleration vector (x, y, z) of the segment in the global frame in
         (units: rad/s2)
         """
-        return self.kin_data['angular_acceleration'][segment_label]
+        return self.get_modality('angular_acceleration')[segment_label]
 
     def joint_angle(self, joint_label):
         """
@@ -151,7 +187,7 @@ class TrialDataLoader:
         :return: N×3 matrix containing the Euler representation of the joint angle vector (x, y, z) calculated using the
          Euler sequence ZXY (units: deg)
         """
-        return self.kin_data['joint_angle'][joint_label]
+        return self.get_modality('joint_angle')[joint_label]
 
     def get_sample_rate(self):
         """
@@ -194,6 +230,7 @@ class TrialLabelsLoader:
     - SA/SD = Stair ascent and Stair descent
     """
     def __init__(self, label_path, length_data):
+        from scipy.io import loadmat
         label = loadmat(label_path)['gc']
         # Take relevant information of the file
         self.index = label[0][0][1]
@@ -213,35 +250,59 @@ class TrialLabelsLoader:
                         self.index[i][-1] == self.index[i + 1][0]):
                     self.unlabeled_index.append(range(self.index[i][-1], self.index[i + 1][0]))
 
+    def unlabeled_mask(self):
+        """
+        :return: Boolean array of length N that is True on the samples lying in a gap between two gait cycles
+        """
+        mask = np.zeros(self.length_data + 1, dtype=int)
+        if len(self.unlabeled_index) > 0:
+            starts = np.clip([gap.start for gap in self.unlabeled_index], 0, self.length_data)
+            stops = np.clip([gap.stop for gap in self.unlabeled_index], 0, self.length_data)
+            valid = starts < stops
+            np.add.at(mask, starts[valid], 1)
+            np.add.at(mask, stops[valid], -1)
+
+        return np.cumsum(mask[:-1]) > 0
+
+    def get_label_codes(self):
+        """
+        Labeled of the data with the codes of activity_vocabulary and gait_event_vocabulary. Every sample is located
+        between the sorted gait event boundaries with a binary search, so the cost grows with the number of samples plus
+        the number of events instead of their product. A trial with fewer than 2 gait events has no gait cycle, all its
+        samples get the code of 'none' like the samples outside the gait cycles.
+        :return: N×2 array with the [activity, gait event] codes of the data
+        """
+        labels = np.zeros((self.length_data, 2), dtype=np.int8)
+        index = np.unique(self.index)
+        if len(index) < 2 or self.length_data == 0:
+            return labels
+
+        samples = np.arange(self.length_data)
+        # Position j of each sample such that index[j] <= i < index[j + 1], the last event keeps its own label
+        interval = np.searchsorted(index, samples, side='right') - 1
+        labeled = (samples >= index[0]) & (samples <= index[-1])
+        labeled &= ~(self.unlabeled_mask() & (samples < index[-1]))
+
+        used_interval, inverse = np.unique(interval[labeled], return_inverse=True)
+        labels_info = [self.labels_info[index[j]] for j in used_interval]
+        labels[labeled, 0] = activity_vocabulary.encode([event_labels[info['event']] for info in labels_info])[inverse]
+        labels[labeled, 1] = gait_event_vocabulary.encode([gait_event_labels[info['gait_event']] for info in
+                                                           labels_info])[inverse]
+
+        return labels
+
     def get_labels(self):
         """
-        Labeled of the data
+        Labeled of the data. The samples of a trial with fewer than 2 gait events are labeled 'none' (they used to be
+        None), so they are dropped with the other unlabeled samples (see NormalizeDataset.remove_nones).
         :return: List with labels of data
         """
-        labels = []
-        index = np.unique(self.index)
-        for i in range(self.length_data):
-            flag = False
-            label_gait_event = None
-            label_event = None
-            for j in range(len(index)-1):
-                if i < index[0] or i > index[-1]:
-                    label_gait_event = gait_event_labels['None']
-                    label_event = event_labels['None']
-                elif index[j] <= i < index[j+1]:
-                    for k in range(len(self.unlabeled_index)):
-                        if i in self.unlabeled_index[k]:
-                            flag = True
-                    if flag is False:
-                        label_gait_event = gait_event_labels[self.labels_info[index[j]]['gait_event']]
-                        label_event = event_labels[self.labels_info[index[j]]['event']]
-                    else:
-                        label_gait_event = gait_event_labels['None']
-                        label_event = event_labels['None']
-                elif index[-2] <= i <= index[-1]:
-                    label_gait_event = gait_event_labels[self.labels_info[index[-1]]['gait_event']]
-                    label_event = event_labels[self.labels_info[index[-1]]['event']]
-
-            labels.append([label_event, label_gait_event])
-
-        return np.array(labels)
+        return decode_labels(self.get_label_codes())
+
+
+def decode_labels(labels):
+    """
+    :param labels: N×2 array with [activity, gait event] codes
+    :return: N×2 array with the [activity, gait event] labels
+    """
+    return np.column_stack([activity_vocabulary.decode(labels[:, 0]), gait_event_vocabulary.decode(labels[:, 1])])
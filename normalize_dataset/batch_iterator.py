@@ -0,0 +1,175 @@
+import queue
+import threading
+import numpy as np
+
+from normalize_dataset.precision import decode
+
+
+class BatchIterator:
+    """
+    Iterate over shuffled mini-batches of strides of a selection of subjects, joints and activities of a normalized
+    dataset. The entries are memory-mapped and only the rows of each batch are read, so an epoch never loads the whole
+    selection in memory. The entries of a compressed store are the exception: they are decompressed once, when the
+    iterator is built, and stay in memory (in their stored precision) as long as the iterator. Batches are gathered in
+    a background thread while the previous ones are consumed.
+    Every iteration is a new epoch, shuffled with a seed derived from the seed of the iterator and the epoch number, so
+    runs are reproducible.
+    """
+    def __init__(self, data_loader, subjects=None, joints=None, activities=None, batch_size=64, shuffle_data=True,
+                 seed=0, prefetch=2, drop_last=False):
+        """
+        :param data_loader: NormalizedDataLoader of the dataset
+        :param subjects: Subjects of the selection, all if not given (same for joints and activities)
+        :param prefetch: Number of batches gathered ahead of the consumer, 0 to gather them in the calling thread
+        :param drop_last: Skip the last batch of an epoch when it is smaller than batch_size
+        """
+        self.data_loader = data_loader
+        self.batch_size = batch_size
+        self.shuffle_data = shuffle_data
+        self.seed = seed
+        self.prefetch = prefetch
+        self.drop_last = drop_last
+        self.epoch = 0
+
+        subjects = data_loader.subjects() if subjects is None else subjects
+        # Entries are kept in their stored precision, every batch only decodes the strides it reads. Compressed entries
+        # are decompressed here and held in memory.
+        self.entries, self.arrays, self.encodings = list(), list(), list()
+        for subject in subjects:
+            for entry in data_loader.select(subjects=[subject], joints=joints, activities=activities):
+                if data_loader.catalog.entry(*entry)['strides'] > 0:
+                    array, encoding = data_loader.get_stored(*entry)
+                    self.entries.append(entry)
+                    self.arrays.append(array)
+                    self.encodings.append(encoding)
+
+        if len({array.shape[1:] for array in self.arrays}) > 1:
+            raise ValueError("Selection: strides of different shapes can not be batched together.")
+        self.stride_shape = self.arrays[0].shape[1:] if len(self.arrays) > 0 else ()
+        dtypes = {array.dtype if encoding is None else np.dtype(encoding['dtype'])
+                  for array, encoding in zip(self.arrays, self.encodings)}
+        self.dtype = np.result_type(*dtypes) if len(dtypes) > 0 else np.dtype(float)
+
+        # Entry and row of every stride of the selection, and the [subject, joint, activity] codes of every entry
+        lengths = np.array([array.shape[0] for array in self.arrays], dtype=np.int64)
+        self.stride_entries = np.repeat(np.arange(len(self.arrays)), lengths)
+        self.stride_rows = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        self.entry_labels = np.empty((0, 3), dtype=np.int8)
+        if len(self.entries) > 0:
+            self.entry_labels = np.concatenate([data_loader.label_rows(*entry, n=1, encoded=True)
+                                                for entry in self.entries])
+
+    def __len__(self):
+        """
+        :return: Number of batches of an epoch
+        """
+        if self.drop_last:
+            return len(self.stride_entries) // self.batch_size
+        return -(-len(self.stride_entries) // self.batch_size)
+
+    def num_strides(self):
+        return len(self.stride_entries)
+
+    def order(self, epoch):
+        """
+        :return: Indices of the strides of the selection in the order of an epoch
+        """
+        if not self.shuffle_data:
+            return np.arange(len(self.stride_entries))
+        return np.random.default_rng([self.seed, epoch]).permutation(len(self.stride_entries))
+
+    def gather(self, strides_idx):
+        """
+        :return: Batch (x, y) with the strides and the [subject, joint, activity] codes of strides_idx. The rows of each
+         entry are read in file order.
+        """
+        entries, rows = self.stride_entries[strides_idx], self.stride_rows[strides_idx]
+        x = np.empty((len(strides_idx),) + self.stride_shape, dtype=self.dtype)
+        order = np.lexsort((rows, entries))
+        bounds = np.flatnonzero(np.diff(entries[order])) + 1
+        for batch_idx in np.split(order, bounds):
+            entry = entries[batch_idx[0]]
+            x[batch_idx] = decode(self.arrays[entry][rows[batch_idx]], self.encodings[entry])
+
+        return x, self.entry_labels[entries]
+
+    def batches(self, epoch):
+        order = self.order(epoch)
+        for i in range(len(self)):
+            yield self.gather(order[i * self.batch_size:(i + 1) * self.batch_size])
+
+    def __iter__(self):
+        epoch = self.epoch
+        self.epoch += 1
+        if self.prefetch <= 0:
+            return self.batches(epoch)
+        return self.prefetched(self.batches(epoch))
+
+    def prefetched(self, batches):
+        """
+        Consume a generator of batches in a background thread, keeping up to self.prefetch batches ready
+        """
+        batch_queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        end = object()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    batch_queue.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def produce():
+            try:
+                for batch in batches:
+                    if not put(batch):
+                        return
+                put(end)
+            except Exception as error:
+                put(error)
+
+        thread = threading.Thread(target=produce, daemon=True)
+        thread.start()
+        try:
+            while True:
+                batch = batch_queue.get()
+                if batch is end:
+                    return
+                if isinstance(batch, Exception):
+                    raise batch
+                yield batch
+        finally:
+            # The consumer may stop early, the producer stops at its next batch
+            stop.set()
+            thread.join()
+
+    def labels(self, y):
+        """
+        :return: [subject, joint, activity] labels of the codes of a batch
+        """
+        return self.data_loader.decode_labels(y)
+
+
+def leave_one_subject_out_splits(subjects):
+    """
+    :return: List of (test subject, train subjects) folds
+    """
+    return [(subject, [train_subject for train_subject in subjects if train_subject != subject])
+            for subject in subjects]
+
+
+def leave_one_subject_out(data_loader, subjects=None, **kwargs):
+    """
+    Iterate over the leave-one-subject-out folds of a dataset
+    :param kwargs: Arguments of the BatchIterator of each fold (joints, activities, batch_size, seed...), the test
+     iterator is not shuffled
+    :return: Generator of (test subject, train BatchIterator, test BatchIterator)
+    """
+    subjects = data_loader.subjects() if subjects is None else subjects
+    for subject, train_subjects in leave_one_subject_out_splits(subjects):
+        train = BatchIterator(data_loader, subjects=train_subjects, **kwargs)
+        test = BatchIterator(data_loader, subjects=[subject], **dict(kwargs, shuffle_data=False))
+        yield subject, train, test
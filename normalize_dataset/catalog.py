@@ -0,0 +1,151 @@
+import os
+import json
+import numpy as np
+
+
+def npy_header(path):
+    """
+    :return: Shape and dtype of a .npy file, read from its header only
+    """
+    with open(path, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, _, dtype = np.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, _, dtype = np.lib.format.read_array_header_2_0(f)
+        else:
+            data = np.load(path, mmap_mode='r')
+            shape, dtype = data.shape, data.dtype
+
+    return shape, dtype
+
+
+class Catalog:
+    """
+    Index of the subject/joint/activity entries of a normalized dataset with the stride count, dtype and shape of each,
+    so listings and selections do not touch the filesystem. A dataset saved as a directory tree keeps it in
+    catalog.json, updated when the dataset is saved; a store file already has it in its index.
+    """
+    file_name = 'catalog.json'
+
+    def __init__(self, entries=None):
+        """
+        :param entries: Dictionary {(subject, joint, activity): {'strides', 'dtype', 'shape'}}
+        """
+        self.entries = dict()
+        self.tree = dict()
+        for key, entry in ({} if entries is None else entries).items():
+            self.add(*key, shape=[entry['strides']] + list(entry['shape']), dtype=entry['dtype'])
+
+    @classmethod
+    def catalog_path(cls, dataset_path):
+        return os.path.join(dataset_path, cls.file_name)
+
+    @classmethod
+    def from_store(cls, store):
+        return cls({tuple(key.split('/')): {'strides': entry['shape'][0], 'dtype': entry['dtype'],
+                                            'shape': entry['shape'][1:]}
+                    for key, entry in store.index['entries'].items()})
+
+    @classmethod
+    def read(cls, dataset_path):
+        """
+        :return: Catalog of a directory tree, read from its catalog.json or built if it has none
+        """
+        if not os.path.isdir(dataset_path):
+            raise FileNotFoundError(f"Dataset: '{dataset_path}' does not exist.")
+        catalog_path = cls.catalog_path(dataset_path)
+        if not os.path.exists(catalog_path):
+            return cls().scan(dataset_path)
+        with open(catalog_path) as f:
+            catalog = json.load(f)
+
+        return cls({tuple(key.split('/')): entry for key, entry in catalog['entries'].items()})
+
+    def save(self, dataset_path):
+        os.makedirs(dataset_path, exist_ok=True)
+        tmp_path = f"{self.catalog_path(dataset_path)}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'entries': {'/'.join(key): entry for key, entry in sorted(self.entries.items())}}, f)
+        os.replace(tmp_path, self.catalog_path(dataset_path))
+
+    def add(self, subject, joint, activity, shape, dtype):
+        self.entries[(subject, joint, activity)] = {'strides': int(shape[0]), 'dtype': np.dtype(dtype).str,
+                                                    'shape': [int(size) for size in shape[1:]]}
+        activities = self.tree.setdefault(subject, dict()).setdefault(joint, list())
+        if activity not in activities:
+            activities.append(activity)
+
+    def remove(self, subject=None, joint=None, activity=None):
+        """
+        Remove the entries matching the given subject, joint and activity (all if not given)
+        """
+        for key in self.select(subjects=None if subject is None else [subject],
+                               joints=None if joint is None else [joint],
+                               activities=None if activity is None else [activity]):
+            del self.entries[key]
+            self.tree[key[0]][key[1]].remove(key[2])
+            if len(self.tree[key[0]][key[1]]) == 0:
+                del self.tree[key[0]][key[1]]
+            if len(self.tree[key[0]]) == 0:
+                del self.tree[key[0]]
+
+    def scan(self, dataset_path, subjects=None):
+        """
+        Read the entries of the given subjects (all the subject folders if not given) from the headers of their .npy
+        files, replacing their previous entries
+        :return: The catalog
+        """
+        if subjects is None:
+            subjects = [subject for subject in sorted(os.listdir(dataset_path))
+                        if os.path.isdir(os.path.join(dataset_path, subject))] if os.path.exists(dataset_path) else []
+        for subject in subjects:
+            self.remove(subject=subject)
+            subject_path = os.path.join(dataset_path, subject)
+            if not os.path.isdir(subject_path):
+                continue
+            for joint in sorted(os.listdir(subject_path)):
+                if not os.path.isdir(os.path.join(subject_path, joint)):
+                    continue
+                for file in sorted(os.listdir(os.path.join(subject_path, joint))):
+                    if file.endswith('.npy'):
+                        shape, dtype = npy_header(os.path.join(subject_path, joint, file))
+                        self.add(subject, joint, file[:-len('.npy')], shape=shape, dtype=dtype)
+
+        return self
+
+    def __contains__(self, key):
+        return tuple(key) in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def entry(self, subject, joint, activity):
+        return self.entries[(subject, joint, activity)]
+
+    def subjects(self):
+        return sorted(self.tree.keys())
+
+    def joints(self, subject):
+        return sorted(self.tree.get(subject, dict()).keys())
+
+    def activities(self, subject, joint):
+        return sorted(self.tree.get(subject, dict()).get(joint, list()))
+
+    def select(self, subjects=None, joints=None, activities=None):
+        """
+        :return: Sorted (subject, joint, activity) keys of the entries in the given subjects, joints and activities
+         (all if not given), e.g. select(joints=['KneeAngles'], activities=['ra2ra'])
+        """
+        subjects = None if subjects is None else set(subjects)
+        joints = None if joints is None else set(joints)
+        activities = None if activities is None else set(activities)
+
+        return sorted(key for key in self.entries.keys() if (subjects is None or key[0] in subjects) and
+                      (joints is None or key[1] in joints) and (activities is None or key[2] in activities))
+
+    def strides(self, subjects=None, joints=None, activities=None):
+        """
+        :return: Number of strides of a selection (see select)
+        """
+        return sum(self.entries[key]['strides'] for key in self.select(subjects, joints, activities))
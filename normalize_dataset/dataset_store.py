@@ -0,0 +1,274 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+
+from normalize_dataset.catalog import Catalog
+from normalize_dataset.precision import encode, decode, tree_encoding
+
+
+# A store is a single file: the stride arrays one after another (aligned to ALIGNMENT bytes), then a JSON index with the
+# offset, shape and dtype of every subject/joint/activity entry, then a footer with the position of the index. Entries
+# stored with a reduced precision or compressed also have their 'encoding' (see encode) and 'compression' in the index.
+MAGIC = b'HKDSTORE'
+FOOTER = struct.Struct('<QQ8s')
+ALIGNMENT = 64
+# Fast block compression of the entries, zlib at its fastest level
+compressions = {'zlib': 1}
+
+
+def entry_key(subject, joint, activity):
+    return f"{subject}/{joint}/{activity}"
+
+
+def max_error(index):
+    return max([entry['encoding'].get('error', 0.) for entry in index['entries'].values() if 'encoding' in entry],
+               default=0.)
+
+
+class DatasetStoreWriter:
+    """
+    Write the normalized dataset into a single store file. The store is written to <path>.tmp and replaces path when
+    the writer is closed, so an interrupted run never leaves a store without its index.
+    """
+    def __init__(self, path, mode='w', precision=None, compression=None):
+        """
+        :param path: Path of the store file
+        :param mode: 'w' to create a new store, 'a' to add (or replace) entries in an existing one
+        :param precision: None to store the arrays as they are, or 'float32', 'float16' or 'int16' (see encode). The
+         arrays are decoded back to their dtype when read.
+        :param compression: None or 'zlib', compression of every entry
+        """
+        if compression is not None and compression not in compressions:
+            raise ValueError(f"Compression: '{compression}' is not supported.")
+        if mode not in ['w', 'a']:
+            raise ValueError(f"Mode: '{mode}' is not supported.")
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.precision = precision
+        self.compression = compression
+        self.index = {'entries': dict(), 'attrs': dict()}
+        # Entries written again, their previous bytes are dropped when the writer is closed
+        self.replaced = 0
+        directory = os.path.dirname(path)
+        if directory != '' and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.file = open(self.tmp_path, 'wb')
+        if mode == 'a' and os.path.exists(path):
+            store = DatasetStore(path)
+            for key in store.keys():
+                self.copy(store, *key)
+            self.index['attrs'].update(store.index['attrs'])
+            store.close()
+
+    def write(self, subject, joint, activity, data):
+        self.write_stored(subject, joint, activity, *encode(np.ascontiguousarray(data), self.precision))
+
+    def write_stored(self, subject, joint, activity, data, encoding=None):
+        """
+        Write an array as it is, with the encoding it was stored with (see encode), e.g. the strides of a tree saved
+        with a reduced precision
+        """
+        entry = {'shape': list(data.shape), 'dtype': data.dtype.str}
+        if encoding is not None:
+            entry['encoding'] = encoding
+        content = np.ascontiguousarray(data).tobytes()
+        if self.compression is not None:
+            content = zlib.compress(content, compressions[self.compression])
+            entry['compression'] = self.compression
+            entry['nbytes'] = len(content)
+        self.write_entry(entry_key(subject, joint, activity), entry, content)
+
+    def copy(self, store, subject, joint, activity):
+        """
+        Copy an entry of another store as it is stored, without decoding it
+        """
+        entry = dict(store.index['entries'][entry_key(subject, joint, activity)])
+        self.write_entry(entry_key(subject, joint, activity), entry, store.content(entry))
+
+    def write_entry(self, key, entry, content):
+        if key in self.index['entries']:
+            self.replaced += 1
+        position = self.file.tell()
+        padding = -position % ALIGNMENT
+        self.file.write(b'\0' * padding)
+        entry = dict({'offset': position + padding},
+                     **{name: value for name, value in entry.items() if name != 'offset'})
+        self.index['entries'][key] = entry
+        self.file.write(content)
+
+    def max_error(self):
+        """
+        :return: Max reconstruction error of the entries stored with a reduced precision
+        """
+        return max_error(self.index)
+
+    def set_attr(self, key, value):
+        """
+        Store a JSON serializable value, e.g. the channel names of a folder
+        """
+        self.index['attrs'][key] = value
+
+    def write_index(self):
+        index = json.dumps(self.index).encode()
+        index_offset = self.file.tell()
+        self.file.write(index)
+        self.file.write(FOOTER.pack(index_offset, len(index), MAGIC))
+        self.file.close()
+
+    def compact(self):
+        """
+        Rewrite the store with the live entries only, in the order of the index, when some were replaced
+        """
+        store = DatasetStore(self.tmp_path)
+        self.index = {'entries': dict(), 'attrs': store.index['attrs']}
+        self.file = open(f"{self.tmp_path}.compact", 'wb')
+        for key, entry in store.index['entries'].items():
+            self.write_entry(key, entry, store.content(entry))
+        store.close()
+        self.write_index()
+        os.replace(f"{self.tmp_path}.compact", self.tmp_path)
+
+    def close(self):
+        if self.file.closed:
+            return
+        self.write_index()
+        if self.replaced > 0:
+            self.compact()
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """
+        Discard what was written, the store at path (if any) is left as it was
+        """
+        if self.file.closed:
+            return
+        self.file.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class DatasetStore:
+    """
+    Read-only view of a store file. The file is memory-mapped once and every entry stored uncompressed in its dtype is
+    returned as a zero-copy slice.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            f.seek(-FOOTER.size, os.SEEK_END)
+            self.index_offset, index_length, magic = FOOTER.unpack(f.read(FOOTER.size))
+            if magic != MAGIC:
+                raise ValueError(f"File: '{path}' is not a dataset store.")
+            f.seek(self.index_offset)
+            self.index = json.loads(f.read(index_length))
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r') if self.index_offset > 0 else None
+
+        self.tree = dict()
+        for key in self.index['entries'].keys():
+            subject, joint, activity = key.split('/')
+            self.tree.setdefault(subject, dict()).setdefault(joint, list()).append(activity)
+
+    @classmethod
+    def from_directory(cls, dataset_path, store_path):
+        """
+        Convert a dataset saved as a <subject>/<joint>/<activity>.npy tree into a store file. The entries are listed
+        by the catalog of the tree, so the files next to the subject folders (catalog.json, manifest.json) are skipped.
+        Strides saved as float32 or float16 keep their dtype and are upcast when read, as from the tree.
+        """
+        catalog = Catalog.read(dataset_path)
+        with DatasetStoreWriter(store_path) as writer:
+            for subject, joint, activity in catalog.select():
+                joint_path = os.path.join(dataset_path, subject, joint)
+                data = np.load(os.path.join(joint_path, f"{activity}.npy"))
+                writer.write_stored(subject, joint, activity, data, tree_encoding(data))
+                channels_path = os.path.join(joint_path, 'channels.txt')
+                if f"{subject}/{joint}/channels" not in writer.index['attrs'] and os.path.exists(channels_path):
+                    with open(channels_path) as f:
+                        writer.set_attr(f"{subject}/{joint}/channels", f.read().split('\n'))
+
+        return cls(store_path)
+
+    def close(self):
+        self.buffer = None
+
+    def __getstate__(self):
+        # The memory map is not pickled (e.g. with the loader of a method run in a worker process), the worker maps the
+        # file again
+        state = self.__dict__.copy()
+        state['buffer'] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.index_offset > 0:
+            self.buffer = np.memmap(self.path, dtype=np.uint8, mode='r')
+
+    def keys(self):
+        return [tuple(key.split('/')) for key in self.index['entries'].keys()]
+
+    def __contains__(self, key):
+        return entry_key(*key) in self.index['entries']
+
+    def __len__(self):
+        return len(self.index['entries'])
+
+    def subjects(self):
+        return sorted(self.tree.keys())
+
+    def joints(self, subject):
+        return sorted(self.tree.get(subject, dict()).keys())
+
+    def activities(self, subject, joint):
+        return sorted(self.tree.get(subject, dict()).get(joint, list()))
+
+    def attr(self, key, default=None):
+        return self.index['attrs'].get(key, default)
+
+    def content(self, entry):
+        """
+        :return: Bytes of an entry as stored in the file
+        """
+        nbytes = entry.get('nbytes', int(np.prod(entry['shape'])) * np.dtype(entry['dtype']).itemsize)
+        if nbytes == 0:
+            return b''
+        return self.buffer[entry['offset']:entry['offset'] + nbytes].tobytes()
+
+    def get_stored(self, subject, joint, activity):
+        """
+        :return: Array of the entry as stored (a read-only view on the memory-mapped file unless it is compressed) and
+         its encoding (see decode), None if it is stored in its dtype
+        """
+        entry = self.index['entries'][entry_key(subject, joint, activity)]
+        dtype = np.dtype(entry['dtype'])
+        shape = tuple(entry['shape'])
+        if int(np.prod(shape)) == 0:
+            return np.empty(shape, dtype=dtype), entry.get('encoding')
+        if 'compression' in entry:
+            data = np.frombuffer(zlib.decompress(self.content(entry)), dtype=dtype).reshape(shape)
+        else:
+            data = np.ndarray(shape=shape, dtype=dtype, buffer=self.buffer, offset=entry['offset'])
+
+        return data, entry.get('encoding')
+
+    def get(self, subject, joint, activity):
+        """
+        :return: Array of the entry, a read-only view on the memory-mapped file when it is stored uncompressed in its
+         dtype, decoded otherwise
+        """
+        return decode(*self.get_stored(subject, joint, activity))
+
+    def max_error(self):
+        """
+        :return: Max reconstruction error of the entries stored with a reduced precision
+        """
+        return max_error(self.index)
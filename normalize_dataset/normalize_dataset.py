@@ -1,19 +1,96 @@
 import os
+import shutil
 import numpy as np
 
-from scipy.interpolate import interp1d
+from concurrent.futures import ProcessPoolExecutor
+
+from data_management.categorical import activity_vocabulary, gait_event_vocabulary, activity_transitions
+from data_management.instrumentation import Instrumentation
+from data_management.manifest import Manifest
+from normalize_dataset.catalog import Catalog
+from normalize_dataset.dataset_store import DatasetStore, DatasetStoreWriter
+from normalize_dataset.precision import check_precision, encode
+
+
+# Degree of the interpolating spline of each supported interpolation
+interpolation_orders = {'linear': 1, 'cubic': 3}
+
+
+def spline_resampling_matrix(length, samples, interpolation='cubic'):
+    """
+    The spline interpolation is linear in the data, so resampling a stride of a given length is a product with a
+    samples×length matrix. It is obtained by interpolating the identity.
+    """
+    x = np.linspace(0, samples, num=length, endpoint=True)
+    x_new = np.linspace(0, samples, num=samples, endpoint=True)
+    from scipy.interpolate import make_interp_spline
+    spline = make_interp_spline(x, np.eye(length), k=interpolation_orders[interpolation])
+
+    return spline(x_new)
+
+
+def resample_strides(matrix, strides):
+    """
+    :param matrix: Resampling matrix of the length of the strides
+    :param strides: Array with the strides of the same length along its second axis
+    """
+    return np.einsum('sl,bl...->bs...', matrix, strides)
 
 
 class NormalizeDataset:
-    def __init__(self, data_loader, gc_key='hs', samples=50, path="normalized_dataset"):
+    def __init__(self, data_loader, gc_key='hs', samples=50, path="normalized_dataset", workers=1,
+                 interpolation='cubic', all_channels=False, storage='directory', incremental=False,
+                 instrumentation=None, shard=None, precision=None, compression=None):
+        """
+        :param precision: None to save the strides in float64, or 'float32', 'float16' or 'int16' (scaled to the range
+         of every array, store only), see encode. The max reconstruction error is reported at the end of the run.
+        :param compression: None or 'zlib' compression of the store entries
+        :param shard: Optional Shard of a run split across nodes. Only the subjects of the shard are processed, into
+         the partial output of the shard (see Shard.path), to be combined by merge_shards.
+        :param instrumentation: Optional Instrumentation recording a 'normalize' span for the run, a
+         'normalize_subject' span per subject and a 'normalize_joint' span per joint (or side)
+        :param incremental: Only process the subjects whose input files or parameters changed since the last run, as
+         recorded in the manifest of the output (see Manifest)
+        :param storage: 'directory' to save a <subject>/<joint>/<activity>.npy tree in path, 'store' to save a single
+         store file in path (see DatasetStoreWriter)
+        :param interpolation: 'cubic' or 'linear' resampling of the strides
+        :param all_channels: Normalize every plane of every joint (and the extra channels of the data loader) in one
+         pass, saving a strides×channels×samples array per side and activity instead of the sagittal angle of each
+         joint
+        :param workers: Number of processes segmenting and saving subjects in parallel. Each subject writes its own
+         files, so the output is the same as the serial run.
+        """
         self.data_loader = data_loader
         self.gc_key = gc_key
         self.samples = samples
-        self.path = path
+        self.shard = shard
+        self.path = path if shard is None else shard.path(path)
+        self.final_path = path
+        self.workers = workers
+        if interpolation not in interpolation_orders:
+            raise ValueError(f"Interpolation: '{interpolation}' is not supported.")
+        self.interpolation = interpolation
+        self.resampling_matrices = dict()
+        self.all_channels = all_channels
+        if storage not in ['directory', 'store']:
+            raise ValueError(f"Storage: '{storage}' is not supported.")
+        self.storage = storage
+        check_precision(precision=precision, compression=compression, storage=storage)
+        self.precision = precision
+        self.compression = compression
+        self.max_error = 0.
+        self.incremental = incremental
+        self.instrumentation = Instrumentation(enabled=False) if instrumentation is None else instrumentation
+        # Arrays (and attributes) of the subject being processed, written to the store by the main process. Arrays are
+        # keyed by entry, the Right_ and Left_ joints of a subject both save to <Joint>Angles and the last one is kept.
+        self.outputs, self.output_attrs = dict(), dict()
 
     @staticmethod
     def remove_nones(data):
-        none_idx = [i for i, label in enumerate(data['Labels'][:, 0]) if label == 'none']
+        """
+        :param data: Dictionary of a subject with the 'Labels' as codes (see DataLoader.get_subject)
+        """
+        none_idx = np.flatnonzero(data['Labels'][:, 0] == activity_vocabulary.code('none'))
 
         new_data = dict()
         for key, value in data.items():
@@ -23,71 +100,114 @@ class NormalizeDataset:
 
     @staticmethod
     def get_stride_idx(gc_event_label, gc_key):
-        stride_idx = list()
-        if gc_event_label[0] == gc_key:
-            stride_idx.append(0)
-
-        for i in range(1, len(gc_event_label)):
-            if gc_event_label[i] == gc_key and gc_event_label[i - 1] != gc_key:
-                stride_idx.append(i)
+        """
+        :return: Array with the first sample of every run of the gait event gc_key, where the strides start
+        """
+        is_key = gc_event_label == gc_key
+        onsets = is_key.copy()
+        onsets[1:] &= ~is_key[:-1]
 
-        return stride_idx
+        return np.flatnonzero(onsets)
 
     @staticmethod
     def normalize_per_gc(stride_idx, data):
-        normalize_data = list()
-        for i in range(len(stride_idx) - 1):
-            normalize_data.append(data[stride_idx[i]:stride_idx[i + 1]])
+        """
+        :return: Ragged strides (offsets, values): values is the view of data from the first to the last stride start
+         and stride i is values[offsets[i]:offsets[i + 1]]
+        """
+        if len(stride_idx) < 2:
+            return np.zeros(1, dtype=np.int64), data[:0]
+
+        return np.asarray(stride_idx, dtype=np.int64) - stride_idx[0], data[stride_idx[0]:stride_idx[-1]]
+
+    @staticmethod
+    def stride_labels(stride_idx, activity_label):
+        """
+        Label the strides from their boundaries: a stride takes the activity of its first sample, or the transition
+        from its first to its last activity when the activity changes inside it (see stride_label)
+        :return: Array with the activity code of every stride
+        """
+        if len(stride_idx) < 2:
+            return np.empty(0, dtype=activity_label.dtype)
+        starts, ends = np.asarray(stride_idx[:-1]), np.asarray(stride_idx[1:]) - 1
+        # Number of activity changes up to every sample, a stride has changes when it differs at its two ends
+        changes = np.concatenate([[0], np.cumsum(activity_label[1:] != activity_label[:-1])])
+        first, last = activity_label[starts], activity_label[ends]
+
+        return np.where(changes[ends] != changes[starts], activity_transitions[first, last], first)
 
-        return normalize_data
+    def resampling_matrix(self, length):
+        """
+        :return: Resampling matrix of a stride length (see spline_resampling_matrix), computed once per length
+        """
+        if length not in self.resampling_matrices:
+            self.resampling_matrices[length] = spline_resampling_matrix(length=length, samples=self.samples,
+                                                                        interpolation=self.interpolation)
+
+        return self.resampling_matrices[length]
 
     def interpolate_data(self, data):
-        new_data = list()
-        for stride in data:
-            x = np.linspace(0, self.samples, num=stride.shape[0], endpoint=True)
-            normalize_obj = interp1d(x, stride, kind='cubic')
-            x_new = np.linspace(0, self.samples, num=self.samples, endpoint=True)
-            new_stride = normalize_obj(x_new)
-            new_data.append(new_stride)
+        """
+        Resample every stride to self.samples points. Strides are grouped by length and each group is gathered from the
+        ragged values and resampled with a single matrix product.
+        :param data: Ragged strides (offsets, values), see normalize_per_gc
+        :return: Array with the resampled strides
+        """
+        offsets, values = data
+        lengths = np.diff(offsets)
+        new_data = np.empty((len(lengths), self.samples) + values.shape[1:], dtype=np.result_type(values, float))
+        for length in np.unique(lengths):
+            strides_idx = np.flatnonzero(lengths == length)
+            strides = values[offsets[strides_idx, None] + np.arange(length)]
+            new_data[strides_idx] = resample_strides(self.resampling_matrix(int(length)), strides)
 
         return new_data
 
     @staticmethod
-    def label_strides_data(stride_data, stride_labels):
-        data_and_labels = list()
-        for stride, labels in zip(stride_data, stride_labels):
-            activities = list(np.unique(labels))
-            if len(activities) > 1:
-                label = f"{labels[0].split('2')[0]}2{labels[-1].split('2')[0]}"
-            else:
-                label = activities[0]
-            data_and_labels.append((stride, label))
+    def stride_label(labels):
+        """
+        :param labels: Activity codes of the samples of a stride
+        :return: Activity code of the stride, the transition from its first to its last activity if they differ
+        """
+        if len(np.unique(labels)) > 1:
+            return activity_transitions[labels[0], labels[-1]]
+        return labels[0]
 
-        all_labels = np.unique([i[1] for i in data_and_labels])
-        all_data_labelled = {label: list() for label in all_labels}
-
-        for data, label in data_and_labels:
-            all_data_labelled[label].append(data)
-
-        for label in all_data_labelled.keys():
-            all_data_labelled[label] = np.array(all_data_labelled[label])
+    @staticmethod
+    def label_strides_data(stride_data, stride_labels):
+        """
+        :param stride_data: Array of strides
+        :param stride_labels: Activity code of every stride (see stride_labels)
+        :return: Dictionary {activity label: array of strides}, sorted by label
+        """
+        labels = {activity_vocabulary.labels[code]: code for code in np.unique(stride_labels)}
 
-        return all_data_labelled
+        return {label: stride_data[stride_labels == labels[label]] for label in sorted(labels.keys())}
 
     def save_files(self, data, subject, joint):
+        if self.storage == 'store':
+            for label, data_ in data.items():
+                self.outputs[(subject, f"{joint.split('_')[1]}Angles", label)] = data_
+            return
+
         path_lvl_1 = self.path
-        if not os.path.exists(path_lvl_1):
-            os.mkdir(path_lvl_1)
-        path_lvl_2 = os.path.join(path_lvl_1, f"AB{str(subject).zfill(2)}")
-        if not os.path.exists(path_lvl_2):
-            os.mkdir(path_lvl_2)
+        path_lvl_2 = os.path.join(path_lvl_1, subject)
         path_lvl_3 = os.path.join(path_lvl_2, f"{joint.split('_')[1]}Angles")
-        if not os.path.exists(path_lvl_3):
-            os.mkdir(path_lvl_3)
+        # Subjects may be saved concurrently, so the shared folders can be created by another process
+        os.makedirs(path_lvl_3, exist_ok=True)
 
         for label, data_ in data.items():
             file_name = os.path.join(path_lvl_3, f"{label}.npy")
-            np.save(file_name, data_)
+            self.save_array(file_name, data_)
+
+    def save_array(self, file_name, data):
+        """
+        Save an array of a directory tree with the precision of the run
+        """
+        data, encoding = encode(data, self.precision)
+        np.save(file_name, data)
+        if encoding is not None:
+            self.max_error = max(self.max_error, encoding['error'])
 
     def segment_by_gc_key(self, data, subject):
         labels = data.pop('Labels')
@@ -95,22 +215,217 @@ class NormalizeDataset:
         gc_event_label = labels[:, 1]
 
         for joint, angle_values in data.items():
+            if joint not in self.data_loader.joints:
+                continue
             sagittal_data = data[joint][:, 2]
             if joint.split('_')[0] == 'Right':
-                gc_key = f"r{self.gc_key}"
+                gc_key = gait_event_vocabulary.code(f"r{self.gc_key}")
+            else:
+                gc_key = gait_event_vocabulary.code(f"l{self.gc_key}")
+
+            with self.instrumentation.span('normalize_joint', subject=subject,
+                                           joint=joint) as span:
+                stride_idx = self.get_stride_idx(gc_event_label=gc_event_label, gc_key=gc_key)
+                normalize_labels = self.stride_labels(stride_idx=stride_idx, activity_label=activity_label)
+                normalize_data = self.normalize_per_gc(stride_idx=stride_idx, data=sagittal_data)
+                normalize_data = self.interpolate_data(normalize_data)
+
+                all_data_labelled = self.label_strides_data(stride_data=normalize_data, stride_labels=normalize_labels)
+                self.save_files(data=all_data_labelled, subject=subject, joint=joint)
+                span.add(strides=len(normalize_data))
+
+    def save_channel_files(self, data, subject, side, channels):
+        if self.storage == 'store':
+            self.output_attrs[f"{subject}/{side}Channels/channels"] = channels
+            for label, data_ in data.items():
+                self.outputs[(subject, f"{side}Channels", label)] = data_
+            return
+
+        path_lvl_1 = self.path
+        path_lvl_2 = os.path.join(path_lvl_1, subject)
+        path_lvl_3 = os.path.join(path_lvl_2, f"{side}Channels")
+        os.makedirs(path_lvl_3, exist_ok=True)
+
+        with open(os.path.join(path_lvl_3, "channels.txt"), 'w') as f:
+            f.write('\n'.join(channels))
+        for label, data_ in data.items():
+            file_name = os.path.join(path_lvl_3, f"{label}.npy")
+            self.save_array(file_name, data_)
+
+    def segment_channels(self, data, subject):
+        """
+        Normalize all the planes of all the channels of each side at once. The stride boundaries are computed once per
+        side and every stride is saved as a channels×samples matrix, the channel names in channels.txt.
+        """
+        labels = data.pop('Labels')
+        activity_label = labels[:, 0]
+        gc_event_label = labels[:, 1]
+
+        for side in ['Right', 'Left']:
+            side_channels = [channel for channel in data.keys() if channel.split('_')[0] == side]
+            if len(side_channels) == 0:
+                continue
+            channels = [f"{channel}_{axis}" for channel in side_channels for axis in range(data[channel].shape[1])]
+            side_data = np.concatenate([data[channel] for channel in side_channels], axis=1)
+
+            gc_key = gait_event_vocabulary.code(f"{side[0].lower()}{self.gc_key}")
+            with self.instrumentation.span('normalize_joint', subject=subject,
+                                           joint=f"{side}Channels") as span:
+                stride_idx = self.get_stride_idx(gc_event_label=gc_event_label, gc_key=gc_key)
+                normalize_labels = self.stride_labels(stride_idx=stride_idx, activity_label=activity_label)
+                normalize_data = self.normalize_per_gc(stride_idx=stride_idx, data=side_data)
+                normalize_data = np.swapaxes(self.interpolate_data(normalize_data), 1, 2)
+
+                all_data_labelled = self.label_strides_data(stride_data=normalize_data, stride_labels=normalize_labels)
+                self.save_channel_files(data=all_data_labelled, subject=subject, side=side, channels=channels)
+                span.add(strides=len(normalize_data))
+
+    def process_subject(self, idx):
+        """
+        :return: Arrays ({(subject, joint, activity): strides}) and attributes to write in the store, empty when saving
+         a directory tree, and the max reconstruction error of the arrays saved to the directory tree
+        """
+        print(f"Subject {self.subject_name(idx)}...")
+        self.outputs, self.output_attrs, self.max_error = dict(), dict(), 0.
+        with self.instrumentation.span('normalize_subject', subject=self.subject_name(idx)) as span:
+            clean_data = self.remove_nones(data=self.data_loader.get_subject(idx, encoded=True))
+            span.add(samples=len(clean_data['Labels']))
+            if self.all_channels:
+                self.segment_channels(data=clean_data, subject=self.subject_name(idx))
             else:
-                gc_key = f"l{self.gc_key}"
+                self.segment_by_gc_key(data=clean_data, subject=self.subject_name(idx))
+
+        outputs, output_attrs, max_error = self.outputs, self.output_attrs, self.max_error
+        self.outputs, self.output_attrs = dict(), dict()
+
+        return outputs, output_attrs, max_error
+
+    def process_subject_entry(self, idx):
+        """
+        Process a subject in a worker process
+        :return: Result of process_subject and the spans recorded in the worker
+        """
+        result = self.process_subject(idx)
+        spans = self.instrumentation.pop_spans()
+        if self.data_loader.instrumentation is not self.instrumentation:
+            spans += self.data_loader.instrumentation.pop_spans()
+
+        return result, spans
+
+    def merge_spans(self, entries):
+        """
+        Merge the spans of the results of process_subject_entry as they are consumed
+        """
+        for result, spans in entries:
+            self.instrumentation.merge(spans)
+            yield result
 
-            stride_idx = self.get_stride_idx(gc_event_label=gc_event_label, gc_key=gc_key)
-            normalize_labels = self.normalize_per_gc(stride_idx=stride_idx, data=activity_label)
-            normalize_data = self.normalize_per_gc(stride_idx=stride_idx, data=sagittal_data)
-            normalize_data = self.interpolate_data(normalize_data)
+    def subject_name(self, idx):
+        """
+        :return: Name of the outputs of a subject, the name of the subject in the source dataset (e.g. AB01), so adding
+         or removing subjects does not rename the others
+        """
+        return str(self.data_loader.subjects[idx])
 
-            all_data_labelled = self.label_strides_data(stride_data=normalize_data, stride_labels=normalize_labels)
-            self.save_files(data=all_data_labelled, subject=subject, joint=joint)
+    def params(self):
+        """
+        :return: Parameters that change the output of a subject
+        """
+        params = {'gc_key': self.gc_key, 'samples': self.samples, 'interpolation': self.interpolation,
+                  'all_channels': self.all_channels, 'joints': self.data_loader.joints,
+                  'extra_channels': self.data_loader.extra_channels}
+        if self.precision is not None or self.compression is not None:
+            params.update(precision=self.precision, compression=self.compression)
+
+        return params
+
+    def save_results(self, subjects, results, manifest=None, removed=()):
+        """
+        Consume the results of process_subject, writing them to the store when saving a single file. Subjects are
+        written in order as they complete, so the store is the same as in the serial run. In an incremental run the
+        store entries of the subjects that were not processed are copied from the previous store. When saving a
+        directory tree, the catalog of the tree is updated as every subject completes.
+        :param removed: Names of the subjects of the previous run that are no longer in the dataset, dropped from the
+         store or the catalog
+        """
+        max_error = 0.
+        if self.storage == 'store':
+            previous_store = DatasetStore(self.path) if manifest is not None and os.path.exists(self.path) else None
+            dropped = {self.subject_name(idx) for idx in subjects} | set(removed)
+            with DatasetStoreWriter(self.path, precision=self.precision, compression=self.compression) as writer:
+                if previous_store is not None:
+                    for subject, joint, label in previous_store.keys():
+                        if subject not in dropped:
+                            writer.copy(previous_store, subject, joint, label)
+                    for key, value in previous_store.index['attrs'].items():
+                        if key.split('/')[0] not in dropped:
+                            writer.set_attr(key, value)
+                    previous_store.close()
+
+                for idx, (outputs, output_attrs, _) in zip(subjects, results):
+                    for (subject, joint, label), data in outputs.items():
+                        writer.write(subject, joint, label, data)
+                    for key, value in output_attrs.items():
+                        writer.set_attr(key, value)
+                    if manifest is not None:
+                        manifest.record(self.subject_name(idx), self.data_loader.subject_paths(idx), self.params())
+            max_error = writer.max_error()
+        else:
+            catalog = Catalog.read(self.path) if os.path.exists(self.path) else Catalog()
+            for subject in removed:
+                catalog.remove(subject=subject)
+            if len(removed) > 0:
+                catalog.save(self.path)
+            for idx, (_, _, subject_error) in zip(subjects, results):
+                max_error = max(max_error, subject_error)
+                catalog.scan(self.path, subjects=[self.subject_name(idx)])
+                catalog.save(self.path)
+                if manifest is not None:
+                    manifest.record(self.subject_name(idx), self.data_loader.subject_paths(idx), self.params())
+                    manifest.save()
+
+        if manifest is not None:
+            manifest.save()
+        self.max_error = max_error
+        if self.precision is not None:
+            print(f"Max reconstruction error ({self.precision}): {max_error:.3g}")
 
     def run(self):
-        for i in range(len(self.data_loader)):
-            print(f"Subject {str(i + 1).zfill(2)}...")
-            clean_data = self.remove_nones(data=self.data_loader[i])
-            self.segment_by_gc_key(data=clean_data, subject=i + 1)
+        subjects = list(range(len(self.data_loader)))
+        if self.shard is not None:
+            shard_subjects = self.shard.select([self.subject_name(idx) for idx in subjects])
+            subjects = [position for position, _ in shard_subjects]
+            print(f"Shard {self.shard.index} of {self.shard.count}: {len(subjects)} subjects...")
+        manifest, removed = None, list()
+        if self.incremental:
+            manifest = Manifest(Manifest.output_path(self.path, storage=self.storage))
+            # Outputs of the subjects that are no longer in the dataset (or in the shard)
+            names = {self.subject_name(idx) for idx in subjects}
+            removed = [name for name in manifest.outputs() if name not in names]
+            subjects = [idx for idx in subjects if not manifest.is_up_to_date(
+                self.subject_name(idx), inputs=self.data_loader.subject_paths(idx), params=self.params())]
+            print(f"{len(subjects)} of {len(self.data_loader)} subjects changed, {len(removed)} removed...")
+            for name in removed:
+                manifest.remove(name)
+                if self.storage == 'directory' and os.path.exists(os.path.join(self.path, name)):
+                    shutil.rmtree(os.path.join(self.path, name))
+            for idx in subjects:
+                # Outputs of the previous run that the new one may not overwrite
+                manifest.remove(self.subject_name(idx))
+                if self.storage == 'directory' and os.path.exists(os.path.join(self.path, self.subject_name(idx))):
+                    shutil.rmtree(os.path.join(self.path, self.subject_name(idx)))
+
+        if not self.incremental or len(subjects) > 0 or len(removed) > 0:
+            with self.instrumentation.span('normalize', subjects=len(subjects)):
+                if self.workers > 1:
+                    with ProcessPoolExecutor(max_workers=self.workers) as executor:
+                        self.save_results(subjects, self.merge_spans(executor.map(self.process_subject_entry,
+                                                                                  subjects)), manifest=manifest,
+                                          removed=removed)
+                else:
+                    self.save_results(subjects, (self.process_subject(i) for i in subjects), manifest=manifest,
+                                      removed=removed)
+
+        if self.shard is not None:
+            self.shard.save_manifest(self.final_path, unit='subject', items=shard_subjects,
+                                     total=len(self.data_loader), storage=self.storage, params=self.params())
@@ -1,29 +1,104 @@
 import os
 import numpy as np
 
-from sklearn.utils import shuffle
+from data_management.categorical import Vocabulary, activity_vocabulary
+from normalize_dataset.dataset_store import DatasetStore
+from normalize_dataset.catalog import Catalog
+from normalize_dataset.precision import decode, tree_encoding
 
 
 class NormalizedDataLoader:
     def __init__(self, dataset_path):
+        """
+        :param dataset_path: Folder with the <subject>/<joint>/<activity>.npy tree, or a store file written by
+         DatasetStoreWriter
+        """
         self.dataset_path = dataset_path
+        self.store = DatasetStore(dataset_path) if os.path.isfile(dataset_path) else None
+        # Listings and lookups go through the catalog instead of the filesystem
+        self.catalog = Catalog.from_store(self.store) if self.store is not None else Catalog.read(dataset_path)
+        # Vocabularies of the encoded labels, subjects and joints get their codes as they are loaded
+        self.subject_vocabulary = Vocabulary(grow=True)
+        self.joint_vocabulary = Vocabulary(grow=True)
+        self.activity_vocabulary = Vocabulary(activity_vocabulary.labels, grow=True)
 
-    def get_data(self, subject, joint, activity, shuffle_data=False):
+    def subjects(self):
+        return self.catalog.subjects()
+
+    def joints(self, subject):
+        return self.catalog.joints(subject)
+
+    def activities(self, subject, joint):
+        return self.catalog.activities(subject, joint)
+
+    def select(self, subjects=None, joints=None, activities=None):
+        """
+        :return: Sorted (subject, joint, activity) keys of the entries in the given subjects, joints and activities
+         (all if not given), see Catalog.select
+        """
+        return self.catalog.select(subjects=subjects, joints=joints, activities=activities)
+
+    def get_array(self, subject, joint, activity, mmap=False):
+        """
+        :param mmap: Memory-map the .npy file instead of reading it, when reading from a directory tree
+        :return: Strides of a subject/joint/activity, memory-mapped (zero-copy) when reading from a store. Strides
+         saved with a reduced precision are decoded (see decode).
+        """
+        if self.store is not None:
+            return self.store.get(subject, joint, activity)
+        data = np.load(os.path.join(self.dataset_path, subject, joint, f"{activity}.npy"),
+                       mmap_mode='r' if mmap else None)
+        return decode(data, tree_encoding(data))
+
+    def get_stored(self, subject, joint, activity):
+        """
+        :return: Strides of a subject/joint/activity as stored, memory-mapped unless they are compressed, and their
+         encoding (see decode), to decode only the strides read
+        """
+        if self.store is not None:
+            return self.store.get_stored(subject, joint, activity)
+        data = np.load(os.path.join(self.dataset_path, subject, joint, f"{activity}.npy"), mmap_mode='r')
+        return data, tree_encoding(data)
+
+    def vocabularies(self):
+        """
+        :return: Vocabularies of the [subject, joint, activity] codes
+        """
+        return self.subject_vocabulary, self.joint_vocabulary, self.activity_vocabulary
+
+    def label_rows(self, subject, joint, activity, n, encoded=False):
+        if encoded:
+            codes = [vocabulary.code(label) for vocabulary, label in zip(self.vocabularies(), [subject, joint, activity])]
+            dtype = np.result_type(*[vocabulary.dtype for vocabulary in self.vocabularies()])
+            return np.tile(np.array(codes, dtype=dtype), (n, 1))
+
+        return np.tile(np.array([subject, joint, activity]), (n, 1))
+
+    def decode_labels(self, labels):
+        """
+        :param labels: N×3 array with [subject, joint, activity] codes
+        :return: N×3 array with the [subject, joint, activity] labels
+        """
+        return np.column_stack([vocabulary.decode(labels[:, i]) for i, vocabulary in enumerate(self.vocabularies())])
+
+    def get_data(self, subject, joint, activity, shuffle_data=False, encoded=False):
+        """
+        :param encoded: Return the labels as [subject, joint, activity] codes of the loader vocabularies instead of
+         strings
+        """
         data = list()
         labels = list()
 
-        b_path = os.path.join(self.dataset_path, subject, joint)
-        files = os.listdir(b_path)
-
-        if f"{activity}.npy" in files:
-            file_data = np.load(f"{b_path}/{activity}.npy")
+        if (subject, joint, activity) in self.catalog:
+            file_data = self.get_array(subject, joint, activity)
             data.append(file_data)
-            labels.append(np.array([[subject, joint, activity]]*file_data.shape[0]))
+            labels.append(self.label_rows(subject, joint, activity, file_data.shape[0], encoded=encoded))
 
         x = np.concatenate(data)
         y = np.concatenate(labels)
 
         if shuffle_data:
+            from sklearn.utils import shuffle
             x, y = shuffle(x, y)
 
         return x, y
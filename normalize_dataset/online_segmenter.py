@@ -0,0 +1,115 @@
+import numpy as np
+
+from data_management.categorical import activity_vocabulary, gait_event_vocabulary
+from normalize_dataset.normalize_dataset import NormalizeDataset, interpolation_orders, spline_resampling_matrix, \
+    resample_strides
+
+
+class OnlineSegmenter:
+    """
+    Segment and normalize a live stream of joint angles into strides. Samples are pushed as they arrive, alone or in
+    small chunks, with their [activity, gait event] codes, and every stride is emitted as soon as the heel strike closing
+    it is pushed. Only the samples of the stride in progress are kept, in a ring buffer of fixed capacity.
+    Replaying a recorded subject gives the same strides as NormalizeDataset: samples labeled 'none' are skipped (see
+    NormalizeDataset.remove_nones), strides start at the first sample of every gait event gc_key of the side and are
+    resampled with the same spline.
+    """
+    def __init__(self, side='Right', gc_key='hs', samples=50, interpolation='cubic', capacity=1000):
+        """
+        :param side: 'Right' or 'Left', side of the gait event opening and closing the strides
+        :param capacity: Maximum length of a stride (samples). Longer strides are dropped and counted in self.dropped.
+        """
+        if interpolation not in interpolation_orders:
+            raise ValueError(f"Interpolation: '{interpolation}' is not supported.")
+        self.gc_key = gait_event_vocabulary.code(f"{side[0].lower()}{gc_key}")
+        self.samples = samples
+        self.interpolation = interpolation
+        self.capacity = capacity
+        self.resampling_matrices = dict()
+        self.none_code = activity_vocabulary.code('none')
+
+        self.values, self.activities = None, np.empty(capacity, dtype=activity_vocabulary.dtype)
+        # Number of samples pushed (without 'none' samples), start of the stride in progress and last gait event
+        self.count = 0
+        self.start = None
+        self.last_event = None
+        self.dropped = 0
+
+    def reset(self):
+        self.count, self.start, self.last_event, self.dropped = 0, None, None, 0
+
+    def resampling_matrix(self, length):
+        if length not in self.resampling_matrices:
+            self.resampling_matrices[length] = spline_resampling_matrix(length=length, samples=self.samples,
+                                                                        interpolation=self.interpolation)
+
+        return self.resampling_matrices[length]
+
+    def append(self, values, activities):
+        if self.values is None:
+            self.values = np.empty((self.capacity,) + values.shape[1:], dtype=values.dtype)
+        # Only the last capacity samples of a chunk can belong to an emitted stride
+        skipped = max(0, len(values) - self.capacity)
+        positions = np.arange(self.count + skipped, self.count + len(values)) % self.capacity
+        self.values[positions] = values[skipped:]
+        self.activities[positions] = activities[skipped:]
+        self.count += len(values)
+
+    def close_stride(self):
+        """
+        :return: (normalized stride, activity label) of the stride in progress, None if it is too long for the buffer
+        """
+        length = self.count - self.start
+        if length > self.capacity:
+            self.dropped += 1
+            return None
+
+        positions = np.arange(self.start, self.count) % self.capacity
+        stride = resample_strides(self.resampling_matrix(length), self.values[positions][None])[0]
+        label = NormalizeDataset.stride_label(self.activities[positions])
+
+        return stride, activity_vocabulary.labels[label]
+
+    def push(self, values, labels):
+        """
+        :param values: Sample, or N×... chunk of samples, of the joint angles
+        :param labels: [activity, gait event] codes of the sample, or N×2 codes of the chunk
+        :return: List with the (normalized stride, activity label) of every stride closed by the samples
+        """
+        values, labels = np.asarray(values), np.asarray(labels)
+        if labels.ndim == 1:
+            values, labels = values[None], labels[None]
+        keep = labels[:, 0] != self.none_code
+        values, labels = values[keep], labels[keep]
+        if len(labels) == 0:
+            return list()
+
+        events = labels[:, 1]
+        previous = np.concatenate([[-1 if self.last_event is None else self.last_event], events[:-1]])
+        boundaries = np.flatnonzero((events == self.gc_key) & (previous != self.gc_key))
+        self.last_event = events[-1]
+
+        strides = list()
+        position = 0
+        for boundary in boundaries:
+            self.append(values[position:boundary], labels[position:boundary, 0])
+            position = boundary
+            if self.start is not None:
+                stride = self.close_stride()
+                if stride is not None:
+                    strides.append(stride)
+            self.start = self.count
+        self.append(values[position:], labels[position:, 0])
+
+        return strides
+
+    def replay(self, values, labels, chunk_size=1):
+        """
+        Push a recorded sequence in chunks, as if it was streamed
+        :return: List with the (normalized stride, activity label) of every stride
+        """
+        strides = list()
+        for i in range(0, len(labels), chunk_size):
+            strides.extend(self.push(values[i:i + chunk_size], labels[i:i + chunk_size]))
+
+        return strides
@@ -0,0 +1,82 @@
+import numpy as np
+
+
+# Stored dtype of every supported precision. int16 stores the strides of an array scaled to the range of the dtype, with
+# the scale and offset recorded along with the array.
+precisions = {'float64': np.dtype(np.float64), 'float32': np.dtype(np.float32), 'float16': np.dtype(np.float16),
+              'int16': np.dtype(np.int16)}
+int16_max = np.iinfo(np.int16).max
+# Code of the NaN values in int16, out of the ±int16_max range of the scaled values
+int16_nan = np.iinfo(np.int16).min
+
+
+def check_precision(precision, compression, storage):
+    """
+    Check the precision and compression of a dataset saved as a 'directory' tree or a 'store' file. The scale of int16
+    and the compression are recorded in the store index, .npy files have no room for them.
+    """
+    if precision is not None and precision not in precisions:
+        raise ValueError(f"Precision: '{precision}' is not supported.")
+    if storage == 'directory' and precision == 'int16':
+        raise ValueError(f"Precision: '{precision}' is only supported by the store.")
+    if storage == 'directory' and compression is not None:
+        raise ValueError(f"Compression: '{compression}' is only supported by the store.")
+
+
+def encode(data, precision):
+    """
+    :param precision: One of the keys of precisions, None to keep the data as it is
+    :return: Array to store and its encoding: a dictionary with the original 'dtype', the 'scale' and 'offset' of int16
+     and the max reconstruction 'error' of the finite values, None when the array is stored as it is. NaN values are
+     kept (int16 stores them as int16_nan, with 'nan' set in the encoding); int16 has no room for infinite values.
+    """
+    if precision is not None and precision not in precisions:
+        raise ValueError(f"Precision: '{precision}' is not supported.")
+    if precision is None or precisions[precision] == data.dtype:
+        return data, None
+
+    encoding = {'dtype': data.dtype.str}
+    if precision == 'int16':
+        nan = np.isnan(data)
+        if np.isinf(data).any():
+            raise ValueError(f"Precision: '{precision}' can not store infinite values.")
+        values = data[~nan] if nan.any() else data
+        low, high = (float(values.min()), float(values.max())) if values.size > 0 else (0., 0.)
+        encoding['offset'] = (high + low) / 2
+        encoding['scale'] = (high - low) / (2 * int16_max) if high > low else 1.
+        encoded = np.rint((data - encoding['offset']) / encoding['scale'])
+        if nan.any():
+            encoding['nan'] = True
+            encoded[nan] = int16_nan
+        encoded = encoded.astype(np.int16)
+    else:
+        encoded = data.astype(precisions[precision])
+    finite = np.isfinite(data)
+    encoding['error'] = float(np.abs(decode(encoded, encoding)[finite] - data[finite]).max(initial=0.))
+
+    return encoded, encoding
+
+
+def decode(data, encoding):
+    """
+    :return: Array in its original dtype, upcast (and rescaled) from the stored one
+    """
+    if encoding is None:
+        return data
+    if 'scale' in encoding:
+        decoded = data.astype(encoding['dtype']) * encoding['scale'] + encoding['offset']
+        if encoding.get('nan', False):
+            decoded[data == int16_nan] = np.nan
+        return decoded
+
+    return data.astype(encoding['dtype'])
+
+
+def tree_encoding(data):
+    """
+    :return: Encoding of the strides of a directory tree, float32 and float16 strides are upcast to float64. The tree
+     does not record the reconstruction error.
+    """
+    if data.dtype in [precisions['float32'], precisions['float16']]:
+        return {'dtype': precisions['float64'].str}
+    return None
@@ -0,0 +1,125 @@
+import os
+import json
+import shutil
+
+from normalize_dataset.catalog import Catalog
+from normalize_dataset.dataset_store import DatasetStore, DatasetStoreWriter
+
+
+class Shard:
+    """
+    One of the shards of a run split across nodes. Every node processes the items (subjects when normalizing,
+    (joint, activity) groups when cleaning) of its shard into its own partial output next to the final one, and writes
+    a shard manifest when it completes. merge_shards then combines the partial outputs into the tree or store a
+    single node would have produced.
+    """
+    def __init__(self, index, count):
+        """
+        :param index: Index of the shard, from 0 to count - 1
+        :param count: Number of shards of the run
+        """
+        if not 0 <= index < count:
+            raise ValueError(f"Shard: '{index}' is not supported, the run has {count} shards.")
+        self.index = index
+        self.count = count
+
+    def select(self, items):
+        """
+        :return: Positions and items of the shard, every count-th item of the list. All the nodes must list the same
+         items in the same order.
+        """
+        return [(position, item) for position, item in enumerate(items) if position % self.count == self.index]
+
+    def path(self, path):
+        """
+        :return: Path of the partial output of the shard
+        """
+        return f"{path}.shard-{self.index}-of-{self.count}"
+
+    @staticmethod
+    def manifest_path(shard_path):
+        return f"{shard_path}.shard.json"
+
+    def save_manifest(self, path, unit, items, total, storage, params):
+        """
+        Mark the partial output of the shard as complete
+        :param path: Path of the final output
+        :param unit: 'subject' or 'group', what the items are
+        :param items: List of (position, item) of the shard (see select)
+        :param total: Number of items of the whole run
+        :param params: JSON serializable parameters of the run, the same for all the shards
+        """
+        manifest = {'shard': self.index, 'shards': self.count, 'unit': unit, 'items': [list(item) for item in items],
+                    'total': total, 'storage': storage, 'params': json.loads(json.dumps(params))}
+        tmp_path = f"{self.manifest_path(self.path(path))}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path(self.path(path)))
+
+
+def read_shard_manifests(path, shards):
+    """
+    :return: Manifests of the shards of a run, checked to be complete, consistent and to cover every item once
+    """
+    manifests = list()
+    for index in range(shards):
+        manifest_path = Shard.manifest_path(Shard(index, shards).path(path))
+        if not os.path.exists(manifest_path):
+            raise ValueError(f"Shard: '{index}' of '{path}' is not complete.")
+        with open(manifest_path) as f:
+            manifests.append(json.load(f))
+
+    for key in ['shards', 'unit', 'total', 'storage', 'params']:
+        if len({json.dumps(manifest[key], sort_keys=True) for manifest in manifests}) > 1:
+            raise ValueError(f"Shards: the shards of '{path}' were run with different '{key}'.")
+    positions = sorted(position for manifest in manifests for position, _ in manifest['items'])
+    if positions != list(range(manifests[0]['total'])):
+        raise ValueError(f"Shards: the shards of '{path}' do not cover every {manifests[0]['unit']} once.")
+
+    return manifests
+
+
+def merge_shards(path, shards):
+    """
+    Combine the partial outputs of the shards of a run into path. A store is written entry by entry in the order of
+    the items, so it has the same entries in the same order as the store of a single-node run. The files of a
+    directory tree are copied and its catalog merged.
+    :param shards: Number of shards of the run
+    """
+    manifests = read_shard_manifests(path, shards)
+    storage, unit = manifests[0]['storage'], manifests[0]['unit']
+    print(f"Merging {shards} shards into {path}...")
+
+    if storage == 'store':
+        items = sorted((position, item, manifest['shard']) for manifest in manifests
+                       for position, item in manifest['items'])
+        stores = [DatasetStore(Shard(index, shards).path(path)) for index in range(shards)]
+        with DatasetStoreWriter(path) as writer:
+            for _, item, index in items:
+                store = stores[index]
+                for key in store.keys():
+                    if (key[0] if unit == 'subject' else '/'.join(key[1:])) == item:
+                        writer.copy(store, *key)
+                for key, value in store.index['attrs'].items():
+                    if unit == 'subject' and key.split('/')[0] == item:
+                        writer.set_attr(key, value)
+        for store in stores:
+            store.close()
+        return
+
+    catalog = Catalog.read(path) if os.path.exists(path) else Catalog()
+    for index in range(shards):
+        shard_path = Shard(index, shards).path(path)
+        for folder, _, files in os.walk(shard_path):
+            for file in files:
+                if folder == shard_path and file in [Catalog.file_name, 'manifest.json']:
+                    continue
+                target_folder = os.path.join(path, os.path.relpath(folder, shard_path))
+                os.makedirs(target_folder, exist_ok=True)
+                shutil.copyfile(os.path.join(folder, file), os.path.join(target_folder, file))
+        # A shard with no items to process (more shards than items) does not create its folder
+        shard_catalog = Catalog.read(shard_path) if os.path.exists(shard_path) else Catalog()
+        for key in shard_catalog.select():
+            entry = shard_catalog.entry(*key)
+            catalog.add(*key, shape=[entry['strides']] + entry['shape'], dtype=entry['dtype'])
+    catalog.save(path)
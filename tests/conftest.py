@@ -0,0 +1,20 @@
+import os
+import sys
+import pytest
+
+# The packages of the repository are imported from its root, as the scripts and the CLI do
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def raw_dataset(tmp_path_factory):
+    """
+    Small synthetic dataset in the layout of the UH dataset (see benchmarks/synthetic_dataset.py)
+    :return: Base path of the dataset and the subject names
+    """
+    from benchmarks.synthetic_dataset import generate_dataset
+
+    base_path = str(tmp_path_factory.mktemp('raw_dataset'))
+    subjects = generate_dataset(base_path, subjects=3, trials=2, trial_time=20, sample_rate=60, seed=0)
+
+    return base_path, subjects
@@ -0,0 +1,116 @@
+import threading
+import pytest
+import numpy as np
+
+from data_management.data_loader import DataLoader
+from normalize_dataset.batch_iterator import BatchIterator, leave_one_subject_out
+from normalize_dataset.normalize_dataset import NormalizeDataset
+from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+
+
+@pytest.fixture(scope='module', params=[None, 'float16', 'int16'])
+def normalized(request, raw_dataset, tmp_path_factory):
+    """
+    :return: NormalizedDataLoader of the raw dataset normalized to a store, in full or reduced precision
+    """
+    base_path, subjects = raw_dataset
+    path = str(tmp_path_factory.mktemp('normalized') / 'normalized.store')
+    data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels', subjects=subjects)
+    NormalizeDataset(data_loader=data_loader, samples=50, path=path, storage='store', precision=request.param).run()
+
+    return NormalizedDataLoader(path)
+
+
+def epoch(iterator):
+    """
+    :return: Strides and labels of all the batches of an epoch
+    """
+    batches = list(iterator)
+    return np.concatenate([x for x, _ in batches]), np.concatenate([y for _, y in batches])
+
+
+def test_same_seed_same_batches(normalized):
+    first, second = (BatchIterator(normalized, batch_size=16, seed=3) for _ in range(2))
+    for _ in range(2):
+        for (x_first, y_first), (x_second, y_second) in zip(first, second):
+            np.testing.assert_array_equal(x_first, x_second)
+            np.testing.assert_array_equal(y_first, y_second)
+
+    # Every epoch is shuffled differently
+    assert not np.array_equal(first.order(0), first.order(1))
+    assert not np.array_equal(first.order(0), BatchIterator(normalized, batch_size=16, seed=4).order(0))
+
+
+def test_epoch_covers_every_stride_once(normalized):
+    iterator = BatchIterator(normalized, batch_size=16, seed=0)
+    x, y = epoch(iterator)
+    assert len(x) == iterator.num_strides()
+
+    # The strides of the epoch, with their labels, are a permutation of the strides of the dataset
+    entries = normalized.select()
+    data = np.concatenate([normalized.get_array(*entry) for entry in entries])
+    labels = np.concatenate([normalized.label_rows(*entry, n=len(normalized.get_array(*entry)), encoded=True)
+                             for entry in entries])
+    expected, shuffled = np.column_stack([labels, data]), np.column_stack([y, x])
+    np.testing.assert_array_equal(shuffled[np.lexsort(shuffled.T[::-1])], expected[np.lexsort(expected.T[::-1])])
+
+
+def test_unshuffled_batches_match_get_array(normalized):
+    iterator = BatchIterator(normalized, batch_size=10, shuffle_data=False)
+    x, y = epoch(iterator)
+    entries = normalized.select()
+    np.testing.assert_array_equal(x, np.concatenate([normalized.get_array(*entry) for entry in entries]))
+    np.testing.assert_array_equal(iterator.labels(y), np.concatenate(
+        [normalized.label_rows(*entry, n=len(normalized.get_array(*entry))) for entry in entries]))
+
+
+def test_drop_last(normalized):
+    strides = BatchIterator(normalized).num_strides()
+    batch_size = 7 if strides % 7 > 0 else 11
+    assert strides % batch_size > 0
+
+    kept, dropped = (BatchIterator(normalized, batch_size=batch_size, drop_last=drop_last) for drop_last in
+                     [False, True])
+    assert [len(x) for x, _ in kept][-1] == strides % batch_size
+    assert len(dropped) == len(kept) - 1 == strides // batch_size
+    assert [len(x) for x, _ in dropped] == [batch_size] * (strides // batch_size)
+
+
+def test_early_stop_does_not_hang(normalized):
+    iterator = BatchIterator(normalized, batch_size=1, prefetch=1)
+    threads = threading.active_count()
+
+    def consume():
+        for _ in iterator:
+            break
+
+    consumer = threading.Thread(target=consume, daemon=True)
+    consumer.start()
+    consumer.join(timeout=10)
+    assert not consumer.is_alive()
+    # The producer of the prefetched batches stopped as well
+    assert threading.active_count() == threads
+
+
+def test_prefetched_raises_producer_errors(normalized):
+    def batches():
+        yield 1
+        raise RuntimeError("Producer failed")
+
+    iterator = BatchIterator(normalized, prefetch=1)
+    with pytest.raises(RuntimeError, match="Producer failed"):
+        list(iterator.prefetched(batches()))
+
+
+def test_leave_one_subject_out_folds_are_disjoint(normalized):
+    subjects = normalized.subjects()
+    total = BatchIterator(normalized).num_strides()
+    folds = list(leave_one_subject_out(normalized, batch_size=16))
+    assert [subject for subject, _, _ in folds] == subjects
+
+    for subject, train, test in folds:
+        _, y_train = epoch(train)
+        _, y_test = epoch(test)
+        assert subject not in set(train.labels(y_train)[:, 0])
+        assert set(test.labels(y_test)[:, 0]) == {subject}
+        assert train.num_strides() + test.num_strides() == total
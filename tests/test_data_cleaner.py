@@ -0,0 +1,68 @@
+import os
+import json
+import pytest
+import numpy as np
+
+from clean_dataset.data_cleaner import DataCleaner
+from data_management.data_loader import DataLoader
+from data_management.manifest import Manifest
+from normalize_dataset.normalize_dataset import NormalizeDataset
+from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+
+
+def test_score_subjects_requires_models(tmp_path):
+    cleaner = DataCleaner(base_path=str(tmp_path), data_loader=None)
+    with pytest.raises(ValueError, match="models_path"):
+        cleaner.score_subjects(subjects=['AB01'])
+
+
+@pytest.mark.parametrize('storage', ['directory', 'store'])
+def test_incremental_cleaning_prunes_removed_groups(tmp_path, storage):
+    rng = np.random.default_rng(0)
+    source = str(tmp_path / 'normalized')
+    for subject, activities in [('AB01', ['ra2ra', 'sd2sd']), ('AB02', ['ra2ra'])]:
+        os.makedirs(os.path.join(source, subject, 'KneeAngles'))
+        for activity in activities:
+            np.save(os.path.join(source, subject, 'KneeAngles', f"{activity}.npy"), rng.normal(size=(10, 50)))
+    path = str(tmp_path / ('clean' if storage == 'directory' else 'clean.store'))
+
+    data_loader = NormalizedDataLoader(source)
+    DataCleaner(base_path=source, data_loader=data_loader, outlier_method='iForest').run_and_save(
+        subjects=['AB01', 'AB02'], base_folder=path, storage=storage, incremental=True)
+    assert NormalizedDataLoader(path).select(activities=['sd2sd']) == [('AB01', 'KneeAngles', 'sd2sd')]
+
+    # Without AB01 the sd2sd group has no strides left, its outputs are removed
+    DataCleaner(base_path=source, data_loader=data_loader, outlier_method='iForest').run_and_save(
+        subjects=['AB02'], base_folder=path, storage=storage, incremental=True)
+    assert NormalizedDataLoader(path).select() == [('AB02', 'KneeAngles', 'ra2ra')]
+    with open(Manifest.output_path(path, storage=storage)) as f:
+        assert list(json.load(f)['outputs'].keys()) == ['KneeAngles/ra2ra']
+    if storage == 'directory':
+        assert not os.path.exists(os.path.join(path, 'AB01', 'KneeAngles', 'sd2sd.npy'))
+
+
+@pytest.mark.parametrize('storage', ['directory', 'store'])
+def test_all_channels_batch_and_streaming_cleaning(raw_dataset, tmp_path, storage):
+    base_path, subjects = raw_dataset
+    data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels', subjects=subjects)
+    source = str(tmp_path / 'normalized')
+    NormalizeDataset(data_loader=data_loader, samples=50, path=source, all_channels=True).run()
+
+    outputs = dict()
+    for mode in ['batch', 'streaming']:
+        path = str(tmp_path / f"clean_{mode}")
+        # LOF is deterministic, both paths find the same outliers
+        cleaner = DataCleaner(base_path=source, data_loader=NormalizedDataLoader(source), outlier_method='LOF')
+        if mode == 'batch':
+            cleaner.run_and_save(subjects=subjects, base_folder=path, storage=storage)
+        else:
+            cleaner.run_streaming(subjects=subjects, base_folder=path, storage=storage)
+        outputs[mode] = NormalizedDataLoader(path)
+
+    source_loader = NormalizedDataLoader(source)
+    assert sorted(outputs['batch'].select()) == sorted(outputs['streaming'].select())
+    for key in outputs['batch'].select():
+        batch = outputs['batch'].get_array(*key)
+        # Strides keep their channels×samples shape
+        assert batch.ndim == 3 and batch.shape[1:] == source_loader.get_array(*key).shape[1:]
+        np.testing.assert_array_equal(batch, outputs['streaming'].get_array(*key))
@@ -0,0 +1,133 @@
+import os
+import pickle
+import pytest
+import numpy as np
+
+from clean_dataset.data_cleaner import DataCleaner
+from data_management.manifest import Manifest
+from normalize_dataset.catalog import Catalog
+from normalize_dataset.dataset_store import DatasetStore, DatasetStoreWriter
+from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+
+
+def write_tree(path, rng):
+    """
+    Write a <subject>/<joint>/<activity>.npy tree with its catalog and manifest
+    :return: Dictionary {(subject, joint, activity): array}
+    """
+    arrays = dict()
+    for subject in ['AB01', 'AB02']:
+        for joint in ['HipAngles', 'KneeAngles']:
+            os.makedirs(os.path.join(path, subject, joint))
+            for activity in ['ra2ra', 'sd2sd']:
+                arrays[(subject, joint, activity)] = rng.normal(size=(int(rng.integers(1, 5)), 50, 3))
+                np.save(os.path.join(path, subject, joint, f"{activity}.npy"), arrays[(subject, joint, activity)])
+            with open(os.path.join(path, subject, joint, 'channels.txt'), 'w') as f:
+                f.write('\n'.join(['x', 'y', 'z']))
+    Catalog().scan(path).save(path)
+    manifest = Manifest(Manifest.output_path(path))
+    manifest.record('AB01', inputs={'AB01T01.mat': '0'}, params={'samples': 50})
+    manifest.save()
+
+    return arrays
+
+
+def test_from_directory_skips_catalog_and_manifest(tmp_path):
+    arrays = write_tree(str(tmp_path / 'tree'), np.random.default_rng(0))
+    assert os.path.exists(tmp_path / 'tree' / Catalog.file_name)
+    assert os.path.exists(tmp_path / 'tree' / 'manifest.json')
+
+    store = DatasetStore.from_directory(str(tmp_path / 'tree'), str(tmp_path / 'tree.store'))
+    assert store.keys() == sorted(arrays.keys())
+    for key, data in arrays.items():
+        np.testing.assert_array_equal(store.get(*key), data)
+    assert store.attr('AB02/KneeAngles/channels') == ['x', 'y', 'z']
+
+
+def test_catalog_read_missing_path(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        Catalog.read(str(tmp_path / 'missing'))
+    # An existing tree without catalog.json is scanned
+    os.makedirs(tmp_path / 'tree' / 'AB01' / 'KneeAngles')
+    np.save(str(tmp_path / 'tree' / 'AB01' / 'KneeAngles' / 'ra2ra.npy'), np.zeros((2, 50, 3)))
+    assert Catalog.read(str(tmp_path / 'tree')).select() == [('AB01', 'KneeAngles', 'ra2ra')]
+
+
+def test_store_pickles_without_its_buffer(tmp_path):
+    rng = np.random.default_rng(1)
+    arrays = write_tree(str(tmp_path / 'tree'), rng)
+    arrays[('AB03', 'KneeAngles', 'ra2ra')] = rng.normal(size=(2000, 50, 3))
+    with DatasetStoreWriter(str(tmp_path / 'tree.store')) as writer:
+        for key, data in arrays.items():
+            writer.write(*key, data)
+
+    data_loader = NormalizedDataLoader(str(tmp_path / 'tree.store'))
+    cleaner = DataCleaner(base_path=str(tmp_path), data_loader=data_loader)
+    # Every task of a process pool pickles the bound method, with the cleaner and its loader
+    content = pickle.dumps(cleaner.detect_group_outliers_entry)
+    assert len(content) < os.path.getsize(tmp_path / 'tree.store') / 10
+
+    store = pickle.loads(content).__self__.data_loader.store
+    for key, data in arrays.items():
+        np.testing.assert_array_equal(store.get(*key), data)
+
+
+def test_writer_replaces_entries(tmp_path):
+    rng = np.random.default_rng(2)
+    path = str(tmp_path / 'data.store')
+    first, second, third = rng.normal(size=(3, 50, 3)), rng.normal(size=(5, 50, 3)), rng.normal(size=(4, 50, 3))
+    with DatasetStoreWriter(path) as writer:
+        writer.write('AB01', 'KneeAngles', 'ra2ra', first)
+        writer.write('AB01', 'KneeAngles', 'sd2sd', second)
+        writer.set_attr('AB01/KneeAngles/channels', ['x'])
+    with DatasetStoreWriter(path, mode='a') as writer:
+        writer.write('AB01', 'KneeAngles', 'ra2ra', third)
+        writer.write('AB02', 'KneeAngles', 'ra2ra', first)
+    assert not os.path.exists(f"{path}.tmp")
+
+    store = DatasetStore(path)
+    assert store.keys() == [('AB01', 'KneeAngles', 'ra2ra'), ('AB01', 'KneeAngles', 'sd2sd'),
+                            ('AB02', 'KneeAngles', 'ra2ra')]
+    np.testing.assert_array_equal(store.get('AB01', 'KneeAngles', 'ra2ra'), third)
+    np.testing.assert_array_equal(store.get('AB01', 'KneeAngles', 'sd2sd'), second)
+    assert store.attr('AB01/KneeAngles/channels') == ['x']
+
+    # The bytes of the replaced entry are dropped, the store is the one written without it
+    with DatasetStoreWriter(str(tmp_path / 'fresh.store')) as writer:
+        writer.write('AB01', 'KneeAngles', 'ra2ra', third)
+        writer.write('AB01', 'KneeAngles', 'sd2sd', second)
+        writer.write('AB02', 'KneeAngles', 'ra2ra', first)
+        writer.set_attr('AB01/KneeAngles/channels', ['x'])
+    with open(path, 'rb') as f, open(tmp_path / 'fresh.store', 'rb') as fresh:
+        assert f.read() == fresh.read()
+
+
+def test_interrupted_writer_keeps_store(tmp_path):
+    path = str(tmp_path / 'data.store')
+    with DatasetStoreWriter(path) as writer:
+        writer.write('AB01', 'KneeAngles', 'ra2ra', np.ones((2, 50)))
+    with pytest.raises(RuntimeError):
+        with DatasetStoreWriter(path, mode='a') as writer:
+            writer.write('AB01', 'KneeAngles', 'ra2ra', np.zeros((2, 50)))
+            raise RuntimeError("interrupted")
+
+    assert not os.path.exists(f"{path}.tmp")
+    np.testing.assert_array_equal(DatasetStore(path).get('AB01', 'KneeAngles', 'ra2ra'), np.ones((2, 50)))
+
+
+@pytest.mark.parametrize('dtype', [np.float16, np.float32])
+def test_from_directory_upcasts_like_the_tree(tmp_path, dtype):
+    path = str(tmp_path / 'tree')
+    os.makedirs(os.path.join(path, 'AB01', 'KneeAngles'))
+    np.save(os.path.join(path, 'AB01', 'KneeAngles', 'ra2ra.npy'),
+            np.random.default_rng(3).normal(size=(4, 50)).astype(dtype))
+
+    store = DatasetStore.from_directory(path, str(tmp_path / 'tree.store'))
+    data, encoding = store.get_stored('AB01', 'KneeAngles', 'ra2ra')
+    assert data.dtype == dtype and encoding == {'dtype': '<f8'}
+    expected = NormalizedDataLoader(path).get_array('AB01', 'KneeAngles', 'ra2ra')
+    assert expected.dtype == np.float64
+    np.testing.assert_array_equal(store.get('AB01', 'KneeAngles', 'ra2ra'), expected)
+    np.testing.assert_array_equal(NormalizedDataLoader(str(tmp_path / 'tree.store')).get_array(
+        'AB01', 'KneeAngles', 'ra2ra'), expected)
+    assert store.max_error() == 0.
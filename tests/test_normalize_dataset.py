@@ -0,0 +1,198 @@
+import os
+import json
+import pytest
+import numpy as np
+
+from data_management.categorical import activity_vocabulary, gait_event_vocabulary
+from data_management.data_loader import DataLoader
+from data_management.manifest import Manifest
+from normalize_dataset.catalog import Catalog
+from normalize_dataset.normalize_dataset import NormalizeDataset
+from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+
+
+def normalize(raw_dataset, subjects, path, storage):
+    """
+    Incremental run over the given subjects of the raw dataset
+    :return: Names of the subjects processed
+    """
+    base_path, _ = raw_dataset
+    data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels', subjects=subjects)
+    normalize_dataset = NormalizeDataset(data_loader=data_loader, samples=50, path=path, storage=storage,
+                                         incremental=True)
+    processed = list()
+    process_subject = normalize_dataset.process_subject
+
+    def record(idx):
+        processed.append(normalize_dataset.subject_name(idx))
+        return process_subject(idx)
+    normalize_dataset.process_subject = record
+    normalize_dataset.run()
+
+    return processed
+
+
+@pytest.mark.parametrize('storage', ['directory', 'store'])
+def test_incremental_outputs_follow_the_source_subjects(raw_dataset, tmp_path, storage):
+    path = str(tmp_path / ('normalized' if storage == 'directory' else 'normalized.store'))
+    assert normalize(raw_dataset, ['AB02', 'AB03'], path, storage) == ['AB02', 'AB03']
+    before = {key: NormalizedDataLoader(path).get_array(*key) for key in NormalizedDataLoader(path).select()}
+    assert {key[0] for key in before} == {'AB02', 'AB03'}
+
+    # A subject sorted before the others is the only one processed, the others keep their names and outputs
+    assert normalize(raw_dataset, ['AB01', 'AB02', 'AB03'], path, storage) == ['AB01']
+    data_loader = NormalizedDataLoader(path)
+    assert data_loader.subjects() == ['AB01', 'AB02', 'AB03']
+    for key, data in before.items():
+        np.testing.assert_array_equal(data_loader.get_array(*key), data)
+
+    # The outputs of a removed subject are deleted
+    assert normalize(raw_dataset, ['AB01', 'AB03'], path, storage) == []
+    data_loader = NormalizedDataLoader(path)
+    assert data_loader.subjects() == ['AB01', 'AB03']
+    with open(Manifest.output_path(path, storage=storage)) as f:
+        assert sorted(json.load(f)['outputs'].keys()) == ['AB01', 'AB03']
+    if storage == 'directory':
+        assert not os.path.exists(os.path.join(path, 'AB02'))
+        assert Catalog().scan(path).entries == data_loader.catalog.entries
+    for key, data in before.items():
+        if key[0] == 'AB03':
+            np.testing.assert_array_equal(data_loader.get_array(*key), data)
+
+
+def read_files(path):
+    """
+    :return: Dictionary {relative path: bytes} with the files of a directory tree, or the bytes of a store
+    """
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    files = dict()
+    for folder, _, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(folder, name), 'rb') as f:
+                files[os.path.relpath(os.path.join(folder, name), path)] = f.read()
+
+    return files
+
+
+@pytest.mark.parametrize('storage', ['directory', 'store'])
+def test_parallel_run_matches_serial(raw_dataset, tmp_path, storage):
+    base_path, subjects = raw_dataset
+    outputs, loaded = dict(), dict()
+    for workers, loader_workers in [(1, 1), (2, 1), (1, 2)]:
+        data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels',
+                                 subjects=subjects, workers=loader_workers)
+        path = str(tmp_path / f"normalized_{workers}_{loader_workers}")
+        NormalizeDataset(data_loader=data_loader, samples=50, path=path, storage=storage, workers=workers).run()
+        outputs[(workers, loader_workers)] = read_files(path)
+        loaded[loader_workers] = data_loader.get_subject(idx=0)
+
+    # Subjects normalized in parallel and trials decoded in parallel give the bytes of the serial run
+    assert outputs[(2, 1)] == outputs[(1, 1)]
+    assert outputs[(1, 2)] == outputs[(1, 1)]
+    assert list(loaded[2].keys()) == list(loaded[1].keys())
+    for name, data in loaded[1].items():
+        assert loaded[2][name].dtype == data.dtype and loaded[2][name].tobytes() == data.tobytes()
+
+
+def random_strides(rng, channels=()):
+    """
+    :return: Ragged strides (offsets, values) of random lengths (see NormalizeDataset.normalize_per_gc)
+    """
+    lengths = rng.integers(4, 90, size=60)
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    return offsets, rng.normal(size=(offsets[-1],) + tuple(channels))
+
+
+@pytest.mark.parametrize('interpolation', ['cubic', 'linear'])
+@pytest.mark.parametrize('channels', [(), (7,)])
+def test_resampling_matches_interp1d(interpolation, channels):
+    from scipy.interpolate import interp1d
+
+    offsets, values = random_strides(np.random.default_rng(0), channels)
+    normalize_dataset = NormalizeDataset(data_loader=None, samples=50, interpolation=interpolation)
+    resampled = normalize_dataset.interpolate_data((offsets, values))
+
+    assert resampled.shape == (len(offsets) - 1, 50) + channels
+    for i, (start, end) in enumerate(zip(offsets[:-1], offsets[1:])):
+        # Resampling of the original implementation, one stride at a time
+        x = np.linspace(0, 50, num=end - start, endpoint=True)
+        expected = interp1d(x, values[start:end], kind=interpolation, axis=0)(np.linspace(0, 50, num=50,
+                                                                                          endpoint=True))
+        np.testing.assert_allclose(resampled[i], expected, rtol=0, atol=1e-9)
+
+
+def baseline_stride_idx(gc_event_label, gc_key):
+    stride_idx = list()
+    if gc_event_label[0] == gc_key:
+        stride_idx.append(0)
+    for i in range(1, len(gc_event_label)):
+        if gc_event_label[i] == gc_key and gc_event_label[i - 1] != gc_key:
+            stride_idx.append(i)
+
+    return stride_idx
+
+
+def baseline_label_strides_data(stride_data, stride_labels):
+    """
+    Labeling loop of the original NormalizeDataset, on the activity names of the samples of every stride
+    """
+    data_and_labels = list()
+    for stride, labels in zip(stride_data, stride_labels):
+        activities = list(np.unique(labels))
+        if len(activities) > 1:
+            label = f"{labels[0].split('2')[0]}2{labels[-1].split('2')[0]}"
+        else:
+            label = activities[0]
+        data_and_labels.append((stride, label))
+
+    all_labels = np.unique([i[1] for i in data_and_labels])
+    all_data_labelled = {label: list() for label in all_labels}
+    for data, label in data_and_labels:
+        all_data_labelled[label].append(data)
+
+    return {label: np.array(data) for label, data in all_data_labelled.items()}
+
+
+def random_runs(rng, labels, length):
+    """
+    :return: Sequence of runs of random labels and lengths
+    """
+    runs = rng.choice(labels, size=length)
+    return np.repeat(runs, rng.integers(1, 12, size=length))[:length]
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_segmentation_matches_loops(seed):
+    rng = np.random.default_rng(seed)
+    length = int(rng.integers(1, 3000))
+    gc_event_label = random_runs(rng, ['rhs', 'lto', 'lhs', 'rto'], length)
+    activity_label = random_runs(rng, ['w2w', 'ra2ra', 'rd2rd', 'sa2sa', 'sd2sd'], length)
+    values = rng.normal(size=length)
+
+    gc_codes = gait_event_vocabulary.encode(gc_event_label)
+    activity_codes = activity_vocabulary.encode(activity_label)
+    for side in ['r', 'l']:
+        expected_idx = baseline_stride_idx(gc_event_label, f"{side}hs")
+        stride_idx = NormalizeDataset.get_stride_idx(gc_codes, gait_event_vocabulary.code(f"{side}hs"))
+        assert stride_idx.tolist() == expected_idx
+
+        offsets, stride_values = NormalizeDataset.normalize_per_gc(stride_idx, values)
+        strides = [stride_values[start:end] for start, end in zip(offsets[:-1], offsets[1:])]
+        expected_strides = [values[expected_idx[i]:expected_idx[i + 1]] for i in range(len(expected_idx) - 1)]
+        assert len(strides) == len(expected_strides)
+        for stride, expected in zip(strides, expected_strides):
+            assert stride.tobytes() == expected.tobytes()
+
+        stride_labels = NormalizeDataset.stride_labels(stride_idx, activity_codes)
+        if len(strides) == 0:
+            assert len(stride_labels) == 0
+            continue
+        expected_labels = [activity_label[expected_idx[i]:expected_idx[i + 1]] for i in range(len(expected_idx) - 1)]
+        # Strides are grouped by their position, their values are compared above
+        labelled = NormalizeDataset.label_strides_data(np.arange(len(strides)), stride_labels)
+        expected_labelled = baseline_label_strides_data(range(len(strides)), expected_labels)
+        assert list(labelled.keys()) == list(expected_labelled.keys())
+        for label, positions in expected_labelled.items():
+            assert labelled[label].tolist() == positions.tolist()
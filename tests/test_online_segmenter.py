@@ -0,0 +1,64 @@
+import pytest
+
+from data_management.categorical import activity_vocabulary, gait_event_vocabulary
+from data_management.data_loader import DataLoader
+from normalize_dataset.normalize_dataset import NormalizeDataset
+from normalize_dataset.online_segmenter import OnlineSegmenter
+
+
+@pytest.fixture(scope='module')
+def subject_data(raw_dataset):
+    base_path, subjects = raw_dataset
+    data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels', subjects=subjects)
+    return data_loader.get_subject(0, encoded=True)
+
+
+def offline_strides(subject_data, joint, interpolation, channels=False):
+    """
+    :return: Strides and activity labels of a joint normalized by NormalizeDataset, in the order of the recording
+    """
+    normalize_dataset = NormalizeDataset(data_loader=None, samples=50, interpolation=interpolation)
+    data = normalize_dataset.remove_nones(subject_data)
+    stride_idx = normalize_dataset.get_stride_idx(data['Labels'][:, 1],
+                                                  gait_event_vocabulary.code(f"{joint[0].lower()}hs"))
+    values = data[joint] if channels else data[joint][:, 2]
+    strides = normalize_dataset.interpolate_data(normalize_dataset.normalize_per_gc(stride_idx, values))
+    labels = normalize_dataset.stride_labels(stride_idx, data['Labels'][:, 0])
+
+    return strides, [activity_vocabulary.labels[code] for code in labels]
+
+
+@pytest.mark.parametrize('interpolation', ['cubic', 'linear'])
+@pytest.mark.parametrize('joint', ['Right_Knee', 'Left_Hip'])
+@pytest.mark.parametrize('chunk_size', [1, 7, 100000])
+def test_replay_matches_offline(subject_data, joint, interpolation, chunk_size):
+    strides, labels = offline_strides(subject_data, joint, interpolation)
+    assert len(strides) > 0
+
+    segmenter = OnlineSegmenter(side=joint.split('_')[0], samples=50, interpolation=interpolation, capacity=400)
+    online = segmenter.replay(subject_data[joint][:, 2], subject_data['Labels'], chunk_size=chunk_size)
+
+    assert segmenter.dropped == 0
+    assert [label for _, label in online] == labels
+    assert len(online) == len(strides)
+    for (stride, _), expected in zip(online, strides):
+        assert stride.tobytes() == expected.tobytes()
+
+
+def test_replay_matches_offline_channels(subject_data):
+    strides, labels = offline_strides(subject_data, 'Right_Knee', 'cubic', channels=True)
+    online = OnlineSegmenter(side='Right', samples=50).replay(subject_data['Right_Knee'], subject_data['Labels'],
+                                                              chunk_size=5)
+
+    assert [label for _, label in online] == labels
+    for (stride, _), expected in zip(online, strides):
+        assert stride.tobytes() == expected.tobytes()
+
+
+def test_long_strides_are_dropped(subject_data):
+    strides, _ = offline_strides(subject_data, 'Right_Knee', 'cubic')
+    segmenter = OnlineSegmenter(side='Right', samples=50, capacity=30)
+    online = segmenter.replay(subject_data['Right_Knee'][:, 2], subject_data['Labels'])
+
+    assert len(online) + segmenter.dropped == len(strides)
+    assert segmenter.dropped > 0
@@ -0,0 +1,67 @@
+import pytest
+import numpy as np
+
+from clean_dataset.outlier_detector import OutlierDetector
+
+
+def strides(rng, n, outliers=10):
+    """
+    :return: n×50 strides, the first ones of them far from the others
+    """
+    x = np.sin(np.linspace(0, 2 * np.pi, 50))[None, :] + rng.normal(scale=0.1, size=(n, 50))
+    x[:outliers] += rng.normal(scale=3., size=(outliers, 50))
+
+    return x
+
+
+def test_small_groups_are_detected_exactly(monkeypatch):
+    x = strides(np.random.default_rng(0), n=100)
+    exact = OutlierDetector(method='LOF').detect_outliers(x=x)
+
+    outlier_detector = OutlierDetector(method='LOF', max_fit_strides=100)
+    called = list()
+    monkeypatch.setattr(outlier_detector, 'detect_outliers_approximate', lambda x, strata: called.append(len(x)))
+    np.testing.assert_array_equal(outlier_detector.detect_outliers(x=x), exact)
+    assert called == []
+    outlier_detector.detect_outliers(x=strides(np.random.default_rng(0), n=101))
+    assert called == [101]
+
+
+def test_stratified_subsample():
+    strata = np.repeat(['AB01', 'AB02', 'AB03'], [600, 393, 7])
+    outlier_detector = OutlierDetector(method='LOF', max_fit_strides=100)
+    subsample_idx = outlier_detector.subsample(n=len(strata), strata=strata)
+
+    assert (np.diff(subsample_idx) > 0).all()
+    assert abs(len(subsample_idx) - 100) <= 3
+    # Every stratum keeps its proportion, the smallest one at least one stride
+    counts = {stratum: np.count_nonzero(strata[subsample_idx] == stratum) for stratum in ['AB01', 'AB02', 'AB03']}
+    assert counts == {'AB01': 60, 'AB02': 39, 'AB03': 1}
+
+    assert len(outlier_detector.subsample(n=len(strata))) == 100
+    np.testing.assert_array_equal(outlier_detector.subsample(n=len(strata), strata=strata), subsample_idx)
+
+
+@pytest.mark.parametrize('reduction', [None, 'pca', 'downsample'])
+def test_chunked_scoring_matches_single_call(reduction):
+    x = strides(np.random.default_rng(1), n=500)
+    strata = np.arange(len(x)) % 4
+    outliers_idx = [OutlierDetector(method='LOF', max_fit_strides=150, reduction=reduction, components=10,
+                                    chunk_size=chunk_size).detect_outliers(x=x, strata=strata)
+                    for chunk_size in [37, len(x)]]
+    np.testing.assert_array_equal(*outliers_idx)
+    assert len(outliers_idx[0]) > 0
+
+
+def test_agreement():
+    x = strides(np.random.default_rng(2), n=300)
+    agreement = OutlierDetector(method='LOF', max_fit_strides=100).agreement(x=x)
+    assert set(agreement.keys()) == {'strides', 'exact_outliers', 'approximate_outliers', 'agreement', 'precision',
+                                     'recall', 'exact_seconds', 'approximate_seconds'}
+    assert agreement['strides'] == len(x)
+    assert 0. <= agreement['agreement'] <= 1.
+
+    # Fitted on all the strides, the approximate detection is the exact one
+    agreement = OutlierDetector(method='LOF', max_fit_strides=len(x)).agreement(x=x)
+    assert agreement['exact_outliers'] == agreement['approximate_outliers'] > 0
+    assert agreement['agreement'] == agreement['precision'] == agreement['recall'] == 1.
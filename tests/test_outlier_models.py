@@ -0,0 +1,102 @@
+import os
+import pytest
+import numpy as np
+
+from clean_dataset.data_cleaner import DataCleaner
+from clean_dataset.outlier_models import OutlierModels
+from data_management.data_loader import DataLoader
+from data_management.manifest import Manifest
+from normalize_dataset.normalize_dataset import NormalizeDataset
+from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+
+
+def strides(rng, n=200, outliers=10):
+    """
+    :return: n×50 strides, the first ones of them far from the others
+    """
+    x = np.sin(np.linspace(0, 2 * np.pi, 50))[None, :] + rng.normal(scale=0.1, size=(n, 50))
+    x[:outliers] += rng.normal(scale=3., size=(outliers, 50))
+
+    return x
+
+
+@pytest.mark.parametrize('method', ['iForest', 'LOF'])
+def test_saved_model_is_reloaded(tmp_path, method):
+    rng = np.random.default_rng(0)
+    x, new_x = strides(rng), strides(rng, n=50)
+    models = OutlierModels(path=str(tmp_path), method=method)
+    outliers_idx = models.detect_outliers('knee', 'walk', x=x, subjects=['AB01'])
+    assert len(outliers_idx) > 0
+
+    reloaded = OutlierModels(path=str(tmp_path), method=method)
+    assert reloaded.groups() == [('knee', 'walk')]
+    assert reloaded.get('knee', 'walk')['subjects'] == ['AB01']
+    # The training strides get the outliers found when fitting, also with LOF which scores its own training strides
+    # differently in novelty mode
+    np.testing.assert_array_equal(reloaded.detect_outliers('knee', 'walk', x=x), outliers_idx)
+    np.testing.assert_array_equal(reloaded.predict('knee', 'walk', x=new_x), models.predict('knee', 'walk', x=new_x))
+
+
+def test_changed_params_refit(tmp_path):
+    rng = np.random.default_rng(1)
+    x = strides(rng)
+    OutlierModels(path=str(tmp_path), method='iForest').detect_outliers('knee', 'walk', x=x)
+
+    models = OutlierModels(path=str(tmp_path), method='LOF')
+    assert models.get('knee', 'walk') is None
+    models.detect_outliers('knee', 'walk', x=x)
+    assert OutlierModels(path=str(tmp_path), method='LOF').get('knee', 'walk')['params'] == {'method': 'LOF'}
+
+
+def test_refit_replaces_model(tmp_path):
+    rng = np.random.default_rng(2)
+    x, new_x = strides(rng), strides(rng, n=120)
+    models = OutlierModels(path=str(tmp_path), method='LOF')
+    models.detect_outliers('knee', 'walk', x=x)
+
+    models.detect_outliers('knee', 'walk', x=new_x)
+    assert models.get('knee', 'walk')['data_hash'] == Manifest.data_hash(x)
+    models.detect_outliers('knee', 'walk', x=new_x, refit=True)
+    assert OutlierModels(path=str(tmp_path), method='LOF').get('knee', 'walk')['data_hash'] == Manifest.data_hash(new_x)
+
+
+@pytest.mark.parametrize('drift_threshold', [0.1, 1.])
+def test_drift_refits_model(tmp_path, drift_threshold):
+    rng = np.random.default_rng(3)
+    x = strides(rng, outliers=0)
+    models = OutlierModels(path=str(tmp_path), method='LOF', drift_threshold=drift_threshold)
+    models.detect_outliers('knee', 'walk', x=x)
+
+    # Every shifted stride is an outlier of the model, the outlier rate drifts by almost 1
+    shifted = x[:100] + 5.
+    assert len(models.predict('knee', 'walk', x=shifted)) == len(shifted)
+    models.detect_outliers('knee', 'walk', x=shifted)
+    refitted = OutlierModels(path=str(tmp_path), method='LOF').get('knee', 'walk')['strides'] == len(shifted)
+    assert refitted == (drift_threshold < 1.)
+
+
+def test_score_untrained_subject(raw_dataset, tmp_path):
+    base_path, subjects = raw_dataset
+    data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels', subjects=subjects)
+    source = str(tmp_path / 'normalized')
+    NormalizeDataset(data_loader=data_loader, samples=50, path=source).run()
+
+    models_path = str(tmp_path / 'models')
+    DataCleaner(base_path=source, data_loader=NormalizedDataLoader(source), outlier_method='LOF',
+                models_path=models_path).run_streaming(subjects=subjects[:2], base_folder=str(tmp_path / 'clean'))
+    models = {file: os.path.getmtime(os.path.join(models_path, file)) for file in os.listdir(models_path)}
+
+    normalized = NormalizedDataLoader(source)
+    scores = DataCleaner(base_path=source, data_loader=normalized, outlier_method='LOF',
+                         models_path=models_path).score_subjects(subjects=subjects[2:])
+    outlier_models = OutlierModels(path=models_path, method='LOF')
+    assert len(scores) > 0
+    assert sorted(scores.keys()) == sorted(entry for entry in normalized.select(subjects=subjects[2:])
+                                           if outlier_models.get(*entry[1:]) is not None)
+    for (subject, joint, activity), outliers in scores.items():
+        x = normalized.get_array(subject, joint, activity)
+        expected = np.zeros(len(x), dtype=bool)
+        expected[outlier_models.detector(outlier_models.get(joint, activity)).predict(x=x)] = True
+        np.testing.assert_array_equal(outliers, expected)
+    # Scoring does not fit or save any model
+    assert {file: os.path.getmtime(os.path.join(models_path, file)) for file in os.listdir(models_path)} == models
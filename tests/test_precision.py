@@ -0,0 +1,50 @@
+import numpy as np
+import pytest
+
+from normalize_dataset.precision import encode, decode
+
+
+def strides(rng):
+    return 40 * np.sin(np.linspace(0, 2 * np.pi, 50))[None, :, None] + rng.normal(scale=5, size=(30, 50, 3))
+
+
+def test_float16_round_trip():
+    data = strides(np.random.default_rng(0))
+    encoded, encoding = encode(data, 'float16')
+    decoded = decode(encoded, encoding)
+
+    assert encoded.dtype == np.float16 and decoded.dtype == np.float64
+    error = np.abs(decoded - data)
+    # Half of the spacing of float16 (11 significant bits) around every value
+    assert (error <= np.abs(data) * 2. ** -11).all()
+    assert encoding['error'] == error.max()
+
+
+def test_int16_round_trip():
+    data = strides(np.random.default_rng(1))
+    encoded, encoding = encode(data, 'int16')
+    decoded = decode(encoded, encoding)
+
+    assert encoded.dtype == np.int16 and decoded.dtype == np.float64
+    error = np.abs(decoded - data)
+    # Half of a quantization step, the step spanning the range of the data over 2 * 32767 codes
+    assert error.max() <= (data.max() - data.min()) / (2 * 32767) / 2 * (1 + 1e-9)
+    assert encoding['error'] == error.max()
+
+
+@pytest.mark.parametrize('precision', ['float32', 'float16', 'int16'])
+def test_nan_round_trip(precision):
+    data = np.array([[1., np.nan, 2.], [-3., 0.5, np.nan]])
+    encoded, encoding = encode(data, precision)
+    decoded = decode(encoded, encoding)
+
+    np.testing.assert_array_equal(np.isnan(decoded), np.isnan(data))
+    assert np.isfinite(encoding['error'])
+    assert np.abs(decoded - data)[~np.isnan(data)].max() == encoding['error']
+    if precision == 'int16':
+        assert encoding['offset'] == -0.5
+
+
+def test_int16_rejects_infinite_values():
+    with pytest.raises(ValueError):
+        encode(np.array([1., np.inf]), 'int16')
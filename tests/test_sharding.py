@@ -0,0 +1,93 @@
+import os
+import sys
+import pytest
+import subprocess
+import numpy as np
+
+from clean_dataset.data_cleaner import DataCleaner
+from data_management.data_loader import DataLoader
+from normalize_dataset.normalize_dataset import NormalizeDataset
+from normalize_dataset.normalized_data_loader import NormalizedDataLoader
+from normalize_dataset.sharding import Shard, merge_shards
+
+
+def read_output(path):
+    """
+    :return: Bytes of a store, or dictionary {relative path: bytes} with the files of a directory tree
+    """
+    if os.path.isfile(path):
+        with open(path, 'rb') as f:
+            return f.read()
+    files = dict()
+    for folder, _, names in os.walk(path):
+        for name in names:
+            with open(os.path.join(folder, name), 'rb') as f:
+                files[os.path.relpath(os.path.join(folder, name), path)] = f.read()
+
+    return files
+
+
+def normalize(raw_dataset, path, storage, shard=None):
+    base_path, subjects = raw_dataset
+    data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels', subjects=subjects)
+    NormalizeDataset(data_loader=data_loader, samples=50, path=path, storage=storage, shard=shard).run()
+
+
+def run_cli(*args):
+    """
+    Start cli.py in its own process, as every node of a sharded run does
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return subprocess.Popen([sys.executable, os.path.join(root, 'cli.py'), *args], cwd=root, stdout=subprocess.DEVNULL)
+
+
+def run_shards(command, source, path, storage, shards, *args):
+    """
+    Run the shards of a command in concurrent processes, then merge their partial outputs in another one
+    """
+    nodes = [run_cli(command, source, '--output', path, '--storage', storage, '--shards', str(shards),
+                     '--shard', str(index), *args) for index in range(shards)]
+    assert [node.wait() for node in nodes] == [0] * shards
+    assert run_cli('merge', path, '--shards', str(shards)).wait() == 0
+
+
+@pytest.mark.parametrize('storage', ['directory', 'store'])
+def test_sharded_run_matches_single_node(raw_dataset, tmp_path, storage):
+    single, sharded = str(tmp_path / 'single'), str(tmp_path / 'sharded')
+    normalize(raw_dataset, single, storage)
+    run_shards('normalize', raw_dataset[0], sharded, storage, 2, '--samples', '50')
+    assert read_output(sharded) == read_output(single)
+
+    # Cleaning, sharded by (joint, activity) group. Sharded runs clean group by group, so the merged output is the one
+    # of the streaming run, and has the strides of the whole-dataset run.
+    subjects = NormalizedDataLoader(single).subjects()
+    DataCleaner(base_path=single, data_loader=NormalizedDataLoader(single)).run_and_save(
+        subjects=subjects, base_folder=str(tmp_path / 'clean_single'), storage=storage)
+    DataCleaner(base_path=single, data_loader=NormalizedDataLoader(single)).run_streaming(
+        subjects=subjects, base_folder=str(tmp_path / 'clean_streaming'), storage=storage)
+    run_shards('clean', single, str(tmp_path / 'clean_sharded'), storage, 3, '--method', 'MCD')
+    assert read_output(str(tmp_path / 'clean_sharded')) == read_output(str(tmp_path / 'clean_streaming'))
+
+    clean_single, clean_sharded = (NormalizedDataLoader(str(tmp_path / name)) for name in ['clean_single',
+                                                                                             'clean_sharded'])
+    assert clean_sharded.select() == clean_single.select()
+    for key in clean_single.select():
+        np.testing.assert_array_equal(clean_sharded.get_array(*key), clean_single.get_array(*key))
+
+
+def test_merge_requires_every_shard(raw_dataset, tmp_path):
+    normalize(raw_dataset, str(tmp_path / 'sharded'), 'store', shard=Shard(0, 2))
+    with pytest.raises(ValueError, match="not complete"):
+        merge_shards(str(tmp_path / 'sharded'), 2)
+
+
+@pytest.mark.parametrize('storage', ['directory', 'store'])
+def test_more_shards_than_subjects(raw_dataset, tmp_path, storage):
+    base_path, subjects = raw_dataset
+    single, sharded = str(tmp_path / 'single'), str(tmp_path / 'sharded')
+    data_loader = DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels',
+                             subjects=subjects[:2])
+    NormalizeDataset(data_loader=data_loader, samples=50, path=single, storage=storage).run()
+    # The third shard has no subject to normalize
+    run_shards('normalize', base_path, sharded, storage, 3, '--samples', '50', '--subjects', *subjects[:2])
+    assert read_output(sharded) == read_output(single)
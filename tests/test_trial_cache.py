@@ -0,0 +1,124 @@
+import os
+import numpy as np
+
+from data_management.data_loader import DataLoader
+from data_management.trial_cache import TrialCache
+
+JOINTS = ['jRightKnee', 'jLeftKnee']
+
+
+def sources(path, name):
+    """
+    :return: Paths of a pair of data and label source files
+    """
+    paths = [os.path.join(path, f"{name}.mat"), os.path.join(path, f"{name}_labels.mat")]
+    for source in paths:
+        with open(source, 'wb') as f:
+            f.write(name.encode())
+
+    return paths
+
+
+def trial(rng, samples=100):
+    return {'joint_angle': rng.normal(size=(len(JOINTS), samples, 3)),
+            'labels': rng.integers(0, 5, size=(samples, 2)),
+            'sample_rate': 60}
+
+
+def test_key(tmp_path):
+    cache = TrialCache(str(tmp_path / 'cache'))
+    data_path, label_path = sources(str(tmp_path), 'AB01T01')
+    other_data_path, other_label_path = sources(str(tmp_path), 'AB01T02')
+
+    key = cache.key(data_path, label_path, JOINTS)
+    assert cache.key(data_path, label_path, list(JOINTS)) == key
+    assert cache.key(data_path, label_path, JOINTS[:1]) != key
+    assert cache.key(other_data_path, label_path, JOINTS) != key
+    assert cache.key(data_path, other_label_path, JOINTS) != key
+
+
+def test_round_trip(tmp_path):
+    cache = TrialCache(str(tmp_path / 'cache'))
+    data_path, label_path = sources(str(tmp_path), 'AB01T01')
+    rng = np.random.default_rng(0)
+    trial_data = trial(rng)
+    extra = {'Right_Shank': rng.normal(size=(100, 3)), 'Left_Shank': rng.normal(size=(100, 3))}
+
+    assert cache.get(data_path, label_path, JOINTS) is None
+    cache.put(data_path, label_path, JOINTS, extra=extra, **trial_data)
+    cached = cache.get(data_path, label_path, JOINTS)
+
+    np.testing.assert_array_equal(cached['joint_angle'], trial_data['joint_angle'])
+    np.testing.assert_array_equal(cached['labels'], trial_data['labels'])
+    assert cached['sample_rate'] == 60
+    assert list(cached['extra'].keys()) == list(extra.keys())
+    for name, channel_data in extra.items():
+        np.testing.assert_array_equal(cached['extra'][name], channel_data)
+    # Entries of other joints are not read
+    assert cache.get(data_path, label_path, JOINTS[:1]) is None
+
+
+def test_changed_sources_invalidate_entries(tmp_path):
+    cache = TrialCache(str(tmp_path / 'cache'))
+    data_path, label_path = sources(str(tmp_path), 'AB01T01')
+    rng = np.random.default_rng(1)
+    cache.put(data_path, label_path, JOINTS, **trial(rng))
+
+    # Same size, new modification time
+    stat = os.stat(label_path)
+    os.utime(label_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.get(data_path, label_path, JOINTS) is None
+
+    # New size
+    cache.put(data_path, label_path, JOINTS, **trial(rng))
+    with open(data_path, 'ab') as f:
+        f.write(b'0')
+    assert cache.get(data_path, label_path, JOINTS) is None
+
+    # The new entry of the trial replaces the stale ones
+    cache.put(data_path, label_path, JOINTS, **trial(rng))
+    assert len(cache.entries()) == 1
+    assert cache.get(data_path, label_path, JOINTS) is not None
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    rng = np.random.default_rng(2)
+    trials = {name: (sources(str(tmp_path), name), trial(rng)) for name in ['AB01T01', 'AB01T02', 'AB01T03']}
+    cache = TrialCache(str(tmp_path / 'cache'))
+    for name in ['AB01T01', 'AB01T02']:
+        (data_path, label_path), trial_data = trials[name]
+        cache.put(data_path, label_path, JOINTS, **trial_data)
+    entry_size = cache.size() // 2
+
+    # AB01T01 was put first, but read after AB01T02
+    entry_paths = {name: os.path.join(cache.cache_path, cache.key(*trials[name][0], JOINTS))
+                   for name in ['AB01T01', 'AB01T02']}
+    os.utime(entry_paths['AB01T01'], (1, 1))
+    os.utime(entry_paths['AB01T02'], (2, 2))
+    assert cache.get(*trials['AB01T01'][0], JOINTS) is not None
+
+    cache.max_size = 2 * entry_size
+    (data_path, label_path), trial_data = trials['AB01T03']
+    cache.put(data_path, label_path, JOINTS, **trial_data)
+    assert cache.size() <= cache.max_size
+    assert cache.get(*trials['AB01T02'][0], JOINTS) is None
+    assert cache.get(*trials['AB01T01'][0], JOINTS) is not None
+    assert cache.get(*trials['AB01T03'][0], JOINTS) is not None
+
+
+def test_cached_subject_matches_uncached(raw_dataset, tmp_path):
+    base_path, subjects = raw_dataset
+
+    def data_loader(cache):
+        return DataLoader(base_path=base_path, data_folder='kin_data', labels_folder='labels', subjects=subjects,
+                          cache=cache)
+
+    cache = TrialCache(str(tmp_path / 'cache'))
+    uncached = data_loader(None).get_subject(idx=0)
+    # The first run fills the cache, the second one reads every trial from it
+    for _ in range(2):
+        cached = data_loader(cache).get_subject(idx=0)
+        assert list(cached.keys()) == list(uncached.keys())
+        for name in uncached:
+            np.testing.assert_array_equal(cached[name], uncached[name])
+    assert len(cache.entries()) == len(data_loader(cache).subject_files(idx=0))
@@ -0,0 +1,89 @@
+import numpy as np
+import pytest
+
+from scipy.io import savemat
+
+from benchmarks.synthetic_dataset import label_cell
+from data_management.categorical import activity_vocabulary, gait_event_vocabulary
+from data_management.trial_loader import TrialLabelsLoader, event_labels, gait_event_labels
+
+
+def baseline_labels(loader):
+    """
+    Per-sample labeling loop of the original TrialLabelsLoader.get_labels
+    """
+    labels = []
+    index = np.unique(loader.index)
+    for i in range(loader.length_data):
+        flag = False
+        label_gait_event = None
+        label_event = None
+        for j in range(len(index) - 1):
+            if i < index[0] or i > index[-1]:
+                label_gait_event = gait_event_labels['None']
+                label_event = event_labels['None']
+            elif index[j] <= i < index[j + 1]:
+                for k in range(len(loader.unlabeled_index)):
+                    if i in loader.unlabeled_index[k]:
+                        flag = True
+                if flag is False:
+                    label_gait_event = gait_event_labels[loader.labels_info[index[j]]['gait_event']]
+                    label_event = event_labels[loader.labels_info[index[j]]['event']]
+                else:
+                    label_gait_event = gait_event_labels['None']
+                    label_event = event_labels['None']
+            elif index[-2] <= i <= index[-1]:
+                label_gait_event = gait_event_labels[loader.labels_info[index[-1]]['gait_event']]
+                label_event = event_labels[loader.labels_info[index[-1]]['event']]
+
+        labels.append([label_event, label_gait_event])
+
+    return np.array(labels)
+
+
+def random_gait_cycles(rng, cycles):
+    """
+    :return: cycles×5 array of gait events, consecutive cycles sharing their heel strike, adjacent or separated by a
+     gap, and the terrain event of every cycle
+    """
+    index, position = list(), int(rng.integers(0, 20))
+    for _ in range(cycles):
+        phases = np.sort(rng.integers(0, 30, size=4))
+        index.append(np.concatenate([[position], position + 1 + phases]))
+        position = int(index[-1][-1]) + int(rng.choice([0, 1, rng.integers(2, 15)]))
+
+    return np.array(index, dtype=np.int32).reshape(-1, 5), list(rng.choice(list(event_labels.keys()), size=cycles))
+
+
+def write_labels(path, index, labels):
+    savemat(path, {'gc': {'label': label_cell(labels), 'index': index, 'time': index / 60.}})
+
+
+@pytest.mark.parametrize('seed', range(40))
+def test_labels_match_baseline(tmp_path, seed):
+    rng = np.random.default_rng(seed)
+    index, labels = random_gait_cycles(rng, cycles=int(rng.integers(1, 10)))
+    if seed % 4 == 1:
+        # Cycles out of order
+        order = rng.permutation(len(index))
+        index, labels = index[order], [labels[i] for i in order]
+    length_data = int(rng.integers(1, index.max() + 30))
+    write_labels(str(tmp_path / 'gc.mat'), index, labels)
+
+    loader = TrialLabelsLoader(str(tmp_path / 'gc.mat'), length_data=length_data)
+    expected = baseline_labels(loader)
+    np.testing.assert_array_equal(loader.get_labels(), expected)
+    np.testing.assert_array_equal(loader.get_label_codes(),
+                                  np.column_stack([activity_vocabulary.encode(expected[:, 0]),
+                                                   gait_event_vocabulary.encode(expected[:, 1])]))
+
+
+@pytest.mark.parametrize('index', [np.zeros((0, 5)), np.full((1, 5), 12), np.full((1, 5), 30)])
+def test_labels_without_gait_cycles(tmp_path, index):
+    write_labels(str(tmp_path / 'gc.mat'), index.astype(np.int32), ['RA'] * len(index))
+    loader = TrialLabelsLoader(str(tmp_path / 'gc.mat'), length_data=20)
+
+    # The baseline loop leaves every sample None, get_labels labels them 'none' like the gaps between cycles
+    assert (baseline_labels(loader) == None).all()  # noqa: E711
+    assert (loader.get_labels() == 'none').all()
+    assert (loader.get_label_codes() == 0).all()